@@ -1,111 +1,477 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, jsonify, send_file, session
+from spotipy.oauth2 import SpotifyClientCredentials
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
+from markupsafe import Markup
 import database
+import jobs
+import maintenance
+import metrics
+import spotify_auth
+import spotify_client
+import spotify_sync
+import base64
+import functools
+import hashlib
+import itertools
+import json
 import os
 import tempfile
+import time
+import zlib
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "spotify-manager-secret")
 
-# Spotify API setup
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+# Spotify API setup; both clients share the rate limit in spotify_client
+sp = spotify_client.create(auth_manager=SpotifyClientCredentials(
     client_id=os.getenv("SPOTIPY_CLIENT_ID"),
     client_secret=os.getenv("SPOTIPY_CLIENT_SECRET")
 ))
 
-# Spotify OAuth setup for user authentication
-def get_spotify_oauth():
-    return SpotifyOAuth(
-        client_id=os.getenv("SPOTIPY_CLIENT_ID"),
-        client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
-        redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI", "http://localhost:5000/callback"),
-        scope="user-follow-read user-library-read"
-    )
+REQUESTS = metrics.Counter("http_requests_total", "HTTP requests by route, method and status")
+REQUEST_SECONDS = metrics.Histogram("http_request_duration_seconds", "Time to build the response by route and method")
+SYNC_ITEMS = metrics.Counter("sync_items_total", "Library rows written or removed by Spotify sync jobs")
+
+@app.before_request
+def start_request_timer():
+    """Time the request for /metrics; the first request starts this worker's metrics flush thread."""
+    metrics.start(database.add_metric_samples)
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and the time taken by route template, method and status.
+    
+    Streamed bodies (exports, NDJSON, SSE) are still being sent at this
+    point, so for them this is the time to the first byte.
+    """
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, method=request.method)
+        REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+    return response
+
+@app.before_request
+def start_maintenance():
+    """Start the periodic maintenance tasks in the worker serving this request, if any are enabled."""
+    maintenance.start()
+
+@app.before_request
+def move_session_token():
+    """Move tokens of sessions from before tokens were stored server-side out of the cookie."""
+    if 'token_info' in session:
+        session['spotify_token_key'] = spotify_auth.store_token(session.pop('token_info'))
 
 def get_user_spotify():
-    """Get authenticated Spotify client for current user."""
-    token_info = session.get('token_info')
-    if not token_info:
+    """Get the logged in user's Spotify client; tokens and clients live server-side."""
+    key = session.get('spotify_token_key')
+    return spotify_auth.get_client(key) if key else None
+
+def extract_spotify_info(url, use_cache=True):
+    """Extract info from a Spotify URL or spotify: URI."""
+    try:
+        kind, item_id = spotify_sync.parse_spotify_url(url) or (None, None)
+        # Only web links are kept as the item URL; URIs use the one Spotify returns
+        link = url if "://" in url else None
+        
+        if kind == "album":
+            album = spotify_sync.get_album(sp, item_id, use_cache)
+            artist = spotify_sync.get_artist(sp, album["artists"][0]["id"], use_cache)
+            return spotify_sync.build_album_info(album, artist, url=link)
+        elif kind == "track":
+            track = spotify_sync.get_track(sp, item_id, use_cache)
+            artist = spotify_sync.get_artist(sp, track["artists"][0]["id"], use_cache)
+            return spotify_sync.build_track_info(track, artist, url=link)
+    except Exception:
+        return None
+
+def encode_cursor(cursor):
+    """Encode a keyset cursor tuple as an opaque URL-safe token."""
+    if cursor is None:
         return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+CURSOR_VALUE_TYPES = (str, int, float, type(None))
+
+def decode_cursor(token, length=5):
+    """Decode a cursor token; raises ValueError when it is malformed."""
+    if not token:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(cursor, list) or len(cursor) != length:
+        raise ValueError("Invalid cursor")
+    # Cursor values are bound straight into the keyset query, so only scalars
+    if any(isinstance(value, bool) or not isinstance(value, CURSOR_VALUE_TYPES) for value in cursor):
+        raise ValueError("Invalid cursor")
+    return tuple(cursor)
+
+BROWSE_TYPES = ("all", "album", "track")
+DEFAULT_PAGE_SIZE = int(os.getenv("BROWSE_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = 1000
+
+def get_browse_page():
+    """Read browse paging arguments from the request and fetch the page."""
+    filter_type = request.args.get("type", "all")
+    if filter_type not in BROWSE_TYPES:
+        raise ValueError(f"Invalid type: {filter_type}")
     
-    spotify_oauth = get_spotify_oauth()
-    if spotify_oauth.is_token_expired(token_info):
-        token_info = spotify_oauth.refresh_access_token(token_info['refresh_token'])
-        session['token_info'] = token_info
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
     
-    return spotipy.Spotify(auth=token_info['access_token'])
+    cursor = decode_cursor(request.args.get("cursor"))
+    
+    genre = request.args.get("genre") or None
+    items, next_cursor = database.get_items_page(filter_type, after=cursor, limit=limit, genre=genre)
+    return filter_type, genre, limit, items, encode_cursor(next_cursor)
 
-def extract_spotify_info(url):
-    """Extract info from Spotify URL."""
-    try:
-        item_id = url.split("/")[-1].split("?")[0]
+
+def describe_counts(counts, label):
+    """Summarise bulk upsert counts, e.g. '120 saved albums (5 new, 2 updated)'."""
+    total = counts["inserted"] + counts["updated"] + counts["unchanged"]
+    summary = f"{total} {label} ({counts['inserted']} new, {counts['updated']} updated"
+    if counts.get("removed"):
+        summary += f", {counts['removed']} removed"
+    return summary + ")"
+
+def request_flag(name):
+    """Whether a boolean request argument or form field is set."""
+    return (request.values.get(name) or "").lower() in ("1", "true", "yes", "on")
+
+def wants_refresh():
+    """Whether the request asked to bypass the metadata cache."""
+    return request_flag("refresh")
+
+def get_spotify_user_id(user_sp):
+    """Get the logged in user's Spotify ID, remembered in the session."""
+    if 'spotify_user_id' not in session:
+        session['spotify_user_id'] = user_sp.current_user()["id"]
+    return session['spotify_user_id']
+
+def sync_options(user_sp):
+    """Options for saved album/track syncs; full=1 forces a full resync that also detects removals."""
+    return {
+        "use_cache": not wants_refresh(),
+        "user_id": get_spotify_user_id(user_sp),
+        "full": request_flag("full")
+    }
+
+# Changes with every deploy so cached pages rendered by old templates are dropped
+TEMPLATES_VERSION = str(max(
+    os.path.getmtime(os.path.join(root, name))
+    for folder in ("templates", "static") for root, _, names in os.walk(os.path.join(app.root_path, folder))
+    for name in names
+))
+
+def versioned(view):
+    """Tag a read-only view's response with a strong ETag and answer If-None-Match with 304.
+    
+    The ETag covers the database change version, the full request URL and the
+    login state shown in the page, so it changes whenever the response could.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pending flash messages are shown once, so that page can't be reused
+        if session.get('_flashes'):
+            return view(*args, **kwargs)
         
-        def build_artist_info(artist_data):
-            return {
-                "artist_id": artist_data["id"],
-                "artist_name": artist_data["name"],
-                "genres": artist_data["genres"],
-                "uri": artist_data["uri"],
-                "external_urls": artist_data["external_urls"]
-            }
+        key = f"{database.get_change_version()}|{request.full_path}|{'spotify_token_key' in session}|{TEMPLATES_VERSION}"
+        etag = hashlib.sha1(key.encode()).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
         
-        if "/album/" in url:
-            album = sp.album(item_id)
-            artist = sp.artist(album["artists"][0]["id"])
-            return {
-                "type": "album",
-                "album_id": album["id"],
-                "artist_id": album["artists"][0]["id"],
-                "album_name": album["name"],
-                "artist_name": album["artists"][0]["name"],
-                "release_year": int(album["release_date"].split("-")[0]),
-                "album_uri": album["uri"],
-                "url": url,
-                "artist_info": build_artist_info(artist)
-            }
-        elif "/track/" in url:
-            track = sp.track(item_id)
-            artist = sp.artist(track["artists"][0]["id"])
-            return {
-                "type": "track",
-                "track_id": track["id"],
-                "artist_id": track["artists"][0]["id"],
-                "album_id": track["album"]["id"],
-                "track_name": track["name"],
-                "artist_name": track["artists"][0]["name"],
-                "release_year": int(track["album"]["release_date"].split("-")[0]),
-                "track_uri": track["uri"],
-                "url": url,
-                "artist_info": build_artist_info(artist)
-            }
-    except Exception:
-        return None
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.vary.add("Cookie")
+        return response
+    return wrapper
 
+def cached_fragment(name, render):
+    """Return render()'s HTML, reusing the copy cached for this URL and database change version.
+    
+    Fragments must depend only on the database and the request URL, not on
+    the session; writes bump the change version and drop them.
+    """
+    if not database.FRAGMENT_CACHE_ENABLED:
+        return Markup(render())
+    
+    version = database.get_change_version()
+    key = f"{name}|{request.full_path}|{TEMPLATES_VERSION}"
+    body = database.fragment_get(key, version)
+    if body is None:
+        body = render()
+        database.fragment_put(key, version, body)
+    return Markup(body)
 
 @app.route("/")
+@versioned
 def index():
-    return render_template("index.html")
+    return render_template("index.html", stats=database.get_stats(top=1))
 
 @app.route("/browse")
+@versioned
 def browse():
-    """Browse all items with optional filtering."""
-    filter_type = request.args.get("type", "all")
-    items = database.get_all_items()
+    """Browse items in a virtual list that loads its rows from /api/items."""
+    def render():
+        filter_type = request.args.get("type", "all")
+        if filter_type not in BROWSE_TYPES:
+            raise ValueError(f"Invalid type: {filter_type}")
+        
+        search_text = request.args.get("search", "").strip()
+        genre = request.args.get("genre") or None
+        if search_text:
+            # Full-text results are few enough to embed in the page
+            items = database.search_items(search_text, filter_type, limit=MAX_PAGE_SIZE, genre=genre)
+            return render_template(
+                "browse_content.html",
+                items=items,
+                filter_type=filter_type,
+                total_count=len(items),
+                search_text=search_text,
+                genre=genre
+            )
+        
+        return render_template(
+            "browse_content.html",
+            items=None,
+            filter_type=filter_type,
+            total_count=database.count_items(filter_type, genre),
+            search_text="",
+            genre=genre
+        )
+    
+    try:
+        content = cached_fragment("browse", render)
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("browse"))
+    return render_template("browse.html", content=content)
+
+@app.route("/api/browse")
+@versioned
+def api_browse():
+    """JSON version of /browse with the same paging arguments."""
+    try:
+        filter_type, genre, limit, items, next_cursor = get_browse_page()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    for item in items:
+        item.pop("sort_key", None)
+    return jsonify({"type": filter_type, "genre": genre, "items": items, "next_cursor": next_cursor})
+
+# Columns the list APIs can return; artist names and genres repeat across rows,
+# so the columnar format sends each distinct value once in a string table
+ITEM_FIELDS = ("type", "id", "name", "artist_id", "artist_name", "release_year", "genres", "uri", "url")
+ARTIST_FIELDS = ("id", "name", "genres", "uri", "url", "added")
+SHARED_STRING_FIELDS = ("artist_name", "genres")
+LIST_FORMATS = ("json", "columnar", "ndjson")
+MAX_LIST_PAGE_SIZE = 10000
+STREAM_PAGE_SIZE = 1000
+
+def split_genres(genres):
+    return genres.split(", ") if genres else []
+
+def get_list_fields(allowed):
+    """Read the comma separated ``fields`` argument, defaulting to every field."""
+    fields = request.args.get("fields")
+    if not fields:
+        return allowed
+    fields = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in allowed]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(allowed)}")
+    return fields
+
+def project_row(row, fields):
+    return {f: split_genres(row[f]) if f == "genres" else row[f] for f in fields}
+
+def to_columnar(rows, fields):
+    """Turn rows into one array per field, with shared strings replaced by table indexes."""
+    columns = {f: [] for f in fields}
+    strings = {f: [] for f in fields if f in SHARED_STRING_FIELDS}
+    indexes = {f: {} for f in strings}
+    
+    def intern(field, value):
+        index = indexes[field]
+        if value not in index:
+            index[value] = len(strings[field])
+            strings[field].append(value)
+        return index[value]
+    
+    for row in rows:
+        for f in fields:
+            value = row[f]
+            if f == "genres":
+                value = [intern(f, genre) for genre in split_genres(value)]
+            elif f in strings and value is not None:
+                value = intern(f, value)
+            columns[f].append(value)
+    return {"fields": list(fields), "count": len(rows), "columns": columns, "strings": strings}
+
+def list_response(fetch_page, allowed_fields, cursor_length):
+    """Serve a keyset paged list as JSON rows, columnar JSON or streamed NDJSON.
+    
+    ``fetch_page(after, limit)`` returns ``(rows, next_cursor)``. NDJSON streams
+    every row after the cursor (up to ``limit`` when given) one object per line.
+    """
+    try:
+        fields = get_list_fields(allowed_fields)
+        output = request.args.get("format", "json")
+        if output not in LIST_FORMATS:
+            raise ValueError(f"Invalid format: {output}")
+        after = decode_cursor(request.args.get("cursor"), cursor_length)
+        limit = request.args.get("limit", type=int)
+        if limit is not None:
+            limit = max(1, min(limit, MAX_LIST_PAGE_SIZE)) if output != "ndjson" else max(1, limit)
+        
+        if output == "ndjson":
+            # The first page is read up front so bad arguments still get a 400
+            size = STREAM_PAGE_SIZE if limit is None else min(STREAM_PAGE_SIZE, limit)
+            rows, next_cursor = fetch_page(after, size)
+            
+            def generate(rows, after, remaining):
+                while True:
+                    for row in rows:
+                        yield json.dumps(project_row(row, fields)) + "\n"
+                    if remaining is not None:
+                        remaining -= len(rows)
+                    if not after or remaining == 0:
+                        break
+                    size = STREAM_PAGE_SIZE if remaining is None else min(STREAM_PAGE_SIZE, remaining)
+                    rows, after = fetch_page(after, size)
+            return Response(generate(rows, next_cursor, limit), mimetype="application/x-ndjson")
+        
+        rows, next_cursor = fetch_page(after, limit or DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if output == "columnar":
+        body = to_columnar(rows, fields)
+    else:
+        body = {"items": [project_row(row, fields) for row in rows]}
+    body["next_cursor"] = encode_cursor(next_cursor)
+    return jsonify(body)
+
+@app.route("/api/items")
+@versioned
+def api_items():
+    """Albums and tracks with field selection, type/genre filters and compact formats."""
+    item_type = request.args.get("type", "all")
+    if item_type not in BROWSE_TYPES:
+        return jsonify({"error": f"Invalid type: {item_type}"}), 400
+    genre = request.args.get("genre") or None
+    
+    def fetch_page(after, limit):
+        return database.get_items_page(item_type, after=after, limit=limit, genre=genre)
+    
+    return list_response(fetch_page, ITEM_FIELDS, 5)
+
+@app.route("/api/artists")
+@versioned
+def api_artists():
+    """Artists by name with field selection, a genre filter and compact formats."""
+    genre = request.args.get("genre") or None
+    
+    def fetch_page(after, limit):
+        return database.get_artists_page(genre, after=after, limit=limit)
     
-    if filter_type != "all":
-        items = [item for item in items if item["type"] == filter_type]
+    return list_response(fetch_page, ARTIST_FIELDS, 2)
+
+@app.route("/api/genres")
+@versioned
+def api_genres():
+    """Genre facet: how many artists, albums or tracks carry each genre."""
+    item_type = request.args.get("type", "artist")
+    if item_type not in ("artist", "album", "track"):
+        return jsonify({"error": f"Invalid type: {item_type}"}), 400
+    return jsonify({"type": item_type, "genres": database.get_genre_counts(item_type)})
+
+@app.route("/api/search")
+@versioned
+def api_search():
+    """Full-text search with prefix matching, ranked best match first."""
+    query = request.args.get("q", "").strip()
+    item_type = request.args.get("type", "all")
+    if item_type not in ("all", "artist", "album", "track"):
+        return jsonify({"error": f"Invalid type: {item_type}"}), 400
     
-    return render_template("browse.html", items=items, filter_type=filter_type)
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    results = database.search(query, item_type, limit)
+    return jsonify({"query": query, **results})
+
+@app.route("/api/stats")
+@versioned
+def api_stats():
+    """Library totals and breakdowns from the incrementally maintained counters."""
+    top = max(1, min(request.args.get("top", 10, type=int), 100))
+    return jsonify(database.get_stats(top))
+
+@app.route("/api/spotify-metrics")
+def api_spotify_metrics():
+    """Spotify API calls, errors, 429s, coalesced calls and latency per client method, from the shared metrics."""
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    metrics.flush()
+    return jsonify({
+        "rate_limit": spotify_client.SPOTIFY_RATE_LIMIT,
+        "burst": spotify_client.SPOTIFY_BURST,
+        "endpoints": spotify_client.get_call_stats(database.get_metric_samples())
+    })
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request, SQL, Spotify API, job and sync metrics of all workers in the Prometheus text format."""
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    # This worker's latest counts; other workers flush every METRICS_FLUSH_SECONDS
+    metrics.flush()
+    return Response(metrics.render(database.get_metric_samples()), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/cache", methods=["GET", "DELETE"])
+def api_cache():
+    """Show metadata cache counters, or clear the cache with DELETE."""
+    if request.method == "DELETE":
+        database.clear_metadata_cache()
+    return jsonify(database.get_cache_stats())
 
 @app.route("/artists")
+@versioned
 def artists():
-    artists_list = database.get_artists()
-    return render_template("artists.html", artists=artists_list)
+    def render():
+        genre = request.args.get("genre") or None
+        return render_template(
+            "artists_content.html",
+            artist_count=database.count_artists(genre),
+            genres=database.get_genre_counts("artist"),
+            selected_genre=genre
+        )
+    
+    return render_template("artists.html", content=cached_fragment("artists", render))
+
+def add_expanded(kind, item_id):
+    """Import a playlist's tracks or an artist's albums as a background job."""
+    # Private playlists can only be read with the logged in user's token
+    client = get_user_spotify() or sp
+    use_cache = not wants_refresh()
+    if kind == "playlist":
+        step = ("playlist tracks", lambda progress: spotify_sync.import_playlist(client, item_id, use_cache, progress))
+    else:
+        step = ("artist albums", lambda progress: spotify_sync.import_artist_albums(client, item_id, use_cache, progress))
+    
+    try:
+        return start_sync_job(f"add-{kind}", step[0], [step])
+    except Exception as e:
+        return jsonify({"error": f"Error adding {kind}: {str(e)}"}), 500
 
 @app.route("/add", methods=["POST"])
 def add_item():
@@ -114,26 +480,56 @@ def add_item():
     if not url:
         return jsonify({"error": "No URL provided"}), 400
     
-    info = extract_spotify_info(url)
+    kind, item_id = spotify_sync.parse_spotify_url(url) or (None, None)
+    if kind in spotify_sync.EXPANDED_KINDS:
+        return add_expanded(kind, item_id)
+    
+    info = extract_spotify_info(url, use_cache=not wants_refresh())
     if not info:
         return jsonify({"error": "Invalid Spotify URL or API error"}), 400
     
     try:
-        # Add artist first
-        database.add_artist(info["artist_info"])
+        # The artist and the item go in one transaction, so a concurrent
+        # cleanup can't remove the artist in between
+        database.add_items([info])
         
-        # Add album or track
         if info["type"] == "album":
-            database.add_album(info)
             message = f"Album '{info['album_name']}' added successfully"
         else:
-            database.add_track(info)
             message = f"Track '{info['track_name']}' added successfully"
         
         return jsonify({"success": message})
     except Exception as e:
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+MAX_BULK_URLS = int(os.getenv("MAX_BULK_URLS", "1000"))
+
+@app.route("/add/bulk", methods=["POST"])
+def add_bulk():
+    """Add many URLs or URIs at once, sent as JSON {"urls": [...]} or one per line in a form field."""
+    if request.is_json:
+        urls = (request.get_json(silent=True) or {}).get("urls") or []
+    else:
+        urls = (request.form.get("spotify_urls") or "").split()
+    urls = [url.strip() for url in urls if isinstance(url, str) and url.strip()]
+    
+    if not urls:
+        return jsonify({"error": "No URLs provided"}), 400
+    if len(urls) > MAX_BULK_URLS:
+        return jsonify({"error": f"Too many URLs, the limit is {MAX_BULK_URLS}"}), 400
+    
+    try:
+        results, counts = spotify_sync.add_urls(sp, urls, use_cache=not wants_refresh())
+    except Exception as e:
+        return jsonify({"error": f"Bulk add failed: {str(e)}"}), 500
+    
+    added = sum(1 for result in results if result["ok"])
+    return jsonify({
+        "success": f"Added {added} of {len(results)} items",
+        "results": results,
+        "counts": counts
+    })
+
 @app.route("/delete/<item_type>/<item_id>", methods=["POST"])
 def delete_item(item_type, item_id):
     """Delete item via AJAX."""
@@ -143,15 +539,60 @@ def delete_item(item_type, item_id):
     except Exception as e:
         return jsonify({"error": f"Error deleting {item_type}: {str(e)}"}), 500
 
-@app.route("/export")
+def export_job_path(job_id):
+    """Where a background export job writes its CSV file."""
+    return os.path.join(tempfile.gettempdir(), f"spotify_export_{job_id}.csv")
+
+def run_export_job(progress):
+    """Background job: export the database to a file for /jobs/<id>/download."""
+    database.export_database_csv(export_job_path(progress.job_id), progress)
+    return {"message": "Export ready", "download_url": f"/jobs/{progress.job_id}/download"}
+
+def run_import_job(progress, import_file):
+    """Background job: import an uploaded CSV file, then delete it."""
+    try:
+        report = database.import_database_csv(import_file, progress)
+    finally:
+        os.remove(import_file)
+    
+    tables = ", ".join(
+        f"{counts['accepted']} {table}" + (f" ({counts['rejected']} rejected)" if counts["rejected"] else "")
+        for table, counts in report["tables"].items()
+    )
+    return {
+        "message": f"Imported {tables or 'nothing'} in {report['seconds']}s ({report['rows_per_second']} rows/s)",
+        "report": report
+    }
+
+def gzip_stream(chunks):
+    """Gzip-compress a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route("/export", methods=["GET", "POST"])
 def export_database():
-    """Export database to CSV file."""
+    """Stream the database as CSV (gzip=1 compresses it); POST runs the export as a background job."""
+    if request.method == "POST":
+        job_id = jobs.submit("export", run_export_job)
+        return jsonify({"success": "Export started", "job_id": job_id}), 202
+    
     try:
-        export_file = database.export_database_csv()
-        return send_file(export_file, as_attachment=True, mimetype="text/csv", download_name="spotify_backup.csv")
+        chunks = database.iter_database_csv()
+        # Read the first chunk now so errors can still be reported with a redirect
+        chunks = itertools.chain([next(chunks)], chunks)
     except Exception as e:
         flash(f"Error exporting database: {str(e)}", "error")
         return redirect(url_for("index"))
+    
+    if request_flag("gzip"):
+        body, mimetype, download_name = gzip_stream(chunks), "application/gzip", "spotify_backup.csv.gz"
+    else:
+        body, mimetype, download_name = (chunk.encode("utf-8") for chunk in chunks), "text/csv", "spotify_backup.csv"
+    return Response(body, mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={download_name}"})
 
 @app.route("/import", methods=["GET", "POST"])
 def import_database():
@@ -163,34 +604,70 @@ def import_database():
             return redirect(url_for("import_database"))
         
         try:
-            filename = secure_filename(file.filename)
-            temp_path = os.path.join(tempfile.gettempdir(), filename)
+            # A unique file per upload, removed by the job once imported
+            fd, temp_path = tempfile.mkstemp(prefix="spotify_import_", suffix=".csv")
+            os.close(fd)
             file.save(temp_path)
             
-            database.import_database_csv(temp_path)
-            os.remove(temp_path)
-            
-            flash("Database imported successfully!", "success")
-            return redirect(url_for("browse"))
+            job_id = jobs.submit("import", run_import_job, temp_path)
+            return redirect(url_for("import_database", job=job_id))
         except Exception as e:
             flash(f"Error importing database: {str(e)}", "error")
     
-    return render_template("import.html")
+    return render_template("import.html", job_id=request.args.get("job"))
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Current state of a background job."""
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Stream a background job's progress as Server-Sent Events."""
+    return Response(
+        jobs.stream_events(job_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    """Download the file produced by a finished export job."""
+    job = jobs.get_job(job_id)
+    export_file = export_job_path(job_id)
+    if not job or job["kind"] != "export" or job["status"] != "done" or not os.path.exists(export_file):
+        flash("Export not found or not finished", "error")
+        return redirect(url_for("index"))
+    
+    # The open handle keeps the data readable while the response is sent
+    export = open(export_file, "rb")
+    os.remove(export_file)
+    return send_file(export, as_attachment=True, mimetype="text/csv", download_name="spotify_backup.csv")
 
 @app.route("/download_sqlite")
 def download_sqlite():
-    """Download SQLite database file."""
+    """Download a snapshot of the SQLite database, with ETag and range request support."""
     try:
-        return send_file(database.DB_PATH, as_attachment=True, mimetype="application/x-sqlite3", download_name="spotify_manager.db")
+        version = database.get_change_version()
+        # Snapshots never change, so interrupted downloads can resume with Range
+        return send_file(
+            database.get_snapshot(version), as_attachment=True, mimetype="application/x-sqlite3",
+            download_name="spotify_manager.db", conditional=True, etag=f"db-{version}"
+        )
     except Exception as e:
         flash(f"Error downloading database: {str(e)}", "error")
         return redirect(url_for("index"))
 
 @app.route("/cleanup", methods=["POST"])
 def cleanup():
-    """Clean up unused artists."""
+    """Clean up unused artists, unless a sync or import is writing."""
     try:
-        removed_count = database.cleanup_unused_artists()
+        removed_count = database.sweep_unused_artists()
+        if removed_count is None:
+            return jsonify({"error": "A sync or import is running; try the cleanup again once it finishes"}), 409
         return jsonify({"success": f"Removed {removed_count} unused artists"})
     except Exception as e:
         return jsonify({"error": f"Error during cleanup: {str(e)}"}), 500
@@ -198,20 +675,23 @@ def cleanup():
 @app.route("/login")
 def login():
     """Initiate Spotify OAuth login."""
-    spotify_oauth = get_spotify_oauth()
-    auth_url = spotify_oauth.get_authorize_url()
+    auth_url = spotify_auth.get_oauth().get_authorize_url()
     return redirect(auth_url)
 
 @app.route("/callback")
 def callback():
     """Handle Spotify OAuth callback."""
-    spotify_oauth = get_spotify_oauth()
     code = request.args.get('code')
     
     if code:
         try:
-            token_info = spotify_oauth.get_access_token(code)
-            session['token_info'] = token_info
+            token_info = spotify_auth.get_oauth().get_access_token(code, check_cache=False)
+            old_key = session.pop('spotify_token_key', None)
+            if old_key:
+                spotify_auth.forget(old_key)
+            session['spotify_token_key'] = spotify_auth.store_token(token_info)
+            session.pop('token_info', None)
+            session.pop('spotify_user_id', None)
             flash("Successfully connected to Spotify!", "success")
         except Exception as e:
             flash(f"Failed to connect to Spotify: {str(e)}", "error")
@@ -223,276 +703,124 @@ def callback():
 @app.route("/logout")
 def logout():
     """Logout and clear Spotify session."""
+    key = session.pop('spotify_token_key', None)
+    if key:
+        spotify_auth.forget(key)
     session.pop('token_info', None)
+    session.pop('spotify_user_id', None)
     flash("Logged out from Spotify", "success")
     return redirect(url_for("index"))
 
+def start_sync_job(kind, label, steps):
+    """Run sync steps as one background job and return the 202 response.
+    
+    ``steps`` are (label, function) pairs; each function gets a progress
+    callback and returns bulk upsert counts.
+    """
+    def run(progress):
+        counts = {}
+        for step_label, step in steps:
+            def report(**counters):
+                progress(step=step_label, **counters)
+            counts[step_label] = step(report)
+            for result in ("inserted", "updated", "removed"):
+                SYNC_ITEMS.inc(counts[step_label].get(result, 0), sync=kind, step=step_label, result=result)
+        summary = ", ".join(describe_counts(c, step_label) for step_label, c in counts.items())
+        return {"message": f"Synced {summary} from Spotify", "counts": counts}
+    
+    job_id = jobs.submit(kind, run)
+    return jsonify({"success": f"Syncing {label} from Spotify...", "job_id": job_id}), 202
+
 @app.route("/sync-followed-artists", methods=["POST"])
 def sync_followed_artists():
-    """Sync user's followed artists from Spotify."""
+    """Sync user's followed artists from Spotify in the background."""
     user_sp = get_user_spotify()
     if not user_sp:
         return jsonify({"error": "Please login with Spotify first"}), 401
     
     try:
-        added_count = 0
-        results = user_sp.current_user_followed_artists(limit=50)
-        
-        while results:
-            for artist in results['artists']['items']:
-                # Build artist info structure
-                artist_info = {
-                    "artist_id": artist["id"],
-                    "artist_name": artist["name"],
-                    "genres": artist["genres"],
-                    "uri": artist["uri"],
-                    "external_urls": artist["external_urls"]
-                }
-                
-                # Add to database (will skip if already exists)
-                try:
-                    database.add_artist(artist_info)
-                    added_count += 1
-                except Exception:
-                    # Artist might already exist, continue
-                    pass
-            
-            # Get next page if available
-            if results['artists']['next']:
-                results = user_sp.next(results['artists'])
-            else:
-                break
-        
-        return jsonify({"success": f"Synced {added_count} followed artists from Spotify"})
-    
+        user_id = get_spotify_user_id(user_sp)
+        return start_sync_job("sync-followed-artists", "followed artists", [
+            ("followed artists", lambda progress: spotify_sync.sync_followed_artists(user_sp, progress=progress, user_id=user_id)),
+        ])
     except Exception as e:
         return jsonify({"error": f"Error syncing artists: {str(e)}"}), 500
 
 @app.route("/sync-saved-albums", methods=["POST"])
 def sync_saved_albums():
-    """Sync user's saved albums from Spotify."""
+    """Sync user's saved albums from Spotify in the background."""
     user_sp = get_user_spotify()
     if not user_sp:
         return jsonify({"error": "Please login with Spotify first"}), 401
     
     try:
-        added_count = 0
-        results = user_sp.current_user_saved_albums(limit=50)
-        
-        while results:
-            for item in results['items']:
-                album = item['album']
-                # Get artist details for genres
-                artist = sp.artist(album["artists"][0]["id"])
-                
-                # Build album info structure
-                album_info = {
-                    "type": "album",
-                    "album_id": album["id"],
-                    "artist_id": album["artists"][0]["id"],
-                    "album_name": album["name"],
-                    "artist_name": album["artists"][0]["name"],
-                    "release_year": int(album["release_date"].split("-")[0]),
-                    "album_uri": album["uri"],
-                    "url": album["external_urls"]["spotify"],
-                    "artist_info": {
-                        "artist_id": artist["id"],
-                        "artist_name": artist["name"],
-                        "genres": artist["genres"],
-                        "uri": artist["uri"],
-                        "external_urls": artist["external_urls"]
-                    }
-                }
-                
-                try:
-                    # Add artist first
-                    database.add_artist(album_info["artist_info"])
-                    # Add album
-                    database.add_album(album_info)
-                    added_count += 1
-                except Exception:
-                    # Album might already exist, continue
-                    pass
-            
-            # Get next page if available
-            if results['next']:
-                results = user_sp.next(results)
-            else:
-                break
-        
-        return jsonify({"success": f"Synced {added_count} saved albums from Spotify"})
-    
+        options = sync_options(user_sp)
+        return start_sync_job("sync-saved-albums", "saved albums", [
+            ("saved albums", lambda progress: spotify_sync.sync_saved_albums(user_sp, sp, progress=progress, **options)),
+        ])
     except Exception as e:
         return jsonify({"error": f"Error syncing albums: {str(e)}"}), 500
 
 @app.route("/sync-saved-tracks", methods=["POST"])
 def sync_saved_tracks():
-    """Sync user's saved tracks from Spotify."""
+    """Sync user's saved tracks from Spotify in the background."""
     user_sp = get_user_spotify()
     if not user_sp:
         return jsonify({"error": "Please login with Spotify first"}), 401
     
     try:
-        added_count = 0
-        results = user_sp.current_user_saved_tracks(limit=50)
-        
-        while results:
-            for item in results['items']:
-                track = item['track']
-                # Get artist details for genres
-                artist = sp.artist(track["artists"][0]["id"])
-                
-                # Build track info structure
-                track_info = {
-                    "type": "track",
-                    "track_id": track["id"],
-                    "artist_id": track["artists"][0]["id"],
-                    "album_id": track["album"]["id"],
-                    "track_name": track["name"],
-                    "artist_name": track["artists"][0]["name"],
-                    "release_year": int(track["album"]["release_date"].split("-")[0]),
-                    "track_uri": track["uri"],
-                    "url": track["external_urls"]["spotify"],
-                    "artist_info": {
-                        "artist_id": artist["id"],
-                        "artist_name": artist["name"],
-                        "genres": artist["genres"],
-                        "uri": artist["uri"],
-                        "external_urls": artist["external_urls"]
-                    }
-                }
-                
-                try:
-                    # Add artist first
-                    database.add_artist(track_info["artist_info"])
-                    # Add track
-                    database.add_track(track_info)
-                    added_count += 1
-                except Exception:
-                    # Track might already exist, continue
-                    pass
-            
-            # Get next page if available
-            if results['next']:
-                results = user_sp.next(results)
-            else:
-                break
-        
-        return jsonify({"success": f"Synced {added_count} saved tracks from Spotify"})
-    
+        options = sync_options(user_sp)
+        return start_sync_job("sync-saved-tracks", "saved tracks", [
+            ("saved tracks", lambda progress: spotify_sync.sync_saved_tracks(user_sp, sp, progress=progress, **options)),
+        ])
     except Exception as e:
         return jsonify({"error": f"Error syncing tracks: {str(e)}"}), 500
 
 @app.route("/sync-all-spotify", methods=["POST"])
 def sync_all_spotify():
-    """Sync all user's Spotify data (artists, albums, tracks)."""
+    """Sync all user's Spotify data (artists, albums, tracks) in the background."""
     user_sp = get_user_spotify()
     if not user_sp:
         return jsonify({"error": "Please login with Spotify first"}), 401
     
     try:
-        total_artists = 0
-        total_albums = 0
-        total_tracks = 0
-        
-        # Sync followed artists
-        results = user_sp.current_user_followed_artists(limit=50)
-        while results:
-            for artist in results['artists']['items']:
-                artist_info = {
-                    "artist_id": artist["id"],
-                    "artist_name": artist["name"],
-                    "genres": artist["genres"],
-                    "uri": artist["uri"],
-                    "external_urls": artist["external_urls"]
-                }
-                try:
-                    database.add_artist(artist_info)
-                    total_artists += 1
-                except Exception:
-                    pass
-            if results['artists']['next']:
-                results = user_sp.next(results['artists'])
-            else:
-                break
-        
-        # Sync saved albums
-        results = user_sp.current_user_saved_albums(limit=50)
-        while results:
-            for item in results['items']:
-                album = item['album']
-                artist = sp.artist(album["artists"][0]["id"])
-                album_info = {
-                    "type": "album",
-                    "album_id": album["id"],
-                    "artist_id": album["artists"][0]["id"],
-                    "album_name": album["name"],
-                    "artist_name": album["artists"][0]["name"],
-                    "release_year": int(album["release_date"].split("-")[0]),
-                    "album_uri": album["uri"],
-                    "url": album["external_urls"]["spotify"],
-                    "artist_info": {
-                        "artist_id": artist["id"],
-                        "artist_name": artist["name"],
-                        "genres": artist["genres"],
-                        "uri": artist["uri"],
-                        "external_urls": artist["external_urls"]
-                    }
-                }
-                try:
-                    database.add_artist(album_info["artist_info"])
-                    database.add_album(album_info)
-                    total_albums += 1
-                except Exception:
-                    pass
-            if results['next']:
-                results = user_sp.next(results)
-            else:
-                break
-        
-        # Sync saved tracks
-        results = user_sp.current_user_saved_tracks(limit=50)
-        while results:
-            for item in results['items']:
-                track = item['track']
-                artist = sp.artist(track["artists"][0]["id"])
-                track_info = {
-                    "type": "track",
-                    "track_id": track["id"],
-                    "artist_id": track["artists"][0]["id"],
-                    "album_id": track["album"]["id"],
-                    "track_name": track["name"],
-                    "artist_name": track["artists"][0]["name"],
-                    "release_year": int(track["album"]["release_date"].split("-")[0]),
-                    "track_uri": track["uri"],
-                    "url": track["external_urls"]["spotify"],
-                    "artist_info": {
-                        "artist_id": artist["id"],
-                        "artist_name": artist["name"],
-                        "genres": artist["genres"],
-                        "uri": artist["uri"],
-                        "external_urls": artist["external_urls"]
-                    }
-                }
-                try:
-                    database.add_artist(track_info["artist_info"])
-                    database.add_track(track_info)
-                    total_tracks += 1
-                except Exception:
-                    pass
-            if results['next']:
-                results = user_sp.next(results)
-            else:
-                break
-        
-        return jsonify({
-            "success": f"Full sync complete! Added {total_artists} artists, {total_albums} albums, {total_tracks} tracks"
-        })
-    
+        options = sync_options(user_sp)
+        return start_sync_job("sync-all-spotify", "all your data", [
+            ("artists", lambda progress: spotify_sync.sync_followed_artists(user_sp, progress=progress, user_id=options["user_id"])),
+            ("albums", lambda progress: spotify_sync.sync_saved_albums(user_sp, sp, progress=progress, **options)),
+            ("tracks", lambda progress: spotify_sync.sync_saved_tracks(user_sp, sp, progress=progress, **options)),
+        ])
     except Exception as e:
         return jsonify({"error": f"Error during full sync: {str(e)}"}), 500
 
 
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild the full-text search index from the library tables."""
+    database.rebuild_search_index()
+    print("Search index rebuilt")
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations and show the schema version."""
+    applied = database.create_tables()
+    for name in applied:
+        print(f"Applied migration: {name}")
+    print(f"Schema version {database.get_schema_version()}")
+
+@app.cli.command("analyze")
+def analyze_command():
+    """Refresh the query planner statistics with a full ANALYZE."""
+    database.optimize_database(full=True)
+    print("Planner statistics refreshed")
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the library statistics counters from the library tables."""
+    database.rebuild_stats()
+    print("Library statistics rebuilt")
+
+
 if __name__ == "__main__":
     database.DB_PATH = os.environ.get("DATABASE", "spotify_manager.db")
     database.create_tables()
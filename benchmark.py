@@ -0,0 +1,361 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+# app creates its client-credentials client at import, which needs these set
+os.environ.setdefault("SPOTIPY_CLIENT_ID", "benchmark")
+os.environ.setdefault("SPOTIPY_CLIENT_SECRET", "benchmark")
+
+import database
+import jobs
+import maintenance
+import spotify_auth
+import spotify_client
+import spotify_sync
+from fake_spotify import Catalog, FakeSpotify
+
+def timed(func, repeat):
+    """Call func repeat times. Returns timings in milliseconds and the last result."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return times, result
+
+def summarize(times):
+    """first/min/median/p95/max of a list of milliseconds."""
+    ordered = sorted(times)
+    return {
+        "runs": len(times),
+        "first_ms": round(times[0], 3),
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+def generate_library(catalog):
+    """Store a Catalog in the current database the way syncs do. Returns the seconds taken."""
+    start = time.perf_counter()
+    artists = {artist["id"]: artist for artist in catalog.artists}
+    database.add_artists(spotify_sync.build_artist_info(artist) for artist in catalog.artists)
+    database.add_albums(spotify_sync.build_album_info(album, artists[album["artists"][0]["id"]])
+                        for album in catalog.albums)
+    database.add_tracks(spotify_sync.build_track_info(track, artists[track["artists"][0]["id"]])
+                        for track in catalog.tracks)
+    return time.perf_counter() - start
+
+def wait_for_job(job_id, timeout=3600):
+    """Poll a background job until it finishes. Returns its result; raises if it failed."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs.get_job(job_id)
+        if job["status"] in jobs.FINISHED:
+            if job["status"] == "failed":
+                raise RuntimeError(f"Job {job_id} failed: {job['error']}")
+            return job["result"]
+        time.sleep(0.01)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
+
+class Runner:
+    """Runs named benchmarks, skipping those not matching --only, and collects results."""
+
+    def __init__(self, repeat, only=None):
+        self.repeat = repeat
+        self.only = re.compile(only) if only else None
+        self.results = {}
+
+    def run(self, name, func, repeat=None, before=None, requests=None):
+        """Time func; before() runs ahead of every call, untimed (e.g. to clear a cache).
+
+        ``requests()`` returns a running count of Spotify requests; the median
+        made per call is recorded as ``requests``.
+        """
+        if self.only and not self.only.search(name):
+            return None
+        times, counts, result = [], [], None
+        for _ in range(repeat or self.repeat):
+            if before:
+                before()
+            made = requests() if requests else 0
+            run_times, result = timed(func, 1)
+            times += run_times
+            if requests:
+                counts.append(requests() - made)
+        self.results[name] = summarize(times)
+        line = f"  {name:<48} median {self.results[name]['median_ms']:>10.2f} ms"
+        if requests:
+            self.results[name]["requests"] = statistics.median(counts)
+            line += f"  {self.results[name]['requests']:>8g} requests"
+        print(line, file=sys.stderr)
+        return result
+
+def get_route(client, path, **kwargs):
+    """GET a route through the test client, reading streamed bodies to the end."""
+    def call():
+        response = client.get(path, **kwargs)
+        body = response.get_data()
+        if response.status_code >= 400:
+            raise RuntimeError(f"GET {path} returned {response.status_code}")
+        return len(body)
+    return call
+
+def run_job_route(client, path, form=None):
+    """POST a route that starts a background job and wait for the job to finish.
+
+    ``form`` builds the multipart form data, fresh for every call since
+    uploaded files are read once.
+    """
+    def call():
+        response = client.post(path, data=form() if form else None)
+        if response.status_code == 202:
+            job_id = response.get_json()["job_id"]
+        elif response.status_code == 302:
+            job_id = parse_qs(urlparse(response.location).query)["job"][0]
+        else:
+            raise RuntimeError(f"POST {path} returned {response.status_code}: {response.get_data(as_text=True)}")
+        return wait_for_job(job_id)
+    return call
+
+def benchmark_database(runner, catalog):
+    """Time the database functions behind the pages, APIs, export, import and cleanup."""
+    genre = catalog.artists[0]["genres"][0] if catalog.artists and catalog.artists[0]["genres"] else "rock"
+    word = catalog.tracks[0]["name"].split()[0] if catalog.tracks else "Blue"
+
+    runner.run("db.get_all_items", database.get_all_items)
+    runner.run("db.get_items_page", lambda: database.get_items_page(limit=50))
+    runner.run("db.get_items_page[genre]", lambda: database.get_items_page(limit=50, genre=genre))
+    runner.run("db.get_artists", database.get_artists)
+    runner.run("db.get_artists_page", lambda: database.get_artists_page(limit=50))
+    runner.run("db.count_items", database.count_items)
+    runner.run("db.count_items[genre]", lambda: database.count_items(genre=genre))
+    runner.run("db.get_genre_counts", database.get_genre_counts)
+    runner.run("db.get_stats", database.get_stats)
+    runner.run("db.search", lambda: database.search(word))
+    runner.run("db.search_items", lambda: database.search_items(word))
+    runner.run("db.iter_database_csv", lambda: sum(len(chunk) for chunk in database.iter_database_csv()))
+
+    export_file = os.path.join(os.path.dirname(database.DB_PATH), "benchmark_export.csv")
+    database.export_database_csv(export_file)
+    runner.run("db.import_database_csv", lambda: database.import_database_csv(export_file))
+    os.remove(export_file)
+
+    runner.run("db.rebuild_stats", database.rebuild_stats)
+    runner.run("db.rebuild_search_index", database.rebuild_search_index, repeat=1)
+    runner.run("db.optimize_database", database.optimize_database, repeat=1)
+
+def benchmark_routes(runner, client, catalog):
+    """Time the page, API and download routes, cold (fragment cache cleared) and warm."""
+    genre = catalog.artists[0]["genres"][0] if catalog.artists and catalog.artists[0]["genres"] else "rock"
+    word = catalog.tracks[0]["name"].split()[0] if catalog.tracks else "Blue"
+    routes = {
+        "/": "/",
+        "/browse": "/browse",
+        "/browse?type=track": "/browse?type=track",
+        "/browse?genre": f"/browse?genre={genre}",
+        "/browse?search": f"/browse?search={word}",
+        "/artists": "/artists",
+        "/api/items[json]": "/api/items?limit=1000",
+        "/api/items[columnar]": "/api/items?format=columnar&limit=10000",
+        "/api/items[ndjson]": "/api/items?format=ndjson",
+        "/api/artists[columnar]": "/api/artists?format=columnar&limit=10000",
+        "/api/search": f"/api/search?q={word}",
+        "/api/stats": "/api/stats",
+        "/api/genres": "/api/genres",
+        "/metrics": "/metrics",
+    }
+    for name, path in routes.items():
+        runner.run(f"GET {name} [cold]", get_route(client, path), before=database.clear_fragment_cache)
+        runner.run(f"GET {name} [warm]", get_route(client, path))
+
+    runner.run("GET /export", get_route(client, "/export"))
+    runner.run("GET /export?gzip", get_route(client, "/export?gzip=1"))
+    runner.run("GET /download_sqlite", get_route(client, "/download_sqlite"))
+    runner.run("POST /export [job]", run_job_route(client, "/export"))
+
+    export = client.get("/export").get_data()
+    runner.run("POST /import [job]", run_job_route(
+        client, "/import", lambda: {"file": (io.BytesIO(export), "backup.csv")}
+    ))
+
+def benchmark_syncs(runner, client, fake):
+    """Time the /sync-* routes against the fake Spotify API: a full sync into new rows, then incremental ones.
+
+    Each result also records the Spotify requests the sync made, since an
+    incremental sync should need only a page or two whatever the library size.
+    """
+    def requests():
+        return fake.requests
+
+    for route in ("/sync-followed-artists", "/sync-saved-albums", "/sync-saved-tracks"):
+        runner.run(f"POST {route} [full]", run_job_route(client, f"{route}?full=1"), repeat=1,
+                   before=database.clear_metadata_cache, requests=requests)
+        runner.run(f"POST {route} [incremental]", run_job_route(client, route), requests=requests)
+    runner.run("POST /sync-all-spotify [incremental]", run_job_route(client, "/sync-all-spotify"), requests=requests)
+
+def benchmark_cleanup(runner):
+    """Time deleting the artists nothing references; runs last since it changes the library."""
+    runner.run("db.cleanup_unused_artists", database.cleanup_unused_artists, repeat=1)
+
+def login(client):
+    """Log the test client in as the fake Spotify user with a long-lived stored token."""
+    key = spotify_auth.store_token({
+        "access_token": "benchmark",
+        "refresh_token": "benchmark",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "expires_at": int(time.time()) + 365 * 24 * 3600,
+        "scope": "user-follow-read user-library-read",
+    })
+    with client.session_transaction() as session:
+        session["spotify_token_key"] = key
+        session["spotify_user_id"] = "bench-user"
+
+def run_benchmarks(args):
+    """Build the synthetic library, start the fake API and run every benchmark. Returns the results document."""
+    workdir = tempfile.mkdtemp(prefix="spotify_benchmark_")
+    database.DB_PATH = args.database or os.path.join(workdir, "benchmark.db")
+    spotify_client.SPOTIFY_RATE_LIMIT = args.rate_limit
+    # Periodic optimize/ANALYZE runs would land in the middle of timings
+    maintenance.TASKS = {}
+    # spotipy logs every injected 429 before the client retries it
+    logging.getLogger("spotipy").setLevel(logging.CRITICAL)
+
+    import app as app_module
+
+    try:
+        if os.path.exists(database.DB_PATH):
+            os.remove(database.DB_PATH)
+        database.create_tables()
+
+        print(f"Generating {args.artists} artists, {args.albums} albums, {args.tracks} tracks, "
+              f"{args.genres} genres in {database.DB_PATH}", file=sys.stderr)
+        catalog = Catalog(args.artists, args.albums, args.tracks, args.genres, seed=args.seed)
+        generate_seconds = generate_library(catalog)
+        database.optimize_database(full=True)
+
+        # The user's Spotify library: a smaller catalog of items not in the database yet
+        fraction = args.sync_fraction
+        sync_catalog = Catalog(max(1, int(args.artists * fraction)), max(1, int(args.albums * fraction)),
+                               max(1, int(args.tracks * fraction)), args.genres, seed=args.seed + 1, prefix="sync")
+        fake = FakeSpotify(sync_catalog, latency=args.latency / 1000, rate_429=args.rate_429,
+                           retry_after=args.retry_after, seed=args.seed)
+
+        runner = Runner(args.repeat, args.only)
+        with fake:
+            spotify_client.SPOTIFY_API_URL = fake.url
+            app_module.sp = spotify_client.create(auth="benchmark")
+            client = app_module.app.test_client()
+            login(client)
+
+            print("Database functions", file=sys.stderr)
+            benchmark_database(runner, catalog)
+            print("Routes", file=sys.stderr)
+            benchmark_routes(runner, client, catalog)
+            if not args.skip_sync:
+                print("Syncs", file=sys.stderr)
+                benchmark_syncs(runner, client, fake)
+            benchmark_cleanup(runner)
+
+        return {
+            "meta": {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "library": {"artists": args.artists, "albums": args.albums, "tracks": args.tracks,
+                            "genres": args.genres, "seed": args.seed},
+                "sync_library": {"artists": len(sync_catalog.artists), "albums": len(sync_catalog.albums),
+                                 "tracks": len(sync_catalog.tracks)},
+                "fake_spotify": {"latency_ms": args.latency, "rate_429": args.rate_429,
+                                 "retry_after": args.retry_after, "requests": fake.requests,
+                                 "throttled": fake.throttled},
+                "rate_limit": args.rate_limit,
+                "repeat": args.repeat,
+                "generate_seconds": round(generate_seconds, 3),
+                "database_bytes": os.path.getsize(database.DB_PATH),
+            },
+            "results": runner.results,
+        }
+    finally:
+        database.close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(baseline, current, threshold, min_ms=1.0):
+    """Compare median timings. Returns (rows, regressions) where each row is (name, old, new, ratio).
+
+    A benchmark regressed when its median grew by more than the threshold
+    ratio and by at least min_ms, so sub-millisecond noise is ignored.
+    """
+    rows, regressions = [], []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        old_ms, new_ms = old["median_ms"], result["median_ms"]
+        ratio = new_ms / old_ms if old_ms else float("inf")
+        rows.append((name, old_ms, new_ms, ratio))
+        if ratio > threshold and new_ms - old_ms >= min_ms:
+            regressions.append(name)
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark routes and database functions on a synthetic library.")
+    parser.add_argument("--artists", type=int, default=2000)
+    parser.add_argument("--albums", type=int, default=10000)
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--genres", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark (default 5)")
+    parser.add_argument("--only", help="only run benchmarks whose name matches this regex")
+    parser.add_argument("--database", help="build the library here instead of a temporary file (it is replaced)")
+    parser.add_argument("--sync-fraction", type=float, default=0.1,
+                        help="size of the fake Spotify library relative to the database (default 0.1)")
+    parser.add_argument("--skip-sync", action="store_true", help="skip the /sync-* benchmarks")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Spotify latency per request in ms")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of fake Spotify requests answered 429")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="SPOTIFY_RATE_LIMIT during the run, 0 disables it (default 0)")
+    parser.add_argument("--output", help="write the results JSON here instead of stdout")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="median ratio above which a benchmark counts as a regression (default 1.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline, results, args.threshold)
+        print(f"\n{'benchmark':<48} {'baseline':>10} {'current':>10} {'ratio':>7}", file=sys.stderr)
+        for name, old_ms, new_ms, ratio in rows:
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:<48} {old_ms:>10.2f} {new_ms:>10.2f} {ratio:>7.2f}{flag}", file=sys.stderr)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold}x", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,79 +1,879 @@
 import sqlite3
 import os
+import atexit
+import threading
+import re
+import json
+import logging
+import time
+from collections import Counter
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: migrations are not serialized across processes
+    fcntl = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "spotify_manager.db")
 
-def get_connection():
-    """Return a new database connection with row factory set."""
-    conn = sqlite3.connect(DB_PATH)
+# Connection tuning, applied to every pooled connection (see sqlite.org/pragma.html)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+# Statements slower than this many milliseconds are logged; 0 turns the log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+QUERY_SECONDS = metrics.Histogram(
+    "db_query_duration_seconds", "SQL statement execution time by operation and main table"
+)
+ROWS_WRITTEN = metrics.Counter("db_rows_written_total", "Library rows inserted or updated by bulk upserts")
+_slow_query_log = logging.getLogger("spotify_manager.slow_queries")
+_migration_log = logging.getLogger("spotify_manager.migrations")
+
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|ON)\s+(\w+)", re.IGNORECASE)
+_statement_labels = {}
+
+def _statement_label(sql):
+    """(operation, table) of a statement, e.g. ('SELECT', 'Albums'), kept to a small set of labels."""
+    label = _statement_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        table = _STATEMENT_TABLE.search(sql)
+        label = (words[0].upper() if words else "", table.group(1) if table else "")
+        # Statements with a variable number of placeholders are all distinct
+        if len(_statement_labels) > 1000:
+            _statement_labels.clear()
+        _statement_labels[sql] = label
+    return label
+
+def _record_query(sql, seconds):
+    operation, table = _statement_label(sql)
+    QUERY_SECONDS.observe(seconds, operation=operation, table=table)
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        _slow_query_log.warning("Slow query (%.1f ms): %s", seconds * 1000, " ".join(sql.split())[:1000])
+
+class _TimedConnection(sqlite3.Connection):
+    """Connection that times every statement for /metrics and the slow query log.
+    
+    The time covers preparing the statement and stepping it to its first row,
+    which is all of the work for writes and aggregates; fetching further rows
+    of a large SELECT isn't included.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - start, operation="SCRIPT", table="")
+
+# One connection per thread, reused across requests; keyed by thread so
+# connections of finished threads can be closed
+_connections = {}
+_connections_lock = threading.Lock()
+
+def _connect():
+    """Open a connection to DB_PATH with the configured pragmas."""
+    timed = metrics.METRICS_ENABLED or SLOW_QUERY_MS > 0
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT / 1000, check_same_thread=False,
+                           factory=_TimedConnection if timed else sqlite3.Connection)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}")
+    # In WAL mode readers never wait for a writer, so a sync doesn't block /browse
+    conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    # INSERT OR REPLACE deletes the old row; delete triggers (which keep the
+    # search index in sync) only fire for it with recursive triggers enabled.
+    conn.execute("PRAGMA recursive_triggers = ON")
+    # Deleting an artist deletes their albums and tracks, see _add_cascade_deletes
+    conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
-def create_tables():
-    """Creates simplified database schema."""
-    with get_connection() as conn:
-        conn.executescript('''
-            CREATE TABLE IF NOT EXISTS Artists (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                genres TEXT,
-                uri TEXT,
-                url TEXT
+def get_connection():
+    """Return this thread's pooled database connection with row factory set."""
+    thread = threading.current_thread()
+    conn, path, pid = _connections.get(thread, (None, None, None))
+    # Reconnect when DB_PATH was changed or we are in a forked worker
+    if conn is None or path != DB_PATH or pid != os.getpid():
+        conn = _connect()
+        with _connections_lock:
+            # The main thread reports itself stopped while atexit handlers (which
+            # may still use its connection) run; close_connections closes it then
+            stale_threads = [
+                t for t in _connections
+                if t is thread or (not t.is_alive() and t is not threading.main_thread())
+            ]
+            for other in stale_threads:
+                stale, _, stale_pid = _connections.pop(other)
+                if stale_pid == os.getpid():
+                    stale.close()
+            _connections[thread] = (conn, DB_PATH, os.getpid())
+    return conn
+
+def close_connections():
+    """Close the pooled connections of this thread and of finished threads. Runs at interpreter exit.
+    
+    Connections of threads still running, such as daemon threads at exit,
+    are left to the process: closing one mid-statement would crash it.
+    """
+    current = threading.current_thread()
+    with _connections_lock:
+        for thread in [t for t in _connections if t is current or not t.is_alive()]:
+            conn, _, pid = _connections.pop(thread)
+            if pid == os.getpid():
+                conn.close()
+
+atexit.register(close_connections)
+
+# Full-text search tables, one per source table, indexed from the source rows
+SEARCH_TABLES = {
+    "ArtistsSearch": ("Artists", ["name", "genres"]),
+    "AlbumsSearch": ("Albums", ["name"]),
+    "TracksSearch": ("Tracks", ["name"]),
+}
+
+def _create_search_tables(conn):
+    """Create FTS5 tables and the triggers keeping them in sync. Returns True if newly created."""
+    existing = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    created = False
+    
+    for search_table, (table, columns) in SEARCH_TABLES.items():
+        if search_table not in existing:
+            created = True
+        cols = ", ".join(columns)
+        new_cols = ", ".join(f"new.{c}" for c in columns)
+        old_cols = ", ".join(f"old.{c}" for c in columns)
+        conn.executescript(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {search_table} USING fts5(
+                {cols}, content='{table}', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
             );
             
-            CREATE TABLE IF NOT EXISTS Albums (
-                id TEXT PRIMARY KEY,
-                artist_id TEXT NOT NULL,
-                name TEXT NOT NULL,
-                release_year INTEGER,
-                uri TEXT,
-                url TEXT,
-                FOREIGN KEY (artist_id) REFERENCES Artists(id)
-            );
+            CREATE TRIGGER IF NOT EXISTS {search_table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {search_table}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+            END;
             
-            CREATE TABLE IF NOT EXISTS Tracks (
-                id TEXT PRIMARY KEY,
-                artist_id TEXT NOT NULL,
-                album_id TEXT NOT NULL,
-                name TEXT NOT NULL,
-                release_year INTEGER,
-                uri TEXT,
-                url TEXT,
-                FOREIGN KEY (artist_id) REFERENCES Artists(id)
-            );
+            CREATE TRIGGER IF NOT EXISTS {search_table}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {search_table}({search_table}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+            END;
             
-            CREATE INDEX IF NOT EXISTS idx_albums_artist ON Albums(artist_id);
-            CREATE INDEX IF NOT EXISTS idx_tracks_artist ON Tracks(artist_id);
+            CREATE TRIGGER IF NOT EXISTS {search_table}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {search_table}({search_table}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+                INSERT INTO {search_table}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+            END;
         ''')
+    return created
 
-def add_artist(artist_info):
-    """Insert or update artist with genres as comma-separated string."""
+def _genres_of(row, table=None):
+    """SELECT of (artist id, genre) pairs from an artist's ", "-joined genres string.
+    
+    ``row`` is "new" inside triggers or a table name with ``table`` set to it.
+    The string is turned into a JSON array so json_each can do the splitting:
+    json_quote escapes quotes, backslashes and control characters, and each
+    ", " separator becomes the end of one string and the start of the next.
+    """
+    source = f"{table}, " if table else ""
+    return f"""
+        SELECT {row}.id, trim(g.value)
+        FROM {source}json_each('[' || replace(json_quote(COALESCE({row}.genres, '')), ', ', '", "') || ']') g
+        WHERE trim(g.value) != ''
+    """
+
+def _create_genre_index(conn):
+    """Create the ArtistGenres table and its sync triggers. Returns True if newly created."""
+    created = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ArtistGenres'").fetchone()
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS ArtistGenres (
+            artist_id TEXT NOT NULL,
+            genre TEXT NOT NULL,
+            PRIMARY KEY (artist_id, genre)
+        ) WITHOUT ROWID;
+        
+        CREATE INDEX IF NOT EXISTS idx_artist_genres_genre ON ArtistGenres(genre, artist_id);
+        
+        CREATE TRIGGER IF NOT EXISTS artist_genres_ai AFTER INSERT ON Artists BEGIN
+            INSERT OR IGNORE INTO ArtistGenres (artist_id, genre) {_genres_of("new")};
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS artist_genres_au AFTER UPDATE OF id, genres ON Artists BEGIN
+            DELETE FROM ArtistGenres WHERE artist_id = old.id;
+            INSERT OR IGNORE INTO ArtistGenres (artist_id, genre) {_genres_of("new")};
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS artist_genres_ad AFTER DELETE ON Artists BEGIN
+            DELETE FROM ArtistGenres WHERE artist_id = old.id;
+        END;
+    ''')
+    return created
+
+# Library statistics kept up to date by triggers, so /api/stats never scans.
+# Scopes: "total" (key ""), "artist" (artist id), "decade" (e.g. "1990", "" when
+# unknown) and "genre"; kind is what is counted: artist, album or track.
+STAT_SCOPES = ("total", "artist", "decade", "genre")
+
+def _bump(scope, key, kind, delta):
+    """SQL adding delta to one LibraryStats counter and dropping it when it reaches 0."""
+    sql = f"""
+        INSERT INTO LibraryStats (scope, key, kind, count) VALUES ('{scope}', {key}, '{kind}', {delta})
+        ON CONFLICT (scope, key, kind) DO UPDATE SET count = count + excluded.count;
+    """
+    if delta.lstrip().startswith("-"):
+        sql += f"DELETE FROM LibraryStats WHERE scope = '{scope}' AND key = {key} AND kind = '{kind}' AND count <= 0;"
+    return sql
+
+def _bump_genres(artist_id, kind, delta):
+    """SQL adding delta to the counters of every genre of one artist."""
+    return f"""
+        INSERT INTO LibraryStats (scope, key, kind, count)
+        SELECT 'genre', genre, '{kind}', {delta} FROM ArtistGenres WHERE artist_id = {artist_id}
+        ON CONFLICT (scope, key, kind) DO UPDATE SET count = count + excluded.count;
+        DELETE FROM LibraryStats WHERE scope = 'genre' AND kind = '{kind}' AND count <= 0;
+    """
+
+def _decade(row):
+    """SQL for the decade key of an album or track row."""
+    return f"COALESCE(CAST({row}.release_year / 10 * 10 AS TEXT), '')"
+
+def _create_stats_tables(conn):
+    """Create LibraryStats and the triggers maintaining it. Returns True if newly created."""
+    created = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'LibraryStats'").fetchone()
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS LibraryStats (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (scope, key, kind)
+        ) WITHOUT ROWID;
+        
+        CREATE INDEX IF NOT EXISTS idx_library_stats_count ON LibraryStats(scope, kind, count DESC, key);
+        
+        CREATE TRIGGER IF NOT EXISTS library_stats_artists_ai AFTER INSERT ON Artists BEGIN
+            {_bump("total", "''", "artist", "1")}
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS library_stats_artists_ad AFTER DELETE ON Artists BEGIN
+            {_bump("total", "''", "artist", "-1")}
+        END;
+        
+        -- Genre counters of albums and tracks follow the artist's genres
+        CREATE TRIGGER IF NOT EXISTS library_stats_genres_ai AFTER INSERT ON ArtistGenres BEGIN
+            {_bump("genre", "new.genre", "artist", "1")}
+            INSERT INTO LibraryStats (scope, key, kind, count)
+            SELECT 'genre', new.genre, kind, count FROM LibraryStats WHERE scope = 'artist' AND key = new.artist_id
+            ON CONFLICT (scope, key, kind) DO UPDATE SET count = count + excluded.count;
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS library_stats_genres_ad AFTER DELETE ON ArtistGenres BEGIN
+            {_bump("genre", "old.genre", "artist", "-1")}
+            UPDATE LibraryStats SET count = count - COALESCE((
+                SELECT a.count FROM LibraryStats a WHERE a.scope = 'artist' AND a.key = old.artist_id AND a.kind = LibraryStats.kind
+            ), 0) WHERE scope = 'genre' AND key = old.genre;
+            DELETE FROM LibraryStats WHERE scope = 'genre' AND key = old.genre AND count <= 0;
+        END;
+    ''')
+    for table, kind in (("Albums", "album"), ("Tracks", "track")):
+        conn.executescript(f'''
+            CREATE TRIGGER IF NOT EXISTS library_stats_{table.lower()}_ai AFTER INSERT ON {table} BEGIN
+                {_bump("total", "''", kind, "1")}
+                {_bump("artist", "new.artist_id", kind, "1")}
+                {_bump("decade", _decade("new"), kind, "1")}
+                {_bump_genres("new.artist_id", kind, "1")}
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS library_stats_{table.lower()}_ad AFTER DELETE ON {table} BEGIN
+                {_bump("total", "''", kind, "-1")}
+                {_bump("artist", "old.artist_id", kind, "-1")}
+                {_bump("decade", _decade("old"), kind, "-1")}
+                {_bump_genres("old.artist_id", kind, "-1")}
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS library_stats_{table.lower()}_au AFTER UPDATE OF artist_id, release_year ON {table}
+            WHEN old.artist_id IS NOT new.artist_id OR old.release_year IS NOT new.release_year BEGIN
+                {_bump("artist", "old.artist_id", kind, "-1")}
+                {_bump("decade", _decade("old"), kind, "-1")}
+                {_bump_genres("old.artist_id", kind, "-1")}
+                {_bump("artist", "new.artist_id", kind, "1")}
+                {_bump("decade", _decade("new"), kind, "1")}
+                {_bump_genres("new.artist_id", kind, "1")}
+            END;
+        ''')
+    return created
+
+def rebuild_stats(conn=None):
+    """Recompute every LibraryStats counter from the library tables in one transaction."""
+    if conn is None:
+        with get_connection() as conn:
+            return rebuild_stats(conn)
+    script = """
+        BEGIN;
+        DELETE FROM LibraryStats;
+        INSERT INTO LibraryStats (scope, key, kind, count)
+        SELECT 'total', '', 'artist', COUNT(*) FROM Artists HAVING COUNT(*) > 0;
+        INSERT INTO LibraryStats (scope, key, kind, count)
+        SELECT 'genre', genre, 'artist', COUNT(*) FROM ArtistGenres GROUP BY genre;
+    """
+    for table, kind in (("Albums", "album"), ("Tracks", "track")):
+        script += f"""
+            INSERT INTO LibraryStats (scope, key, kind, count)
+            SELECT 'total', '', '{kind}', COUNT(*) FROM {table} HAVING COUNT(*) > 0;
+            INSERT INTO LibraryStats (scope, key, kind, count)
+            SELECT 'artist', artist_id, '{kind}', COUNT(*) FROM {table} GROUP BY artist_id;
+            INSERT INTO LibraryStats (scope, key, kind, count)
+            SELECT 'decade', {_decade(table)}, '{kind}', COUNT(*) FROM {table} GROUP BY 2;
+            INSERT INTO LibraryStats (scope, key, kind, count)
+            SELECT 'genre', g.genre, '{kind}', COUNT(*) FROM {table} i JOIN ArtistGenres g ON g.artist_id = i.artist_id
+            GROUP BY g.genre;
+        """
+    conn.executescript(script + "COMMIT;")
+
+def _create_change_version(conn):
+    """Create the ChangeVersion counter bumped by every library write in this module."""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS ChangeVersion (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO ChangeVersion (id, version) VALUES (1, 0);
+    ''')
+
+def _bump_change_version(conn):
+    """Record that artists, albums or tracks changed, inside the writing transaction.
+    
+    Done once per write rather than by row triggers, which would cost an
+    extra UPDATE for every row of a bulk upsert. Cached page fragments are
+    dropped at the same time since none of them can be served again.
+    """
+    conn.execute("UPDATE ChangeVersion SET version = version + 1 WHERE id = 1")
+    conn.execute("DELETE FROM FragmentCache")
+
+def get_change_version():
+    """Counter that changes whenever an artist, album or track is written; used for ETags."""
     with get_connection() as conn:
-        genres_str = ", ".join(artist_info.get("genres", []))
-        conn.execute(
-            "INSERT OR REPLACE INTO Artists (id, name, genres, uri, url) VALUES (?, ?, ?, ?, ?)",
-            (artist_info["artist_id"], artist_info["artist_name"], genres_str, 
-             artist_info["uri"], artist_info["external_urls"].get("spotify", ""))
+        return conn.execute("SELECT version FROM ChangeVersion WHERE id = 1").fetchone()[0]
+
+def _delete_orphans(conn, tables):
+    """Delete the rows of tables that PRAGMA foreign_key_check reports, inside the caller's transaction.
+    
+    Albums and tracks whose artist is gone can't be re-linked and never show
+    up (every listing joins Artists), so they are removed with a warning.
+    Returns the number of rows deleted per table.
+    """
+    removed = {}
+    for table in tables:
+        rowids = sorted({row[1] for row in conn.execute(f"PRAGMA foreign_key_check({table})")})
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            conn.execute(f"DELETE FROM {table} WHERE rowid IN ({','.join(['?'] * len(chunk))})", chunk)
+        if rowids:
+            removed[table] = len(rowids)
+            _migration_log.warning("Removed %d %s rows whose artist no longer exists", len(rowids), table)
+    if removed:
+        _bump_change_version(conn)
+    return removed
+
+def _add_cascade_deletes(conn):
+    """Migration 2: add ON DELETE CASCADE to the artist foreign keys of older databases.
+    
+    Only the stored CREATE TABLE text changes, so instead of rebuilding the
+    tables (which would drop their search and stats triggers) the schema is
+    edited in place, as the SQLite ALTER TABLE docs describe for constraint
+    changes that leave the stored rows as they are. Databases written with
+    foreign keys off may hold albums and tracks of deleted artists; those are
+    removed first, since the new constraint could never cascade to them.
+    """
+    old = "REFERENCES Artists(id)\n"
+    new = "REFERENCES Artists(id) ON DELETE CASCADE\n"
+    tables = [row["name"] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('Albums', 'Tracks') AND sql LIKE ?",
+        (f"%{old}%",)
+    )]
+    if not tables:
+        return
+    
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _delete_orphans(conn, tables)
+        for table in tables:
+            violations = conn.execute(f"PRAGMA foreign_key_check({table})").fetchall()
+            if violations:
+                raise sqlite3.DatabaseError(
+                    f"{table} has {len(violations)} rows without an artist, not adding ON DELETE CASCADE "
+                    f"(first rowids: {', '.join(str(row[1]) for row in violations[:10])})"
+                )
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        conn.execute("PRAGMA writable_schema = ON")
+        conn.executemany(
+            "UPDATE sqlite_master SET sql = replace(sql, ?, ?) WHERE type = 'table' AND name = ?",
+            ((old, new, table) for table in tables)
         )
+        conn.execute(f"PRAGMA schema_version = {schema_version + 1}")
+        conn.execute("PRAGMA writable_schema = OFF")
+    if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+        raise sqlite3.DatabaseError("Database failed its integrity check after adding ON DELETE CASCADE")
+
+# Tables left out of downloadable snapshots because they hold secrets
+PRIVATE_TABLES = ("OAuthTokens",)
+
+def get_snapshot(version=None):
+    """Path of a consistent copy of the database for downloading, made once per change version.
+    
+    The copy never changes once written, so it can be served with range
+    requests. Tables in PRIVATE_TABLES are emptied and their pages zeroed.
+    """
+    version = get_change_version() if version is None else version
+    # Absolute, so a relative DB_PATH still names a directory to list (and send_file
+    # doesn't resolve the path against the app's root instead of the working directory)
+    prefix = f"{os.path.abspath(DB_PATH)}.snapshot-"
+    path = f"{prefix}{version}"
+    if os.path.exists(path):
+        return path
+    
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    snapshot = sqlite3.connect(partial)
+    try:
+        get_connection().backup(snapshot)
+        snapshot.execute("PRAGMA secure_delete = ON")
+        with snapshot:
+            for table in PRIVATE_TABLES:
+                snapshot.execute(f"DELETE FROM {table}")
+        snapshot.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        snapshot.close()
+    os.replace(partial, path)
+    
+    # Older snapshots are no longer served
+    directory, prefix = os.path.split(prefix)
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name != os.path.basename(path) and not name.endswith(".tmp"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return path
+
+def rebuild_search_index():
+    """Rebuild all full-text search tables from their source tables."""
+    with get_connection() as conn:
+        for search_table in SEARCH_TABLES:
+            conn.execute(f"INSERT INTO {search_table}({search_table}) VALUES ('rebuild')")
+
+def _create_schema(conn):
+    """Migration 1: the schema as it was before migrations were versioned.
+    
+    Every statement is IF NOT EXISTS, so it also brings databases created by
+    earlier releases up to this baseline.
+    """
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS Artists (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            genres TEXT,
+            uri TEXT,
+            url TEXT
+        );
+        
+        CREATE TABLE IF NOT EXISTS Albums (
+            id TEXT PRIMARY KEY,
+            artist_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            release_year INTEGER,
+            uri TEXT,
+            url TEXT,
+            FOREIGN KEY (artist_id) REFERENCES Artists(id) ON DELETE CASCADE
+        );
+        
+        CREATE TABLE IF NOT EXISTS Tracks (
+            id TEXT PRIMARY KEY,
+            artist_id TEXT NOT NULL,
+            album_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            release_year INTEGER,
+            uri TEXT,
+            url TEXT,
+            FOREIGN KEY (artist_id) REFERENCES Artists(id) ON DELETE CASCADE
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_albums_artist ON Albums(artist_id);
+        CREATE INDEX IF NOT EXISTS idx_tracks_artist ON Tracks(artist_id);
+        
+        -- Composite indexes matching the browse ORDER BY clauses
+        CREATE INDEX IF NOT EXISTS idx_artists_name ON Artists(name, id);
+        CREATE INDEX IF NOT EXISTS idx_albums_artist_sort ON Albums(artist_id, COALESCE(release_year, -1), id);
+        CREATE INDEX IF NOT EXISTS idx_tracks_artist_name ON Tracks(artist_id, name, id);
+        
+        -- Spotify API payloads shared by all workers, see cache_get_many
+        CREATE TABLE IF NOT EXISTS MetadataCache (
+            kind TEXT NOT NULL,
+            id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (kind, id)
+        ) WITHOUT ROWID;
+        
+        CREATE INDEX IF NOT EXISTS idx_metadata_cache_accessed ON MetadataCache(accessed_at);
+        
+        -- Rendered page fragments shared by all workers, see fragment_get
+        CREATE TABLE IF NOT EXISTS FragmentCache (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            body TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_fragment_cache_accessed ON FragmentCache(accessed_at);
+        
+        -- Per-user sync checkpoints: the newest saved-at timestamp seen so far
+        CREATE TABLE IF NOT EXISTS SyncState (
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            high_water_mark TEXT,
+            last_synced_at REAL,
+            last_full_sync_at REAL,
+            PRIMARY KEY (user_id, kind)
+        );
+        
+        -- Items that came from a user's Spotify library, so a full resync
+        -- can remove exactly those that were unsaved on Spotify
+        CREATE TABLE IF NOT EXISTS SyncedItems (
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            added_at TEXT,
+            PRIMARY KEY (user_id, kind, item_id)
+        ) WITHOUT ROWID;
+        
+        -- Followed artists are looked up by ID when sweeping orphaned artists
+        CREATE INDEX IF NOT EXISTS idx_synced_items_item ON SyncedItems(kind, item_id);
+        
+        -- Last run of each periodic task, see maintenance.py
+        CREATE TABLE IF NOT EXISTS Maintenance (
+            task TEXT PRIMARY KEY,
+            last_run REAL NOT NULL
+        );
+        
+        -- Background jobs (syncs, imports, exports), see jobs.py
+        CREATE TABLE IF NOT EXISTS Jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            pid INTEGER,
+            worker TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_jobs_created ON Jobs(created_at);
+        
+        CREATE TABLE IF NOT EXISTS MetadataCacheStats (
+            kind TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0,
+            evictions INTEGER NOT NULL DEFAULT 0
+        );
+        
+        -- Token buckets shared by all workers, see spotify_client.py
+        CREATE TABLE IF NOT EXISTS RateLimits (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        
+        -- Spotify OAuth tokens of logged in users, keyed by the random ID in their session
+        CREATE TABLE IF NOT EXISTS OAuthTokens (
+            key TEXT PRIMARY KEY,
+            token_info TEXT NOT NULL,
+            refresh_lease REAL,
+            updated_at REAL NOT NULL
+        );
+    ''')
+    
+    # Databases created before search existed need their rows indexed once
+    if _create_search_tables(conn):
+        for search_table in SEARCH_TABLES:
+            conn.execute(f"INSERT INTO {search_table}({search_table}) VALUES ('rebuild')")
+    
+    # Same for the genre index
+    if _create_genre_index(conn):
+        conn.execute(f"INSERT OR IGNORE INTO ArtistGenres (artist_id, genre) {_genres_of('Artists', 'Artists')}")
+    
+    # And for the statistics counters, which start from a full count
+    if _create_stats_tables(conn):
+        rebuild_stats(conn)
+    
+    _create_change_version(conn)
+
+def _add_lookup_indexes(conn):
+    """Migration 3: index tracks by album and albums and tracks by name.
+    
+    SQLite can't build an index concurrently with writes, so each index gets
+    its own short transaction: readers carry on under WAL and writers wait at
+    most one index build, not the whole migration.
+    """
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_tracks_album ON Tracks(album_id)",
+        "CREATE INDEX IF NOT EXISTS idx_albums_name ON Albums(name)",
+        "CREATE INDEX IF NOT EXISTS idx_tracks_name ON Tracks(name)",
+    ):
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(statement)
+    # Give the planner statistics for the new indexes right away
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+
+def _add_metrics_table(conn):
+    """Migration 4: Metrics table holding every worker's /metrics counters."""
+    conn.executescript('''
+        -- Prometheus samples summed over workers, e.g. ('http_requests_total', '{route="/"}', 12)
+        CREATE TABLE IF NOT EXISTS Metrics (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, labels)
+        ) WITHOUT ROWID;
+    ''')
+
+# Schema migrations in the order they run: (version, name, function(conn)).
+# Add new ones at the end with the next version; never change one that has
+# shipped, since existing databases have already recorded it as applied.
+MIGRATIONS = [
+    (1, "baseline schema", _create_schema),
+    (2, "cascade artist deletes", _add_cascade_deletes),
+    (3, "album and name indexes", _add_lookup_indexes),
+    (4, "metrics table", _add_metrics_table),
+]
+
+class _MigrationLock:
+    """Exclusive lock on a file next to the database, held while migrating.
+    
+    Migrations commit as they go (executescript always does), so a SQLite
+    transaction can't keep two workers from running the same one at startup.
+    """
+
+    def __enter__(self):
+        self.file = open(f"{DB_PATH}.migrate-lock", "w")
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+def get_schema_version():
+    """Version of the last migration applied to the database, 0 for a new one."""
+    with get_connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS SchemaVersion (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at REAL NOT NULL
+            )
+        """)
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM SchemaVersion").fetchone()[0]
+
+def create_tables():
+    """Create the schema, or bring an existing database up to date, by running pending migrations.
+    
+    Every worker calls this at startup; they take turns, and each migration is
+    recorded in SchemaVersion as it finishes, so it runs once per database.
+    Returns the names of the migrations this call applied.
+    """
+    applied = []
+    with _MigrationLock():
+        current = get_schema_version()
+        conn = get_connection()
+        for version, name, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            migration(conn)
+            with conn:
+                conn.execute(
+                    "INSERT INTO SchemaVersion (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, time.time())
+                )
+            applied.append(name)
+    return applied
+
+# Planner statistics are sampled from this many rows per index, which keeps
+# ANALYZE quick on large tables (see sqlite.org/lang_analyze.html)
+ANALYSIS_LIMIT = int(os.getenv("ANALYSIS_LIMIT", "1000"))
+
+def optimize_database(full=False):
+    """Refresh the query planner's statistics.
+    
+    By default this is PRAGMA optimize, which only re-analyzes tables whose
+    statistics look stale; ``full`` runs ANALYZE on everything.
+    """
+    with get_connection() as conn:
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE" if full else "PRAGMA optimize")
+
+# Columns of each library table, in the order used by the bulk upserts
+TABLE_COLUMNS = {
+    "Artists": ["id", "name", "genres", "uri", "url"],
+    "Albums": ["id", "artist_id", "name", "release_year", "uri", "url"],
+    "Tracks": ["id", "artist_id", "album_id", "name", "release_year", "uri", "url"],
+}
+# The NOT NULL columns, which every imported CSV section must have
+REQUIRED_COLUMNS = {
+    "Artists": ["id", "name"],
+    "Albums": ["id", "artist_id", "name"],
+    "Tracks": ["id", "artist_id", "album_id", "name"],
+}
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+def _batched(rows, size):
+    """Yield lists of up to size rows from any iterable."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _upsert_rows(conn, table, columns, rows):
+    """Insert or update rows keyed by id with one executemany, leaving identical rows untouched.
+    
+    Returns counts of inserted, updated and unchanged rows.
+    """
+    if "id" not in columns:
+        raise ValueError(f"{table} rows need an id column")
+    
+    # Later duplicates of an id win, as they would with one statement per row
+    id_index = columns.index("id")
+    rows_by_id = {row[id_index]: row for row in rows}
+    ids = list(rows_by_id)
+    
+    existing = 0
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        existing += conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE id IN ({','.join(['?'] * len(chunk))})", chunk
+        ).fetchone()[0]
+    
+    other_columns = [c for c in columns if c != "id"]
+    updates = ", ".join(f"{c} = excluded.{c}" for c in other_columns)
+    changed = " OR ".join(f"{table}.{c} IS NOT excluded.{c}" for c in other_columns)
+    cursor = conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({','.join(['?'] * len(columns))}) "
+        f"ON CONFLICT(id) DO UPDATE SET {updates} WHERE {changed}",
+        rows_by_id.values()
+    )
+    
+    inserted = len(ids) - existing
+    updated = cursor.rowcount - inserted
+    if cursor.rowcount:
+        _bump_change_version(conn)
+        ROWS_WRITTEN.inc(inserted, table=table, result="inserted")
+        ROWS_WRITTEN.inc(updated, table=table, result="updated")
+    return {"inserted": inserted, "updated": updated, "unchanged": existing - updated}
+
+def _bulk_upsert(table, rows, columns=None):
+    """Upsert rows in batches of BULK_BATCH_SIZE, one transaction per batch."""
+    totals = Counter()
+    with get_connection() as conn:
+        for batch in _batched(rows, BULK_BATCH_SIZE):
+            with conn:
+                # Take the write lock up front so the existing-row count stays accurate
+                conn.execute("BEGIN IMMEDIATE")
+                totals.update(_upsert_rows(conn, table, columns or TABLE_COLUMNS[table], batch))
+    return {key: totals[key] for key in ("inserted", "updated", "unchanged")}
+
+def _artist_row(info):
+    """Artists row for an artist record, with genres as a comma-separated string."""
+    return (info["artist_id"], info["artist_name"], ", ".join(info.get("genres", [])),
+            info["uri"], info["external_urls"].get("spotify", ""))
+
+def _album_row(info):
+    """Albums row for an album record."""
+    return (info["album_id"], info["artist_id"], info["album_name"],
+            info["release_year"], info["album_uri"], info["url"])
+
+def _track_row(info):
+    """Tracks row for a track record."""
+    return (info["track_id"], info["artist_id"], info["album_id"],
+            info["track_name"], info["release_year"], info["track_uri"], info["url"])
+
+def add_artists(artist_infos):
+    """Insert or update many artists, storing genres as comma-separated strings."""
+    return _bulk_upsert("Artists", (_artist_row(info) for info in artist_infos))
+
+def add_albums(album_infos):
+    """Insert or update many album records."""
+    return _bulk_upsert("Albums", (_album_row(info) for info in album_infos))
+
+def add_tracks(track_infos):
+    """Insert or update many track records."""
+    return _bulk_upsert("Tracks", (_track_row(info) for info in track_infos))
+
+def add_items(infos, stored_artists=None):
+    """Store album and track records together with their artists in one transaction.
+    
+    Artists whose IDs are in the ``stored_artists`` set are taken as already
+    stored and skipped; the IDs of the artists written are added to it.
+    Returns inserted/updated/unchanged counts per table.
+    """
+    infos = list(infos)
+    artists = {info["artist_id"]: info["artist_info"] for info in infos}
+    if stored_artists is not None:
+        artists = {artist_id: info for artist_id, info in artists.items() if artist_id not in stored_artists}
+    rows = {
+        "Artists": [_artist_row(info) for info in artists.values()],
+        "Albums": [_album_row(info) for info in infos if info["type"] == "album"],
+        "Tracks": [_track_row(info) for info in infos if info["type"] == "track"],
+    }
+    counts = {}
+    with get_connection() as conn:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table, table_rows in rows.items():
+                if table_rows:
+                    counts[table] = _upsert_rows(conn, table, TABLE_COLUMNS[table], table_rows)
+    if stored_artists is not None:
+        stored_artists.update(artists)
+    return counts
+
+def add_artist(artist_info):
+    """Insert or update artist with genres as comma-separated string."""
+    return add_artists([artist_info])
 
 def add_album(album_info):
     """Insert album record."""
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT OR REPLACE INTO Albums (id, artist_id, name, release_year, uri, url) VALUES (?, ?, ?, ?, ?, ?)",
-            (album_info["album_id"], album_info["artist_id"], album_info["album_name"], 
-             album_info["release_year"], album_info["album_uri"], album_info["url"])
-        )
+    return add_albums([album_info])
 
 def add_track(track_info):
     """Insert track record."""
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT OR REPLACE INTO Tracks (id, artist_id, album_id, name, release_year, uri, url) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (track_info["track_id"], track_info["artist_id"], track_info["album_id"], 
-             track_info["track_name"], track_info["release_year"], track_info["track_uri"], track_info["url"])
-        )
+    return add_tracks([track_info])
 
 def get_all_items():
     """Get all albums and tracks with artist info."""
@@ -94,101 +894,827 @@ def get_all_items():
         
         return [dict(row) for row in albums + tracks]
 
-def get_artists():
-    """Get all artists."""
+# Keyset page queries: rows are ordered by (artist name, artist id, sort column, id)
+# so the cursor of the last row on a page uniquely identifies where the next begins.
+# Albums without a year sort first; the key must never be NULL, since a row
+# value comparison with NULL in it is NULL and would skip the row
+ALBUM_SORT_KEY = "COALESCE(a.release_year, -1)"
+ALBUM_SORT_KEY_MIN = -1
+
+PAGE_QUERIES = {
+    "album": f"""
+        SELECT 'album' as type, a.id, a.name, ar.name as artist_name,
+               a.release_year, a.uri, a.url, ar.genres, ar.id as artist_id,
+               {ALBUM_SORT_KEY} as sort_key
+        FROM Albums a JOIN Artists ar ON a.artist_id = ar.id
+        WHERE (ar.name, ar.id) >= (?, ?)
+          AND ((ar.name, ar.id) > (?, ?) OR ({ALBUM_SORT_KEY}, a.id) > (?, ?))
+          {{genre_filter}}
+        ORDER BY ar.name, ar.id, {ALBUM_SORT_KEY}, a.id
+        LIMIT ?
+    """,
+    "track": """
+        SELECT 'track' as type, t.id, t.name, ar.name as artist_name,
+               t.release_year, t.uri, t.url, ar.genres, ar.id as artist_id,
+               t.name as sort_key
+        FROM Tracks t JOIN Artists ar ON t.artist_id = ar.id
+        WHERE (ar.name, ar.id) >= (?, ?)
+          AND ((ar.name, ar.id) > (?, ?) OR (t.name, t.id) > (?, ?))
+          {genre_filter}
+        ORDER BY ar.name, ar.id, t.name, t.id
+        LIMIT ?
+    """,
+}
+
+# Albums are listed before tracks when browsing everything, as in get_all_items
+PAGE_TYPES = ("album", "track")
+
+GENRE_FILTER = "AND ar.id IN (SELECT artist_id FROM ArtistGenres WHERE genre = ?)"
+
+def get_items_page(item_type="all", after=None, limit=50, genre=None):
+    """Get one page of albums and/or tracks after a keyset cursor.
+    
+    ``after`` is the cursor returned for the previous page (or None for the first
+    page). ``genre`` limits the page to artists tagged with that genre.
+    Returns ``(items, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    types = PAGE_TYPES if item_type == "all" else (item_type,)
+    if after:
+        if after[0] not in types:
+            raise ValueError("Invalid cursor")
+        # Skip the types that sort before the cursor's type entirely
+        types = types[types.index(after[0]):]
+    
+    items = []
+    with get_connection() as conn:
+        for page_type in types:
+            if after and after[0] == page_type:
+                _, artist_name, artist_id, sort_key, item_id = after
+                if page_type == "album" and sort_key is None:
+                    # Cursors from before the sort key was made non-null
+                    sort_key = ALBUM_SORT_KEY_MIN
+            else:
+                # Empty strings and NULL sort before every real key
+                artist_name, artist_id, sort_key, item_id = "", "", None, ""
+            
+            params = [artist_name, artist_id, artist_name, artist_id, sort_key, item_id]
+            if genre:
+                params.append(genre)
+            rows = conn.execute(
+                PAGE_QUERIES[page_type].format(genre_filter=GENRE_FILTER if genre else ""),
+                params + [limit + 1 - len(items)]
+            ).fetchall()
+            items.extend(dict(row) for row in rows)
+            if len(items) > limit:
+                break
+    
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = (last["type"], last["artist_name"], last["artist_id"], last["sort_key"], last["id"])
+    return items, next_cursor
+
+def count_items(item_type="all", genre=None):
+    """Count albums and/or tracks, optionally only those by artists of one genre."""
+    types = PAGE_TYPES if item_type == "all" else (item_type,)
+    tables = {"album": "Albums", "track": "Tracks"}
+    with get_connection() as conn:
+        if not genre:
+            return sum(conn.execute(f"SELECT COUNT(*) FROM {tables[t]}").fetchone()[0] for t in types)
+        return sum(conn.execute(f"""
+            SELECT COUNT(*) FROM {tables[t]}
+            WHERE artist_id IN (SELECT artist_id FROM ArtistGenres WHERE genre = ?)
+        """, (genre,)).fetchone()[0] for t in types)
+
+def count_artists(genre=None):
+    """Count artists, optionally only those tagged with ``genre``."""
+    with get_connection() as conn:
+        if genre:
+            return conn.execute("SELECT COUNT(*) FROM ArtistGenres WHERE genre = ?", (genre,)).fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM Artists").fetchone()[0]
+
+def get_genre_counts(item_type="artist"):
+    """Count artists, albums or tracks per genre, most common genre first.
+    
+    Returns a list of ``{"genre", "count"}`` dicts from the LibraryStats counters.
+    """
+    with get_connection() as conn:
+        rows = conn.execute("""
+            SELECT key as genre, count FROM LibraryStats
+            WHERE scope = 'genre' AND kind = ?
+            ORDER BY count DESC, key
+        """, (item_type,)).fetchall()
+        return [dict(row) for row in rows]
+
+STAT_KINDS = ("artist", "album", "track")
+
+def get_stats(top=10):
+    """Library totals, items per decade, and the top genres and artists by count.
+    
+    Every figure is read from the trigger-maintained LibraryStats table, so the
+    cost depends on ``top`` and the number of decades, not the library size.
+    """
+    with get_connection() as conn:
+        def counts(scope):
+            return conn.execute("SELECT key, kind, count FROM LibraryStats WHERE scope = ?", (scope,)).fetchall()
+        
+        def top_rows(scope, kind):
+            return conn.execute("""
+                SELECT s.key, s.count, ar.name FROM LibraryStats s
+                LEFT JOIN Artists ar ON s.scope = 'artist' AND ar.id = s.key
+                WHERE s.scope = ? AND s.kind = ?
+                ORDER BY s.count DESC, s.key
+                LIMIT ?
+            """, (scope, kind, top)).fetchall()
+        
+        totals = {kind: 0 for kind in STAT_KINDS}
+        totals.update({row["kind"]: row["count"] for row in counts("total")})
+        
+        decades = {"album": {}, "track": {}}
+        for row in sorted(counts("decade"), key=lambda row: row["key"]):
+            decades[row["kind"]][row["key"] or "unknown"] = row["count"]
+        
+        return {
+            "totals": totals,
+            "decades": decades,
+            "genres": {
+                kind: [{"genre": row["key"], "count": row["count"]} for row in top_rows("genre", kind)]
+                for kind in STAT_KINDS
+            },
+            "artists": {
+                kind: [{"id": row["key"], "name": row["name"], "count": row["count"]} for row in top_rows("artist", kind)]
+                for kind in ("album", "track")
+            },
+        }
+
+def _match_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{word}"*' for word in words)
+
+def search(text, item_type="all", limit=20):
+    """Full-text search over artists, albums and tracks, best matches first."""
+    query = _match_query(text)
+    results = {"artists": [], "albums": [], "tracks": []}
+    if not query:
+        return results
+    
+    with get_connection() as conn:
+        if item_type in ("all", "artist"):
+            results["artists"] = [dict(row) for row in conn.execute("""
+                SELECT ar.id, ar.name, ar.genres, ar.uri, ar.url
+                FROM ArtistsSearch s JOIN Artists ar ON ar.rowid = s.rowid
+                WHERE ArtistsSearch MATCH ?
+                ORDER BY bm25(ArtistsSearch, 10.0, 1.0)
+                LIMIT ?
+            """, (query, limit))]
+        if item_type in ("all", "album"):
+            results["albums"] = [dict(row) for row in conn.execute("""
+                SELECT 'album' as type, a.id, a.name, ar.name as artist_name,
+                       a.release_year, a.uri, a.url, ar.genres
+                FROM AlbumsSearch s
+                JOIN Albums a ON a.rowid = s.rowid
+                JOIN Artists ar ON a.artist_id = ar.id
+                WHERE AlbumsSearch MATCH ?
+                ORDER BY s.rank
+                LIMIT ?
+            """, (query, limit))]
+        if item_type in ("all", "track"):
+            results["tracks"] = [dict(row) for row in conn.execute("""
+                SELECT 'track' as type, t.id, t.name, ar.name as artist_name,
+                       t.release_year, t.uri, t.url, ar.genres
+                FROM TracksSearch s
+                JOIN Tracks t ON t.rowid = s.rowid
+                JOIN Artists ar ON t.artist_id = ar.id
+                WHERE TracksSearch MATCH ?
+                ORDER BY s.rank
+                LIMIT ?
+            """, (query, limit))]
+    return results
+
+def search_items(text, item_type="all", limit=100, genre=None):
+    """Get albums and/or tracks whose title or artist matches the search text, optionally of one genre."""
+    query = _match_query(text)
+    if not query:
+        return []
+    
+    items = []
+    with get_connection() as conn:
+        for page_type, table, search_table, order in (
+            ("album", "Albums", "AlbumsSearch", "i.release_year"),
+            ("track", "Tracks", "TracksSearch", "i.name"),
+        ):
+            if item_type not in ("all", page_type):
+                continue
+            items.extend(dict(row) for row in conn.execute(f"""
+                SELECT '{page_type}' as type, i.id, i.name, ar.name as artist_name,
+                       i.release_year, i.uri, i.url, ar.genres
+                FROM {table} i JOIN Artists ar ON i.artist_id = ar.id
+                WHERE (i.rowid IN (SELECT rowid FROM {search_table} WHERE {search_table} MATCH :q)
+                       OR ar.rowid IN (SELECT rowid FROM ArtistsSearch WHERE ArtistsSearch MATCH :q))
+                  {"AND ar.id IN (SELECT artist_id FROM ArtistGenres WHERE genre = :genre)" if genre else ""}
+                ORDER BY ar.name, {order}
+                LIMIT :limit
+            """, {"q": query, "limit": limit - len(items), "genre": genre}))
+    return items
+
+# Metadata cache settings; TTLs are in seconds per entity kind
+METADATA_CACHE_ENABLED = os.getenv("METADATA_CACHE", "on").lower() not in ("0", "off", "false", "no")
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "50000"))
+METADATA_CACHE_TTLS = {
+    "artist": int(os.getenv("METADATA_CACHE_TTL_ARTIST", str(7 * 24 * 3600))),
+    "album": int(os.getenv("METADATA_CACHE_TTL_ALBUM", str(30 * 24 * 3600))),
+    "track": int(os.getenv("METADATA_CACHE_TTL_TRACK", str(30 * 24 * 3600))),
+}
+
+def _record_cache_stats(conn, kind, hits=0, misses=0, evictions=0):
+    conn.execute("""
+        INSERT INTO MetadataCacheStats (kind, hits, misses, evictions) VALUES (?, ?, ?, ?)
+        ON CONFLICT(kind) DO UPDATE SET
+            hits = hits + excluded.hits,
+            misses = misses + excluded.misses,
+            evictions = evictions + excluded.evictions
+    """, (kind, hits, misses, evictions))
+
+def cache_get_many(kind, ids):
+    """Get unexpired cached payloads by ID. Returns {id: payload} for the hits only."""
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+    
+    now = time.time()
+    oldest = now - METADATA_CACHE_TTLS[kind]
+    found = {}
+    with get_connection() as conn:
+        # Stay well below SQLite's host parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join(["?"] * len(chunk))
+            rows = conn.execute(
+                f"SELECT id, payload FROM MetadataCache WHERE kind = ? AND fetched_at >= ? AND id IN ({placeholders})",
+                (kind, oldest, *chunk)
+            ).fetchall()
+            found.update((row["id"], json.loads(row["payload"])) for row in rows)
+        
+        if found:
+            conn.executemany(
+                "UPDATE MetadataCache SET accessed_at = ? WHERE kind = ? AND id = ?",
+                [(now, kind, item_id) for item_id in found]
+            )
+        _record_cache_stats(conn, kind, hits=len(found), misses=len(ids) - len(found))
+    return found
+
+def cache_put_many(kind, payloads):
+    """Store {id: payload} in the cache, evicting least recently used entries over the size cap."""
+    if not payloads:
+        return
+    
+    now = time.time()
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO MetadataCache (kind, id, payload, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            [(kind, item_id, json.dumps(payload), now, now) for item_id, payload in payloads.items()]
+        )
+        
+        excess = conn.execute("SELECT COUNT(*) FROM MetadataCache").fetchone()[0] - METADATA_CACHE_MAX_ENTRIES
+        if excess > 0:
+            evicted = conn.execute(
+                "SELECT kind, id FROM MetadataCache ORDER BY accessed_at LIMIT ?", (excess,)
+            ).fetchall()
+            conn.executemany("DELETE FROM MetadataCache WHERE kind = ? AND id = ?", evicted)
+            for evicted_kind, count in Counter(row["kind"] for row in evicted).items():
+                _record_cache_stats(conn, evicted_kind, evictions=count)
+
+def get_cache_stats():
+    """Get metadata cache entry counts and hit/miss/eviction counters per kind."""
+    with get_connection() as conn:
+        stats = {row["kind"]: {**dict(row), "entries": 0} for row in conn.execute("SELECT * FROM MetadataCacheStats")}
+        for row in conn.execute("SELECT kind, COUNT(*) as entries FROM MetadataCache GROUP BY kind"):
+            stats.setdefault(row["kind"], {"kind": row["kind"], "hits": 0, "misses": 0, "evictions": 0})
+            stats[row["kind"]]["entries"] = row["entries"]
+        return {
+            "enabled": METADATA_CACHE_ENABLED,
+            "max_entries": METADATA_CACHE_MAX_ENTRIES,
+            "kinds": list(stats.values())
+        }
+
+def clear_metadata_cache():
+    """Remove all cached metadata and reset the counters."""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM MetadataCache")
+        conn.execute("DELETE FROM MetadataCacheStats")
+
+FRAGMENT_CACHE_ENABLED = os.getenv("FRAGMENT_CACHE", "on").lower() not in ("0", "off", "false", "no")
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv("FRAGMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Hits refresh accessed_at at most this often, so reads rarely write
+FRAGMENT_TOUCH_SECONDS = 60
+
+def fragment_get(key, version):
+    """Get a rendered fragment cached for this change version, or None."""
+    now = time.time()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT body, accessed_at FROM FragmentCache WHERE key = ? AND version = ?", (key, version)
+        ).fetchone()
+        if row and now - row["accessed_at"] > FRAGMENT_TOUCH_SECONDS:
+            conn.execute("UPDATE FragmentCache SET accessed_at = ? WHERE key = ?", (now, key))
+    return row["body"] if row else None
+
+def fragment_put(key, version, body):
+    """Cache a rendered fragment, dropping ones from older versions and the least recently used over the size limit."""
+    size = len(body.encode())
+    if size > FRAGMENT_CACHE_MAX_BYTES:
+        return
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO FragmentCache (key, version, body, size, accessed_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                version = excluded.version, body = excluded.body, size = excluded.size, accessed_at = excluded.accessed_at
+        """, (key, version, body, size, time.time()))
+        # A write since then means these can never be served again
+        conn.execute("DELETE FROM FragmentCache WHERE version < ?", (version,))
+        conn.execute("""
+            DELETE FROM FragmentCache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS total FROM FragmentCache
+                ) WHERE total > ?
+            )
+        """, (FRAGMENT_CACHE_MAX_BYTES,))
+
+def clear_fragment_cache():
+    """Remove all cached fragments."""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM FragmentCache")
+
+def acquire_rate_limit(name, rate, burst):
+    """Take one token from a shared token bucket; returns the seconds to wait before using it.
+    
+    The bucket refills at ``rate`` tokens per second up to ``burst``. Tokens
+    may go negative: each caller reserves the next free slot, so concurrent
+    callers in any worker are spaced out instead of retrying in a burst.
+    """
+    now = time.time()
+    with get_connection() as conn:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at FROM RateLimits WHERE name = ?", (name,)).fetchone()
+            tokens = burst if row is None else min(burst, row["tokens"] + (now - row["updated_at"]) * rate)
+            tokens -= 1
+            conn.execute("""
+                INSERT INTO RateLimits (name, tokens, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+            """, (name, tokens, now))
+    return max(0.0, -tokens / rate)
+
+def block_rate_limit(name, seconds):
+    """Empty a token bucket and stop it refilling for ``seconds``, e.g. after a 429."""
+    until = time.time() + seconds
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO RateLimits (name, tokens, updated_at) VALUES (?, 0, ?)
+            ON CONFLICT(name) DO UPDATE SET tokens = MIN(tokens, 0), updated_at = MAX(updated_at, excluded.updated_at)
+        """, (name, until))
+
+def add_metric_samples(samples):
+    """Add one worker's metric counts, [(name, labels, value)], to the shared totals."""
+    with get_connection() as conn:
+        conn.executemany("""
+            INSERT INTO Metrics (name, labels, value) VALUES (?, ?, ?)
+            ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value
+        """, samples)
+
+def get_metric_samples():
+    """All workers' metric totals as (name, labels, value) rows."""
+    with get_connection() as conn:
+        return [tuple(row) for row in conn.execute("SELECT name, labels, value FROM Metrics")]
+
+def save_oauth_token(key, token_info, max_age=30 * 24 * 3600):
+    """Store a user's token, releasing any refresh lease, and drop tokens unused for max_age seconds."""
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO OAuthTokens (key, token_info, refresh_lease, updated_at) VALUES (?, ?, NULL, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                token_info = excluded.token_info, refresh_lease = NULL, updated_at = excluded.updated_at
+        """, (key, json.dumps(token_info), now))
+        conn.execute("DELETE FROM OAuthTokens WHERE updated_at < ?", (now - max_age,))
+
+def get_oauth_token(key):
+    """Get a stored token, or None."""
     with get_connection() as conn:
-        return [dict(row) for row in conn.execute("SELECT * FROM Artists ORDER BY name").fetchall()]
+        row = conn.execute("SELECT token_info FROM OAuthTokens WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["token_info"]) if row else None
+
+def acquire_oauth_refresh(key, seconds):
+    """Take the lease to refresh a token for ``seconds``. Returns False if another worker holds it."""
+    now = time.time()
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            UPDATE OAuthTokens SET refresh_lease = ?
+            WHERE key = ? AND (refresh_lease IS NULL OR refresh_lease < ?)
+        """, (now + seconds, key, now))
+    return cursor.rowcount == 1
+
+def release_oauth_refresh(key):
+    """Give up a refresh lease without storing a new token."""
+    with get_connection() as conn:
+        conn.execute("UPDATE OAuthTokens SET refresh_lease = NULL WHERE key = ?", (key,))
+
+def delete_oauth_token(key):
+    """Forget a stored token."""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM OAuthTokens WHERE key = ?", (key,))
+
+def get_sync_state(user_id, kind):
+    """Get the sync checkpoint for a user's saved albums or tracks, or None."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM SyncState WHERE user_id = ? AND kind = ?", (user_id, kind)).fetchone()
+        return dict(row) if row else None
+
+def save_sync_state(user_id, kind, high_water_mark, full=False):
+    """Record a finished sync and its high-water mark."""
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO SyncState (user_id, kind, high_water_mark, last_synced_at, last_full_sync_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, kind) DO UPDATE SET
+                high_water_mark = excluded.high_water_mark,
+                last_synced_at = excluded.last_synced_at,
+                last_full_sync_at = COALESCE(excluded.last_full_sync_at, last_full_sync_at)
+        """, (user_id, kind, high_water_mark, now, now if full else None))
+
+def record_synced_items(user_id, kind, items):
+    """Remember (item_id, added_at) pairs as coming from the user's library."""
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO SyncedItems (user_id, kind, item_id, added_at) VALUES (?, ?, ?, ?)",
+            ((user_id, kind, item_id, added_at) for item_id, added_at in items)
+        )
+
+def remove_unsynced_items(user_id, kind, seen_ids):
+    """Delete synced albums or tracks that a full resync no longer saw. Returns the count.
+    
+    Artists are only forgotten as followed; cleanup_unused_artists deletes
+    them once nothing else uses them.
+    """
+    table = {"album": "Albums", "track": "Tracks"}.get(kind)
+    with get_connection() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS SeenItems (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM SeenItems")
+        conn.executemany("INSERT OR IGNORE INTO SeenItems (id) VALUES (?)", ((item_id,) for item_id in seen_ids))
+        
+        removed = [row["item_id"] for row in conn.execute("""
+            SELECT item_id FROM SyncedItems s
+            WHERE s.user_id = ? AND s.kind = ?
+              AND NOT EXISTS (SELECT 1 FROM SeenItems WHERE id = s.item_id)
+        """, (user_id, kind))]
+        if table:
+            conn.executemany(f"DELETE FROM {table} WHERE id = ?", ((item_id,) for item_id in removed))
+            if removed:
+                _bump_change_version(conn)
+        conn.executemany(
+            "DELETE FROM SyncedItems WHERE user_id = ? AND kind = ? AND item_id = ?",
+            ((user_id, kind, item_id) for item_id in removed)
+        )
+        conn.execute("DELETE FROM SeenItems")
+        return len(removed)
+
+def create_job(job_id, kind, worker=None, max_age=7 * 24 * 3600):
+    """Record a new queued job run by this process, forgetting jobs older than max_age seconds.
+    
+    ``worker`` identifies the process beyond its PID (see jobs._process_identity).
+    """
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute("DELETE FROM Jobs WHERE created_at < ?", (now - max_age,))
+        conn.execute(
+            "INSERT INTO Jobs (id, kind, status, progress, pid, worker, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', '{}', ?, ?, ?, ?)",
+            (job_id, kind, os.getpid(), worker, now, now)
+        )
+
+def update_job(job_id, status=None, progress=None, result=None, error=None):
+    """Update a job's status, progress counters, result or error; None leaves a field as is."""
+    with get_connection() as conn:
+        conn.execute("""
+            UPDATE Jobs SET
+                status = COALESCE(?, status),
+                progress = COALESCE(?, progress),
+                result = COALESCE(?, result),
+                error = COALESCE(?, error),
+                updated_at = ?
+            WHERE id = ?
+        """, (status, json.dumps(progress) if progress is not None else None,
+              json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+def get_job(job_id):
+    """Get a job with its progress and result decoded, or None."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM Jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["progress"] = json.loads(job["progress"] or "{}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def get_artists_page(genre=None, after=None, limit=50):
+    """Get one page of artists ordered by name after a (name, id) keyset cursor.
+    
+    ``added`` is the artist's rowid, which grows as artists are inserted, so
+    sorting by it puts the most recently added artists first.
+    Returns ``(artists, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    name, artist_id = after or ("", "")
+    params = [name, artist_id]
+    if genre:
+        params.append(genre)
+    with get_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT ar.id, ar.name, ar.genres, ar.uri, ar.url, ar.rowid AS added FROM Artists ar
+            WHERE (ar.name, ar.id) > (?, ?) {GENRE_FILTER if genre else ""}
+            ORDER BY ar.name, ar.id
+            LIMIT ?
+        """, params + [limit + 1]).fetchall()
+    artists = [dict(row) for row in rows[:limit]]
+    next_cursor = (artists[-1]["name"], artists[-1]["id"]) if len(rows) > limit else None
+    return artists, next_cursor
+
+def get_artists(genre=None):
+    """Get all artists, or only those tagged with ``genre``."""
+    with get_connection() as conn:
+        if genre:
+            rows = conn.execute("""
+                SELECT ar.* FROM ArtistGenres g JOIN Artists ar ON ar.id = g.artist_id
+                WHERE g.genre = ? ORDER BY ar.name
+            """, (genre,)).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM Artists ORDER BY name").fetchall()
+        return [dict(row) for row in rows]
 
 def delete_item(item_id, item_type):
-    """Delete album or track by ID."""
+    """Delete album or track by ID, and its artist if nothing else uses them.
+    
+    While a job is writing the artist is left for the next cleanup instead,
+    since the job may be about to store more items by them.
+    """
     table = "Albums" if item_type == "album" else "Tracks"
     with get_connection() as conn:
-        conn.execute(f"DELETE FROM {table} WHERE id = ?", (item_id,))
+        row = conn.execute(f"DELETE FROM {table} WHERE id = ? RETURNING artist_id", (item_id,)).fetchone()
+        if row is None:
+            return
+        if not _jobs_writing(conn):
+            conn.execute(f"DELETE FROM Artists WHERE id IN (SELECT id FROM Artists ar WHERE id = ? AND {UNUSED_ARTIST})",
+                         (row["artist_id"],))
+        _bump_change_version(conn)
 
-def export_database_csv():
-    """Export all database tables to a CSV file."""
-    import csv
-    tables = {
-        "artists": ["id", "name", "genres", "uri", "url"],
-        "albums": ["id", "artist_id", "name", "release_year", "uri", "url"],
-        "tracks": ["id", "artist_id", "album_id", "name", "release_year", "uri", "url"],
-    }
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+def iter_database_csv(chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """Yield the CSV export of all tables as text chunks of up to chunk_size rows.
     
-    try:
-        export_file = os.path.join(BASE_DIR, "export.csv")
-        with open(export_file, "w", newline="", encoding="utf-8") as file:
-            writer = csv.writer(file)
-            for table, columns in tables.items():
-                writer.writerow([f"[{table}]"])
-                writer.writerow(columns)
-                with get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
-                    writer.writerows(cursor.fetchall())
-                writer.writerow([])  # Blank line between tables
-        return export_file
-    except Exception as e:
-        raise e
-
-def import_database_csv(import_file):
-    """Import database data from a CSV file."""
+    Rows are read through a cursor, so memory use doesn't grow with the
+    library. The export uses its own connection inside one read transaction,
+    which gives a consistent snapshot while other requests keep writing.
+    """
     import csv
+    import io
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
     
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+    
+    conn = _connect()
     try:
-        with open(import_file, "r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            current_table = None
-            headers = []
-            data = []
+        conn.execute("BEGIN")
+        for table, columns in TABLE_COLUMNS.items():
+            section = table.lower()
+            writer.writerow([f"[{section}]"])
+            writer.writerow(columns)
             
-            for row in reader:
-                if not row:
-                    continue
-                if row[0].startswith("[") and row[0].endswith("]"):
-                    if current_table and data:
-                        _insert_csv_data(current_table, headers, data)
-                        data = []
-                    current_table = row[0][1:-1]
-                    headers = []
-                elif not headers:
-                    headers = row
-                else:
-                    data.append(row)
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            written = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                written += len(rows)
+                yield flush()
+                if progress:
+                    progress(**{section: written})
+            writer.writerow([])  # Blank line between tables
+        yield flush()
+    finally:
+        # Also ends the read transaction if the client went away mid-download
+        conn.close()
+
+def export_database_csv(export_file, progress=None):
+    """Export all database tables to a CSV file, reporting rows written per table to progress."""
+    with open(export_file, "w", newline="", encoding="utf-8") as file:
+        for chunk in iter_database_csv(progress=progress):
+            file.write(chunk)
+    return export_file
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+MAX_REPORTED_ERRORS = 20
+
+def _csv_table(section, headers):
+    """Map a CSV section name and header row to a table, or raise ValueError."""
+    table = {name.lower(): name for name in TABLE_COLUMNS}.get(section.lower())
+    if not table:
+        raise ValueError(f"unknown table [{section}]")
+    unknown = set(headers) - set(TABLE_COLUMNS[table])
+    if unknown:
+        raise ValueError(f"unknown columns for {table}: {', '.join(sorted(unknown))}")
+    missing = [column for column in REQUIRED_COLUMNS[table] if column not in headers]
+    if missing:
+        raise ValueError(f"{table} section needs {', '.join(REQUIRED_COLUMNS[table])} columns, "
+                         f"missing {', '.join(missing)}")
+    return table
+
+def _validate_csv_row(table, headers, row):
+    """Check and convert one CSV row. Returns the row as a tuple or raises ValueError."""
+    if len(row) != len(headers):
+        raise ValueError(f"expected {len(headers)} columns, got {len(row)}")
+    values = dict(zip(headers, row))
+    for column in ("id", "name", "artist_id", "album_id"):
+        if column in values and not values[column]:
+            raise ValueError(f"empty {column}")
+    if "release_year" in values:
+        year = values["release_year"].strip()
+        if year and not year.isdigit():
+            raise ValueError(f"invalid release_year {year!r}")
+        values["release_year"] = int(year) if year else None
+    return tuple(values[column] for column in headers)
+
+def import_database_csv(import_file, progress=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import database data from a CSV export, committing every chunk_size rows.
+    
+    ``import_file`` is a path or an open file. Rows are read one at a time;
+    rows with the wrong number of columns, bad values or an unknown artist are
+    rejected instead of failing the import. Returns a report with rows
+    accepted and rejected per table, the first errors and the throughput.
+    """
+    import csv
+    import io
+    
+    started = time.monotonic()
+    report = {"tables": {}, "errors": []}
+    
+    def reject(section, line, message, count=1):
+        report["tables"].setdefault(section, {"accepted": 0, "rejected": 0})["rejected"] += count
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append(f"line {line}: {message}")
+    
+    def flush(section, table, headers, pending):
+        """Write validated rows whose artist exists, as one transaction."""
+        stats = report["tables"].setdefault(section, {"accepted": 0, "rejected": 0})
+        if "artist_id" in headers:
+            artist_index = headers.index("artist_id")
+            known = set()
+            with get_connection() as conn:
+                artist_ids = list({row[artist_index] for _, row in pending})
+                for start in range(0, len(artist_ids), 500):
+                    chunk = artist_ids[start:start + 500]
+                    known.update(r["id"] for r in conn.execute(
+                        f"SELECT id FROM Artists WHERE id IN ({','.join(['?'] * len(chunk))})", chunk
+                    ))
+            for line, row in pending:
+                if row[artist_index] not in known:
+                    reject(section, line, f"unknown artist_id {row[artist_index]!r}")
+            pending = [(line, row) for line, row in pending if row[artist_index] in known]
+        
+        _bulk_upsert(table, (row for _, row in pending), headers)
+        stats["accepted"] += len(pending)
+        if progress:
+            progress(**{name: counts["accepted"] for name, counts in report["tables"].items()},
+                     rejected=sum(counts["rejected"] for counts in report["tables"].values()))
+    
+    if isinstance(import_file, (str, bytes, os.PathLike)):
+        file = open(import_file, "r", encoding="utf-8", newline="")
+    elif isinstance(import_file, io.TextIOBase):
+        file = import_file
+    else:
+        file = io.TextIOWrapper(import_file, encoding="utf-8", newline="")
+    
+    with file:
+        reader = csv.reader(file)
+        section = table = None
+        headers = []
+        pending = []
+        
+        for row in reader:
+            if not row:
+                continue
+            if row[0].startswith("[") and row[0].endswith("]"):
+                if table and pending:
+                    flush(section, table, headers, pending)
+                section, table, headers, pending = row[0][1:-1], None, [], []
+            elif section is None:
+                reject("unknown", reader.line_num, "row outside of a [table] section")
+            elif not headers:
+                headers = row
+                try:
+                    table = _csv_table(section, headers)
+                except ValueError as e:
+                    reject(section, reader.line_num, str(e), count=0)
+            elif not table:
+                report["tables"].setdefault(section, {"accepted": 0, "rejected": 0})["rejected"] += 1
+            else:
+                try:
+                    pending.append((reader.line_num, _validate_csv_row(table, headers, row)))
+                except ValueError as e:
+                    reject(section, reader.line_num, str(e))
+                if len(pending) >= chunk_size:
+                    flush(section, table, headers, pending)
+                    pending = []
+        
+        if table and pending:
+            flush(section, table, headers, pending)
+    
+    report["seconds"] = round(time.monotonic() - started, 3)
+    rows = sum(counts["accepted"] + counts["rejected"] for counts in report["tables"].values())
+    report["rows_per_second"] = round(rows / report["seconds"]) if report["seconds"] else rows
+    return report
+
+# An artist is unused once no album or track references it and no followed
+# artists sync recorded it; each test is an index lookup (idx_albums_artist,
+# idx_tracks_artist, idx_synced_items_item), so no union of IDs is built.
+UNUSED_ARTIST = """
+    NOT EXISTS (SELECT 1 FROM Albums WHERE artist_id = ar.id)
+    AND NOT EXISTS (SELECT 1 FROM Tracks WHERE artist_id = ar.id)
+    AND NOT EXISTS (SELECT 1 FROM SyncedItems WHERE kind = 'artist' AND item_id = ar.id)
+"""
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "1000"))
+ACTIVE_JOB_SECONDS = 600
+
+def _jobs_writing(conn):
+    """Whether a job may be storing albums or tracks whose artists it already wrote."""
+    return conn.execute(
+        "SELECT 1 FROM Jobs WHERE status IN ('queued', 'running') AND updated_at > ? LIMIT 1",
+        (time.time() - ACTIVE_JOB_SECONDS,)
+    ).fetchone() is not None
+
+def cleanup_unused_artists(batch_size=CLEANUP_BATCH_SIZE):
+    """Delete artists not linked to any tracks or albums, except followed ones.
+    
+    Artists are checked batch_size rows at a time in rowid order, one short
+    write transaction per batch, so other writers are never held up for long.
+    Returns the number of artists deleted.
+    """
+    removed = 0
+    after = 0
+    with get_connection() as conn:
+        while True:
+            upto = conn.execute(
+                "SELECT MAX(rowid) FROM (SELECT rowid FROM Artists WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                (after, batch_size)
+            ).fetchone()[0]
+            if upto is None:
+                return removed
             
-            if current_table and data:
-                _insert_csv_data(current_table, headers, data)
-                
-    except Exception as e:
-        raise e
-
-def _insert_csv_data(table, columns, data):
-    """Helper function to insert CSV data into specified table."""
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            placeholders = ",".join(["?"] * len(columns))
-            cursor.executemany(
-                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
-                data
-            )
-            conn.commit()
-    except Exception as e:
-        raise e
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                cursor = conn.execute(f"""
+                    DELETE FROM Artists WHERE rowid IN (
+                        SELECT rowid FROM Artists ar
+                        WHERE rowid > ? AND rowid <= ? AND {UNUSED_ARTIST}
+                    )
+                """, (after, upto))
+                if cursor.rowcount:
+                    _bump_change_version(conn)
+            removed += cursor.rowcount
+            after = upto
 
-def cleanup_unused_artists():
-    """Delete artists not linked to any tracks or albums."""
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                DELETE FROM Artists
-                WHERE id NOT IN (
-                    SELECT DISTINCT artist_id FROM Tracks
-                    UNION
-                    SELECT DISTINCT artist_id FROM Albums
-                )
-            """)
-            conn.commit()
-            return cursor.rowcount
-    except Exception as e:
-        raise e
+def sweep_unused_artists(batch_size=CLEANUP_BATCH_SIZE):
+    """cleanup_unused_artists, skipped while jobs are writing (an import's artists
+    may arrive chunks before their albums and tracks).
+    
+    Used by the background sweep and /cleanup. Returns the number of artists
+    deleted, or None when the sweep was skipped.
+    """
+    if _jobs_writing(get_connection()):
+        return None
+    return cleanup_unused_artists(batch_size)
+
+def claim_maintenance(task, interval):
+    """Claim a periodic task if it last ran interval seconds ago or more.
+    
+    Only one worker's claim succeeds per interval, so tasks run once however
+    many processes serve the app.
+    """
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO Maintenance (task, last_run) VALUES (?, 0)", (task,))
+        return conn.execute(
+            "UPDATE Maintenance SET last_run = ? WHERE task = ? AND last_run <= ?",
+            (now, task, now - interval)
+        ).rowcount == 1
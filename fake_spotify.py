@@ -0,0 +1,241 @@
+import json
+import random
+import threading
+from collections import Counter
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+GENRE_WORDS = ["rock", "pop", "jazz", "indie", "folk", "metal", "soul", "house", "techno", "punk",
+               "blues", "ambient", "hip hop", "country", "disco", "funk", "grunge", "reggae", "trap", "swing"]
+NAME_WORDS = ["Blue", "Night", "Silver", "River", "Echo", "Golden", "Paper", "Velvet", "Neon", "Wild",
+              "Glass", "Quiet", "Electric", "Hollow", "Crimson", "Lucky", "Static", "Northern", "Sugar", "Iron"]
+
+def spotify_id(prefix, number):
+    """A 22 character ID, the length real Spotify IDs (and parse_spotify_url) have."""
+    return f"{prefix}{number:0>{22 - len(prefix)}}"
+
+def genre_pool(count):
+    """count distinct genre names, e.g. 'indie rock', 'jazz 3'."""
+    pool = GENRE_WORDS + [f"{a} {b}" for a in GENRE_WORDS for b in GENRE_WORDS if a != b]
+    return [pool[i] if i < len(pool) else f"{pool[i % len(pool)]} {i // len(pool)}" for i in range(count)]
+
+class Catalog:
+    """A deterministic synthetic music library shaped like Spotify API objects.
+
+    Every album and track has one artist; albums have several tracks. The
+    same seed and sizes always give the same library.
+    """
+
+    def __init__(self, artists=1000, albums=5000, tracks=20000, genres=200, seed=1, prefix="bench"):
+        rng = random.Random(seed)
+        pool = genre_pool(genres)
+
+        def name(words):
+            return " ".join(rng.choice(NAME_WORDS) for _ in range(words))
+
+        self.artists = [{
+            "type": "artist",
+            "id": spotify_id(f"{prefix}ar", i),
+            "name": f"{name(2)} {i}",
+            "genres": rng.sample(pool, min(len(pool), rng.randint(0, 4))),
+            "uri": f"spotify:artist:{spotify_id(f'{prefix}ar', i)}",
+            "external_urls": {"spotify": f"https://open.spotify.com/artist/{spotify_id(f'{prefix}ar', i)}"},
+        } for i in range(artists)]
+
+        self.albums = []
+        for i in range(albums):
+            artist = self.artists[rng.randrange(artists)]
+            album_id = spotify_id(f"{prefix}al", i)
+            self.albums.append({
+                "type": "album",
+                "id": album_id,
+                "name": name(rng.randint(1, 3)),
+                "artists": [{"id": artist["id"], "name": artist["name"]}],
+                "release_date": f"{rng.randint(1960, 2024)}-{rng.randint(1, 12):02d}-01",
+                "uri": f"spotify:album:{album_id}",
+                "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+            })
+
+        self.tracks = []
+        for i in range(tracks):
+            album = self.albums[i % albums] if albums else None
+            artist = album["artists"][0] if album else self.artists[rng.randrange(artists)]
+            track_id = spotify_id(f"{prefix}tr", i)
+            self.tracks.append({
+                "type": "track",
+                "id": track_id,
+                "name": name(rng.randint(1, 4)),
+                "artists": [artist],
+                "album": {
+                    "id": album["id"] if album else spotify_id(f"{prefix}al", i),
+                    "name": album["name"] if album else "Single",
+                    "release_date": album["release_date"] if album else "2000-01-01",
+                },
+                "uri": f"spotify:track:{track_id}",
+                "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+            })
+
+        self.by_id = {item["id"]: item for item in self.artists + self.albums + self.tracks}
+        self.albums_by_artist = {}
+        for album in self.albums:
+            self.albums_by_artist.setdefault(album["artists"][0]["id"], []).append(album)
+
+def _saved(items, key, added_at):
+    return [{"added_at": added_at(i), key: item} for i, item in enumerate(items)]
+
+class FakeSpotify:
+    """A local HTTP server answering the Web API calls the app makes, from a Catalog.
+
+    Every request waits ``latency`` seconds; a ``rate_429`` fraction of them
+    get a 429 with a Retry-After of ``retry_after`` seconds, and fail_next()
+    fails an exact number of upcoming requests. Point a spotipy
+    client at ``url`` by setting its ``prefix`` (see SPOTIFY_API_URL in
+    spotify_client.py). The whole catalog counts as the user's saved tracks,
+    saved albums and followed artists.
+    """
+
+    def __init__(self, catalog, latency=0.0, rate_429=0.0, retry_after=0, seed=1):
+        self.catalog = catalog
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        # Requests per path, e.g. paths["albums"] for the multi-get endpoint
+        self.paths = Counter()
+        self.failures = []
+
+        # Newest first, as Spotify returns saved items
+        newest = time.time()
+        def added_at(i):
+            return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(newest - i * 60))
+        self.saved = {
+            "tracks": _saved(catalog.tracks, "track", added_at),
+            "albums": _saved(catalog.albums, "album", added_at),
+        }
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                fake._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/"
+        self.thread = None
+
+    def start(self):
+        # A short poll interval so stop() doesn't wait long for shutdown
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05},
+                                       name="fake-spotify", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def fail_next(self, count, status=429, retry_after=None):
+        """Answer the next ``count`` requests with ``status``, with a Retry-After header when given."""
+        with self.lock:
+            self.failures += [(status, retry_after)] * count
+
+    def _handle(self, request):
+        parts = [part for part in urlparse(request.path).path.split("/")[2:] if part]
+        with self.lock:
+            self.requests += 1
+            self.paths["/".join(parts)] += 1
+            if self.failures:
+                failure = self.failures.pop(0)
+            elif self.rng.random() < self.rate_429:
+                failure = (429, self.retry_after)
+            else:
+                failure = None
+            if failure and failure[0] == 429:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if failure:
+            status, retry_after = failure
+            message = "API rate limit exceeded" if status == 429 else HTTPStatus(status).phrase
+            body = {"error": {"status": status, "message": message}}
+            headers = {} if retry_after is None else {"Retry-After": str(retry_after)}
+        else:
+            url = urlparse(request.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                status, body = 200, self._route(parts, query)
+            except KeyError:
+                status, body = 404, {"error": {"status": 404, "message": "Not found"}}
+            headers = {}
+
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _page(self, path, items, query, default_limit=20):
+        limit, offset = int(query.get("limit", default_limit)), int(query.get("offset", 0))
+        following = offset + limit < len(items)
+        return {
+            "items": items[offset:offset + limit],
+            "total": len(items),
+            "limit": limit,
+            "offset": offset,
+            "next": f"{self.url}{path}?{urlencode({**query, 'offset': offset + limit})}" if following else None,
+        }
+
+    def _route(self, parts, query):
+        """Answer GET /v1/<parts...>; unknown paths and IDs raise KeyError."""
+        catalog = self.catalog
+        if parts == ["me"]:
+            return {"id": "bench-user", "display_name": "Benchmark"}
+        if parts == ["me", "tracks"]:
+            return self._page("me/tracks", self.saved["tracks"], query)
+        if parts == ["me", "albums"]:
+            return self._page("me/albums", self.saved["albums"], query)
+        if parts == ["me", "following"]:
+            # Followed artists are cursor-paged by the last artist ID
+            limit, after = int(query.get("limit", 20)), query.get("after")
+            start = next((i + 1 for i, artist in enumerate(catalog.artists) if artist["id"] == after), 0)
+            items = catalog.artists[start:start + limit]
+            following = start + limit < len(catalog.artists)
+            return {"artists": {
+                "items": items,
+                "total": len(catalog.artists),
+                "cursors": {"after": items[-1]["id"] if items and following else None},
+                "next": f"{self.url}me/following?{urlencode({'type': 'artist', 'limit': limit, 'after': items[-1]['id']})}"
+                        if items and following else None,
+            }}
+        if len(parts) == 1 and parts[0] in ("artists", "albums", "tracks"):
+            return {parts[0]: [catalog.by_id.get(item_id) for item_id in query["ids"].split(",")]}
+        if len(parts) == 2 and parts[0] in ("artists", "albums", "tracks"):
+            return catalog.by_id[parts[1]]
+        if len(parts) == 3 and parts[0] == "artists" and parts[2] == "albums":
+            return self._page(f"artists/{parts[1]}/albums", catalog.albums_by_artist.get(parts[1], []), query)
+        if len(parts) == 3 and parts[0] == "playlists" and parts[2] == "tracks":
+            # Every playlist holds the whole catalog's tracks
+            return self._page(f"playlists/{parts[1]}/tracks", self.saved["tracks"], query, default_limit=100)
+        raise KeyError(parts)
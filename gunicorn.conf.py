@@ -0,0 +1,17 @@
+import os
+
+# Serving modes, picked with SERVER_MODE:
+#   sync      each worker process serves one request at a time (gunicorn's default worker)
+#   threaded  each worker serves up to THREADS requests at once on a thread pool, so
+#             requests waiting on Spotify (/add, /add/bulk) or streaming job progress
+#             don't hold up the rest; database connections are already per thread
+SERVER_MODE = os.getenv("SERVER_MODE", "sync").lower()
+if SERVER_MODE not in ("sync", "threaded"):
+    raise ValueError(f"Unknown SERVER_MODE {SERVER_MODE!r}, use 'sync' or 'threaded'")
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+
+if SERVER_MODE == "threaded":
+    worker_class = "gthread"
+    threads = int(os.getenv("THREADS", "16"))
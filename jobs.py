@@ -0,0 +1,108 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import database
+import metrics
+
+# Jobs run on threads of the worker process that accepted them; their state
+# lives in the Jobs table so any worker can report on them.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_STREAM_SECONDS = int(os.getenv("JOB_STREAM_SECONDS", "25"))
+FINISHED = ("done", "failed")
+
+JOBS = metrics.Counter("jobs_total", "Background jobs finished by kind and status")
+JOB_SECONDS = metrics.Histogram("job_duration_seconds", "Background job run time by kind", buckets=metrics.JOB_BUCKETS)
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+class Progress:
+    """Callable handed to a job to report its counters, e.g. progress(fetched=100)."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.counters = {}
+
+    def __call__(self, **counters):
+        self.counters.update(counters)
+        database.update_job(self.job_id, progress=self.counters)
+
+def submit(kind, func, *args, **kwargs):
+    """Run func(progress, *args, **kwargs) in the background. Returns the job ID.
+
+    The function's return value (JSON-serialisable) becomes the job result;
+    an exception marks the job failed with its message.
+    """
+    job_id = uuid.uuid4().hex
+    database.create_job(job_id, kind, _process_identity(os.getpid()))
+    _executor.submit(_run, job_id, kind, func, args, kwargs)
+    return job_id
+
+def _run(job_id, kind, func, args, kwargs):
+    database.update_job(job_id, status="running")
+    start = time.perf_counter()
+    try:
+        result = func(Progress(job_id), *args, **kwargs)
+        database.update_job(job_id, status="done", result=result)
+        status = "done"
+    except Exception as e:
+        database.update_job(job_id, status="failed", error=str(e))
+        status = "failed"
+    JOB_SECONDS.observe(time.perf_counter() - start, kind=kind)
+    JOBS.inc(kind=kind, status=status)
+
+def _process_identity(pid):
+    """An ID of the running process with this PID, or None when there is none.
+
+    Restarted hosts and containers hand out the same (often low) PIDs again,
+    so the ID adds the boot ID and the process start time where /proc has
+    them; elsewhere it is just the PID of a live process.
+    """
+    if os.path.isdir("/proc/self"):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # Field 22, the start time in clock ticks since boot, counted after the ")" ending the name
+                started = f.read().rsplit(")", 1)[1].split()[19]
+            with open("/proc/sys/kernel/random/boot_id") as f:
+                boot_id = f.read().strip()
+        except (OSError, IndexError):
+            return None
+        return f"{boot_id}:{pid}:{started}"
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return str(pid)
+
+def get_job(job_id):
+    """Get a job, marking it failed if the worker running it has gone away."""
+    job = database.get_job(job_id)
+    if job and job["status"] not in FINISHED and _process_identity(job["pid"]) != job["worker"]:
+        database.update_job(job_id, status="failed", error="The worker running this job exited")
+        job = database.get_job(job_id)
+    return job
+
+def stream_events(job_id, poll_interval=0.5):
+    """Yield Server-Sent Events with the job's state whenever it changes.
+
+    The stream ends when the job finishes or after JOB_STREAM_SECONDS so it
+    never ties up a worker for long; EventSource clients reconnect by themselves.
+    """
+    yield "retry: 1000\n\n"
+    deadline = time.monotonic() + JOB_STREAM_SECONDS
+    last_update = None
+    while time.monotonic() < deadline:
+        job = get_job(job_id)
+        if not job:
+            yield f"event: gone\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+            return
+        if job["updated_at"] != last_update:
+            last_update = job["updated_at"]
+            yield f"data: {json.dumps(job)}\n\n"
+        if job["status"] in FINISHED:
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,50 @@
+import os
+import threading
+import time
+import database
+
+# Seconds between runs of each periodic task; 0 turns a task off
+ORPHAN_SWEEP_INTERVAL = int(os.getenv("ORPHAN_SWEEP_INTERVAL", "0"))
+OPTIMIZE_INTERVAL = int(os.getenv("OPTIMIZE_INTERVAL", str(3600)))
+ANALYZE_INTERVAL = int(os.getenv("ANALYZE_INTERVAL", str(24 * 3600)))
+MAINTENANCE_POLL_SECONDS = 60
+
+# name: (interval, function); functions return something JSON-friendly
+TASKS = {
+    # Deletes artists nothing uses any more
+    "orphan-sweep": (ORPHAN_SWEEP_INTERVAL, database.sweep_unused_artists),
+    # Keeps the query planner's statistics current as the library grows
+    "optimize": (OPTIMIZE_INTERVAL, database.optimize_database),
+    "analyze": (ANALYZE_INTERVAL, lambda: database.optimize_database(full=True)),
+}
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+def run_due_tasks():
+    """Run the periodic tasks that are due and that this worker claims. Returns {task: result}."""
+    results = {}
+    for name, (interval, task) in TASKS.items():
+        if interval > 0 and database.claim_maintenance(name, interval):
+            results[name] = task()
+    return results
+
+def _loop():
+    while True:
+        try:
+            run_due_tasks()
+        except Exception:
+            # A locked or busy database just means trying again next time
+            pass
+        time.sleep(MAINTENANCE_POLL_SECONDS)
+
+def start():
+    """Start this process's maintenance thread, once; forked workers start their own."""
+    global _started_pid
+    if not any(interval > 0 for interval, _ in TASKS.values()):
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    threading.Thread(target=_loop, name="maintenance", daemon=True).start()
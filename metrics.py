@@ -0,0 +1,203 @@
+import atexit
+import bisect
+import os
+import re
+import threading
+import time
+
+# Each worker counts in memory and adds its counts to the shared Metrics table
+# every METRICS_FLUSH_SECONDS, so /metrics on any worker shows every worker's totals
+METRICS_ENABLED = os.getenv("METRICS", "on").lower() not in ("0", "off", "false", "no")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Histogram upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0, 1800.0, 3600.0)
+
+_metrics = {}
+# Counts since the last flush: counters by (name, labels), histograms by
+# (histogram, labels) as per-bucket counts followed by the sum and count
+_pending = {}
+_pending_histograms = {}
+_lock = threading.Lock()
+_started_pid = None
+_start_lock = threading.Lock()
+_save = None
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    """Prometheus label set text, e.g. '{method="GET",route="/"}'; '' without labels."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _add(samples):
+    with _lock:
+        for key, amount in samples:
+            _pending[key] = _pending.get(key, 0) + amount
+
+class Metric:
+    """A named metric family; its samples are kept per label set."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._keys = {}
+        _metrics[name] = self
+
+    def _label_text(self, labels):
+        key = tuple(sorted(labels.items()))
+        text = self._keys.get(key)
+        if text is None:
+            text = self._keys[key] = _format_labels(key)
+        return text
+
+class Counter(Metric):
+    """A total that only goes up, e.g. requests served."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if METRICS_ENABLED:
+            _add([((self.name, self._label_text(labels)), amount)])
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.bucket_labels = ["+Inf" if bound == float("inf") else repr(bound) for bound in self.buckets]
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (self, self._label_text(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = _pending_histograms.get(key)
+            if counts is None:
+                counts = _pending_histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self, labels, counts):
+        """Prometheus samples for one label set: cumulative buckets (all of them, even at 0), sum and count."""
+        prefix = labels[:-1] + "," if labels else "{"
+        samples = []
+        total = 0
+        for bucket_label, count in zip(self.bucket_labels, counts):
+            total += count
+            samples.append((f"{self.name}_bucket", f'{prefix}le="{bucket_label}"}}', total))
+        samples.append((f"{self.name}_sum", labels, counts[-2]))
+        samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+def take():
+    """Remove and return this worker's counts since the last call as [(name, labels, value)]."""
+    global _pending, _pending_histograms
+    with _lock:
+        pending, _pending = _pending, {}
+        histograms, _pending_histograms = _pending_histograms, {}
+    samples = [(name, labels, value) for (name, labels), value in pending.items()]
+    for (histogram, labels), counts in histograms.items():
+        samples += histogram.samples(labels, counts)
+    return samples
+
+def flush():
+    """Add this worker's pending counts to the shared totals; kept for the next flush if that fails."""
+    if _save is None:
+        return
+    samples = take()
+    if not samples:
+        return
+    try:
+        _save(samples)
+    except Exception:
+        _add(((name, labels), value) for name, labels, value in samples)
+        raise
+
+def _loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception:
+            # A locked database just means flushing more next time
+            pass
+
+def start(save):
+    """Start this process's flush thread, once, storing counts with save(samples).
+
+    Counts a forked worker inherited from its parent are dropped, since the
+    parent flushes (or loses) them itself.
+    """
+    global _started_pid, _save
+    if not METRICS_ENABLED:
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        _save = save
+    take()
+    threading.Thread(target=_loop, name="metrics", daemon=True).start()
+    # Registered now, after database's, so it runs before the connections are closed
+    atexit.register(_flush_at_exit)
+
+def _flush_at_exit():
+    if _started_pid == os.getpid():
+        try:
+            flush()
+        except Exception:
+            pass
+
+_LE = re.compile(r'[{,]le="([^"]+)"\}$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+_UNESCAPE = re.compile(r'\\(.)')
+
+def parse_labels(labels):
+    """The {name: value} dict of a stored label set text, e.g. '{method="GET"}'."""
+    return {
+        name: _UNESCAPE.sub(lambda match: "\n" if match.group(1) == "n" else match.group(1), value)
+        for name, value in _LABEL.findall(labels)
+    }
+
+def _sample_order(sample):
+    """Sort key keeping each label set's buckets in ascending le order."""
+    name, labels, _ = sample
+    match = _LE.search(labels)
+    if not match:
+        return (labels, name, 0.0)
+    return (labels[:match.start()], name, float(match.group(1)))
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def render(samples):
+    """Prometheus text exposition of stored [(name, labels, value)] samples for the known metrics."""
+    families = {name: [] for name in _metrics}
+    for sample in samples:
+        name = sample[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in _metrics:
+                name = name[:-len(suffix)]
+                break
+        if name in families:
+            families[name].append(sample)
+
+    lines = []
+    for name, family_samples in families.items():
+        metric = _metrics[name]
+        lines.append(f"# HELP {name} {metric.help_text}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for sample_name, labels, value in sorted(family_samples, key=_sample_order):
+            lines.append(f"{sample_name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+import database
+import spotify_client
+
+# Tokens are refreshed in the background once they have less than this many
+# seconds left, and inline (one refresh per user) once they are about to expire
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_MIN_VALIDITY = 60
+TOKEN_REFRESH_LEASE = 30
+MAX_CACHED_CLIENTS = int(os.getenv("MAX_CACHED_CLIENTS", "256"))
+
+class _NoCacheHandler(CacheHandler):
+    """Keeps spotipy from writing tokens to a shared .cache file; they live in OAuthTokens."""
+
+    def get_cached_token(self):
+        return None
+
+    def save_token_to_cache(self, token_info):
+        pass
+
+_oauth = None
+
+def get_oauth():
+    """The app's SpotifyOAuth helper, created once per process."""
+    global _oauth
+    if _oauth is None:
+        _oauth = SpotifyOAuth(
+            client_id=os.getenv("SPOTIPY_CLIENT_ID"),
+            client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
+            redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI", "http://localhost:5000/callback"),
+            scope="user-follow-read user-library-read",
+            cache_handler=_NoCacheHandler()
+        )
+    return _oauth
+
+class StoredTokenManager:
+    """spotipy auth manager that serves one user's token from the OAuthTokens store.
+
+    The token is kept in memory until it nears expiry. Refreshes are single
+    flight: one thread per process takes the lock, and one worker takes the
+    database lease; everyone else waits for the token it stores.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.token_info = None
+        self.lock = threading.Lock()
+
+    def get_access_token(self, as_dict=False):
+        token_info = self._current()
+        return token_info if as_dict else token_info["access_token"]
+
+    def _remaining(self, token_info):
+        return token_info["expires_at"] - time.time()
+
+    def _reload(self):
+        token_info = database.get_oauth_token(self.key)
+        if token_info is None:
+            raise LookupError("Spotify login expired, please log in again")
+        self.token_info = token_info
+        return token_info
+
+    def _current(self):
+        token_info = self.token_info
+        if token_info is None or self._remaining(token_info) <= TOKEN_REFRESH_MARGIN:
+            # Another worker may already have refreshed it
+            token_info = self._reload()
+
+        remaining = self._remaining(token_info)
+        if remaining <= TOKEN_MIN_VALIDITY:
+            return self._refresh()
+        if remaining <= TOKEN_REFRESH_MARGIN and not self.lock.locked():
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return token_info
+
+    def _refresh(self):
+        with self.lock:
+            token_info = self._reload()
+            if self._remaining(token_info) > TOKEN_REFRESH_MARGIN:
+                return token_info
+
+            if database.acquire_oauth_refresh(self.key, TOKEN_REFRESH_LEASE):
+                try:
+                    token_info = get_oauth().refresh_access_token(token_info["refresh_token"])
+                except Exception:
+                    database.release_oauth_refresh(self.key)
+                    raise
+                database.save_oauth_token(self.key, token_info)
+                self.token_info = token_info
+                return token_info
+
+            # Another worker holds the lease: wait for the token it stores
+            deadline = time.time() + TOKEN_REFRESH_LEASE
+            while time.time() < deadline:
+                time.sleep(0.1)
+                token_info = self._reload()
+                if self._remaining(token_info) > TOKEN_REFRESH_MARGIN:
+                    return token_info
+            return token_info
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+def store_token(token_info, key=None):
+    """Store a new login's token and return the key to keep in the session."""
+    key = key or uuid.uuid4().hex
+    database.save_oauth_token(key, token_info)
+    with _clients_lock:
+        _clients.pop(key, None)
+    return key
+
+def forget(key):
+    """Log a session key out."""
+    database.delete_oauth_token(key)
+    with _clients_lock:
+        _clients.pop(key, None)
+
+def get_client(key):
+    """A rate-limited Spotify client for a stored token, reused across requests, or None."""
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+
+    if database.get_oauth_token(key) is None:
+        return None
+
+    client = spotify_client.create(auth_manager=StoredTokenManager(key))
+    with _clients_lock:
+        client = _clients.setdefault(key, client)
+        while len(_clients) > MAX_CACHED_CLIENTS:
+            _clients.popitem(last=False)
+    return client
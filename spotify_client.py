@@ -0,0 +1,171 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+import requests
+import spotipy
+import urllib3
+from spotipy.exceptions import SpotifyException
+import database
+import metrics
+
+# Spotify limits requests per app, so every worker draws from one bucket
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))
+SPOTIFY_BURST = int(os.getenv("SPOTIFY_BURST", "20"))
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "5"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_SECONDS = 0.5
+# Connections kept open to the API per client; raise it when many threads share one
+SPOTIFY_POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", "32"))
+# Base URL of the Web API; set it to point clients at a stand-in such as fake_spotify.py
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL")
+
+# Calls whose method name contains one of these words change data and are never coalesced
+WRITE_WORDS = {"add", "delete", "remove", "create", "change", "replace", "reorder", "follow", "unfollow",
+               "upload", "playback", "start", "pause", "seek", "repeat", "shuffle", "volume", "transfer"}
+
+API_CALLS = metrics.Counter("spotify_api_calls_total", "Spotify API calls by client method and outcome")
+API_CALL_SECONDS = metrics.Histogram("spotify_api_call_duration_seconds", "Spotify API call latency by client method")
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+class SpotifyClient:
+    """Wraps a spotipy client so every API call is rate limited, retried and measured.
+
+    Calls go through the shared RateLimits token bucket, 429 and 5xx
+    responses are retried with exponential backoff (a Retry-After pauses the
+    bucket for every worker), and identical read calls made concurrently
+    through the same client share one request and its result.
+    """
+
+    def __init__(self, client, bucket="spotify"):
+        self.client = client
+        self.bucket = bucket
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if WRITE_WORDS.intersection(name.split("_")):
+                return self._call(name, attr, args, kwargs)
+            return self._coalesced(name, attr, args, kwargs)
+        return call
+
+    def _coalesced(self, name, func, args, kwargs):
+        """Make the call, or wait for an identical one already in flight."""
+        key = (id(self.client), name, repr(args), repr(sorted(kwargs.items())))
+        with _in_flight_lock:
+            future = _in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = _in_flight[key] = Future()
+
+        if not leader:
+            API_CALLS.inc(method=name, outcome="coalesced")
+            return future.result()
+
+        try:
+            future.set_result(self._call(name, func, args, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _in_flight_lock:
+                del _in_flight[key]
+        return future.result()
+
+    def _call(self, name, func, args, kwargs):
+        """Make the call once a token is available, retrying throttled and failed requests."""
+        for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+            if SPOTIFY_RATE_LIMIT > 0:
+                wait = database.acquire_rate_limit(self.bucket, SPOTIFY_RATE_LIMIT, SPOTIFY_BURST)
+                if wait:
+                    time.sleep(wait)
+
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except SpotifyException as e:
+                seconds = time.perf_counter() - start
+                throttled = e.http_status == 429
+                API_CALL_SECONDS.observe(seconds, method=name)
+                API_CALLS.inc(method=name, outcome="throttled" if throttled else "error")
+                if e.http_status not in RETRY_STATUSES or attempt == SPOTIFY_MAX_RETRIES:
+                    raise
+
+                retry_after = (e.headers or {}).get("Retry-After")
+                delay = float(retry_after) if retry_after else BACKOFF_SECONDS * 2 ** attempt * (1 + random.random())
+                if throttled and SPOTIFY_RATE_LIMIT > 0:
+                    # Pause the shared bucket so other workers back off too
+                    database.block_rate_limit(self.bucket, delay)
+                else:
+                    time.sleep(delay)
+                continue
+            except Exception:
+                API_CALLS.inc(method=name, outcome="error")
+                raise
+
+            seconds = time.perf_counter() - start
+            API_CALL_SECONDS.observe(seconds, method=name)
+            API_CALLS.inc(method=name, outcome="ok")
+            return result
+
+def get_call_stats(samples):
+    """Calls, errors, 429s, coalesced calls and latency per client method from stored metric samples.
+
+    ``calls`` counts requests actually made (each retry included); errors
+    include the throttled ones. Busiest method first.
+    """
+    stats = {}
+    for name, labels, value in samples:
+        if name not in (API_CALLS.name, f"{API_CALL_SECONDS.name}_sum", f"{API_CALL_SECONDS.name}_count"):
+            continue
+        labels = metrics.parse_labels(labels)
+        method = stats.setdefault(labels["method"], {
+            "endpoint": labels["method"], "calls": 0, "errors": 0, "throttled": 0, "coalesced": 0,
+            "total_seconds": 0.0, "timed_calls": 0,
+        })
+        if name == API_CALLS.name:
+            outcome = labels["outcome"]
+            if outcome == "coalesced":
+                method["coalesced"] += int(value)
+                continue
+            method["calls"] += int(value)
+            if outcome != "ok":
+                method["errors"] += int(value)
+            if outcome == "throttled":
+                method["throttled"] += int(value)
+        elif name.endswith("_sum"):
+            method["total_seconds"] += value
+        else:
+            method["timed_calls"] += int(value)
+
+    for method in stats.values():
+        timed_calls = method.pop("timed_calls")
+        method["avg_seconds"] = method["total_seconds"] / timed_calls if timed_calls else 0.0
+    return sorted(stats.values(), key=lambda method: method["calls"], reverse=True)
+
+def create(bucket="spotify", **kwargs):
+    """Create a spotipy client wrapped in SpotifyClient.
+
+    spotipy's own status retries are turned off (connection retries stay) so
+    that 429s reach the wrapper instead of being slept through per request.
+    """
+    client = spotipy.Spotify(**kwargs)
+    if SPOTIFY_API_URL:
+        client.prefix = SPOTIFY_API_URL.rstrip("/") + "/"
+    retry = urllib3.Retry(
+        total=client.retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        respect_retry_after_header=False,
+        backoff_factor=client.backoff_factor
+    )
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry, pool_maxsize=SPOTIFY_POOL_SIZE)
+    client._session.mount("http://", adapter)
+    client._session.mount("https://", adapter)
+    return SpotifyClient(client, bucket)
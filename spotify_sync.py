@@ -0,0 +1,391 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+# Spotify's limits for paged library endpoints and the multi-get endpoints
+PAGE_SIZE = 50
+PLAYLIST_PAGE_SIZE = 100
+ARTIST_BATCH_SIZE = 50
+MULTI_GET = {
+    "artist": ("artists", ARTIST_BATCH_SIZE),
+    "album": ("albums", 20),
+    "track": ("tracks", 50),
+}
+
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "8"))
+
+# Table holding each kind of saved item
+ITEM_TABLES = {"album": "Albums", "track": "Tracks"}
+
+def build_artist_info(artist):
+    """Build the artist record stored by database.add_artist."""
+    return {
+        "artist_id": artist["id"],
+        "artist_name": artist["name"],
+        "genres": artist["genres"],
+        "uri": artist["uri"],
+        "external_urls": artist["external_urls"]
+    }
+
+def build_album_info(album, artist, url=None):
+    """Build the album record stored by database.add_album."""
+    return {
+        "type": "album",
+        "album_id": album["id"],
+        "artist_id": album["artists"][0]["id"],
+        "album_name": album["name"],
+        "artist_name": album["artists"][0]["name"],
+        "release_year": int(album["release_date"].split("-")[0]),
+        "album_uri": album["uri"],
+        "url": url or album["external_urls"]["spotify"],
+        "artist_info": build_artist_info(artist)
+    }
+
+def build_track_info(track, artist, url=None):
+    """Build the track record stored by database.add_track."""
+    return {
+        "type": "track",
+        "track_id": track["id"],
+        "artist_id": track["artists"][0]["id"],
+        "album_id": track["album"]["id"],
+        "track_name": track["name"],
+        "artist_name": track["artists"][0]["name"],
+        "release_year": int(track["album"]["release_date"].split("-")[0]),
+        "track_uri": track["uri"],
+        "url": url or track["external_urls"]["spotify"],
+        "artist_info": build_artist_info(artist)
+    }
+
+# Fields kept from each API payload, enough for the build_*_info helpers
+CACHED_FIELDS = {
+    "artist": ("id", "name", "genres", "uri", "external_urls"),
+    "album": ("id", "name", "artists", "release_date", "uri", "external_urls"),
+    "track": ("id", "name", "artists", "album", "uri", "external_urls"),
+}
+
+def slim_payload(kind, payload):
+    """Drop the parts of an API payload the app never reads before caching it."""
+    slim = {field: payload.get(field) for field in CACHED_FIELDS[kind]}
+    slim["artists"] = [{"id": a["id"], "name": a["name"]} for a in payload.get("artists", [])]
+    if kind == "track":
+        slim["album"] = {"id": payload["album"]["id"], "release_date": payload["album"]["release_date"]}
+    if kind == "artist":
+        del slim["artists"]
+    return slim
+
+def fetch_cached(kind, ids, fetch_many, use_cache=True):
+    """Resolve IDs through the shared metadata cache, fetching only the misses.
+
+    ``fetch_many`` takes a list of IDs and returns {id: payload}. Pass
+    ``use_cache=False`` to bypass the cache and refresh it from the API.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+
+    found = {}
+    if use_cache and database.METADATA_CACHE_ENABLED:
+        found = database.cache_get_many(kind, ids)
+
+    missing = [item_id for item_id in ids if item_id not in found]
+    if missing:
+        fetched = {item_id: slim_payload(kind, payload) for item_id, payload in fetch_many(missing).items()}
+        if database.METADATA_CACHE_ENABLED:
+            database.cache_put_many(kind, fetched)
+        found.update(fetched)
+    return found
+
+def get_album(client, album_id, use_cache=True):
+    """Get one album, from the cache when possible."""
+    return fetch_cached("album", [album_id], lambda ids: {i: client.album(i) for i in ids}, use_cache)[album_id]
+
+def get_track(client, track_id, use_cache=True):
+    """Get one track, from the cache when possible."""
+    return fetch_cached("track", [track_id], lambda ids: {i: client.track(i) for i in ids}, use_cache)[track_id]
+
+def get_artist(client, artist_id, use_cache=True):
+    """Get one artist, from the cache when possible."""
+    return fetch_cached("artist", [artist_id], lambda ids: {i: client.artist(i) for i in ids}, use_cache)[artist_id]
+
+def fetch_many(client, kind, item_ids, executor):
+    """Resolve IDs to full objects with the multi-get endpoint for ``kind``, batches in parallel.
+
+    IDs Spotify doesn't know are left out of the returned {id: payload}.
+    """
+    method, batch_size = MULTI_GET[kind]
+    ids = list(dict.fromkeys(item_ids))
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    found = {}
+    for result in executor.map(lambda batch: getattr(client, method)(batch), batches):
+        for payload in result[method]:
+            if payload:
+                found[payload["id"]] = payload
+    return found
+
+def fetch_artists(client, artist_ids, executor):
+    """Resolve artist IDs to full artist objects, 50 per request, in parallel."""
+    return fetch_many(client, "artist", artist_ids, executor)
+
+def fetch_saved_pages(fetch_page, executor, page_size=PAGE_SIZE):
+    """Yield (items, total) batches of items from an offset-paged endpoint.
+
+    The first page tells us the total; the remaining pages are then fetched
+    concurrently, one window of ``SYNC_WORKERS`` pages at a time so memory
+    stays bounded by the window rather than the library size.
+    """
+    first = fetch_page(limit=page_size, offset=0)
+    yield first["items"], first["total"]
+
+    offsets = list(range(page_size, first["total"], page_size))
+    for start in range(0, len(offsets), SYNC_WORKERS):
+        window = offsets[start:start + SYNC_WORKERS]
+        pages = executor.map(lambda offset: fetch_page(limit=page_size, offset=offset), window)
+        yield [item for page in pages for item in page["items"]], first["total"]
+
+def _add_counts(totals, counts):
+    """Accumulate the counts returned by the database bulk upserts."""
+    for key, value in counts.items():
+        totals[key] = totals.get(key, 0) + value
+    return totals
+
+def fetch_new_pages(fetch_page, since):
+    """Yield (items, None) batches of saved items added at or after ``since``, newest first.
+
+    Saved albums and tracks come newest first, so paging stops at the first
+    page that reaches items already seen by the previous sync.
+    """
+    offset = 0
+    while True:
+        page = fetch_page(limit=PAGE_SIZE, offset=offset)
+        # Items saved in the same second as the checkpoint are re-read; upserting them is a no-op
+        new_items = [item for item in page["items"] if item["added_at"] >= since]
+        yield new_items, None
+        if len(new_items) < len(page["items"]) or not page["next"]:
+            break
+        offset += PAGE_SIZE
+
+def _sync_saved(fetch_page, catalog_client, item_key, build_info, use_cache=True, user_id=None, full=False,
+                progress=None, page_size=PAGE_SIZE):
+    """Page through saved (or playlist) albums or tracks, enrich them with artist data and store them.
+
+    With a ``user_id`` the sync is incremental: only items saved since that
+    user's last checkpoint are fetched, unless ``full`` is set or there is no
+    checkpoint yet. A full sync also removes previously synced items that are
+    no longer saved. ``progress`` is called with running counters after each
+    batch. Returns inserted/updated/unchanged/removed counts.
+    """
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0, "removed": 0}
+    resolved = {}
+    stored_artists = set()
+    seen_ids = set()
+    fetched = 0
+
+    state = database.get_sync_state(user_id, item_key) if user_id else None
+    incremental = bool(state and state["high_water_mark"] and not full)
+    high_water_mark = state["high_water_mark"] if state else None
+
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+        if incremental:
+            pages = fetch_new_pages(fetch_page, high_water_mark)
+        else:
+            pages = fetch_saved_pages(fetch_page, executor, page_size)
+
+        for items, total in pages:
+            # Local files have no Spotify ID and podcast episodes in playlists aren't tracks
+            items = [
+                item for item in items
+                if item[item_key] and item[item_key]["id"] and item[item_key].get("type", item_key) == item_key
+            ]
+            entries = [item[item_key] for item in items]
+
+            missing = {entry["artists"][0]["id"] for entry in entries} - resolved.keys()
+            resolved.update(fetch_cached(
+                "artist", missing, lambda ids: fetch_artists(catalog_client, ids, executor), use_cache
+            ))
+
+            infos = []
+            for entry in entries:
+                artist = resolved.get(entry["artists"][0]["id"])
+                if not artist:
+                    continue
+                try:
+                    infos.append(build_info(entry, artist))
+                except Exception:
+                    # Malformed item, skip it and continue
+                    pass
+
+            # The window's new artists and its items share one transaction, so an
+            # artist cleanup never sees the artists without the items that use them
+            counts = database.add_items(infos, stored_artists)
+            _add_counts(totals, counts.get(ITEM_TABLES[item_key], {}))
+
+            fetched += len(items)
+            if progress:
+                progress(fetched=fetched, total=total, **totals)
+
+            if user_id:
+                database.record_synced_items(user_id, item_key, ((item[item_key]["id"], item["added_at"]) for item in items))
+                seen_ids.update(item[item_key]["id"] for item in items)
+                high_water_mark = max([high_water_mark or ""] + [item["added_at"] for item in items]) or None
+
+    if user_id:
+        if not incremental:
+            totals["removed"] = database.remove_unsynced_items(user_id, item_key, seen_ids)
+        database.save_sync_state(user_id, item_key, high_water_mark, full=not incremental)
+
+    return totals
+
+def sync_followed_artists(user_sp, progress=None, user_id=None):
+    """Store the user's followed artists. Returns inserted/updated/unchanged counts.
+
+    With a ``user_id`` the artists are also recorded as followed, which keeps
+    them when unused artists are cleaned up; artists no longer followed lose
+    that mark.
+    """
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0}
+    seen_ids = set()
+    results = user_sp.current_user_followed_artists(limit=PAGE_SIZE)
+
+    # Followed artists are cursor-paged, so pages can only be fetched in order
+    while results:
+        artists = results['artists']['items']
+
+        # These are full artist objects, so later album/track syncs can reuse them
+        if database.METADATA_CACHE_ENABLED:
+            database.cache_put_many("artist", {artist["id"]: slim_payload("artist", artist) for artist in artists})
+
+        _add_counts(totals, database.add_artists(build_artist_info(artist) for artist in artists))
+        if user_id:
+            database.record_synced_items(user_id, "artist", ((artist["id"], None) for artist in artists))
+            seen_ids.update(artist["id"] for artist in artists)
+        if progress:
+            progress(fetched=sum(totals.values()), total=results['artists'].get('total'), **totals)
+
+        if results['artists']['next']:
+            results = user_sp.next(results['artists'])
+        else:
+            break
+
+    if user_id:
+        database.remove_unsynced_items(user_id, "artist", seen_ids)
+    return totals
+
+def sync_saved_albums(user_sp, catalog_client, use_cache=True, user_id=None, full=False, progress=None):
+    """Store the user's saved albums. Returns inserted/updated/unchanged/removed counts."""
+    return _sync_saved(
+        user_sp.current_user_saved_albums, catalog_client, "album", build_album_info,
+        use_cache, user_id, full, progress
+    )
+
+def sync_saved_tracks(user_sp, catalog_client, use_cache=True, user_id=None, full=False, progress=None):
+    """Store the user's saved tracks. Returns inserted/updated/unchanged/removed counts."""
+    return _sync_saved(
+        user_sp.current_user_saved_tracks, catalog_client, "track", build_track_info,
+        use_cache, user_id, full, progress
+    )
+
+def import_playlist(client, playlist_id, use_cache=True, progress=None):
+    """Store every track of a playlist, fetching its pages concurrently once the total is known.
+
+    Returns inserted/updated/unchanged counts.
+    """
+    def fetch_page(limit, offset):
+        return client.playlist_items(playlist_id, limit=limit, offset=offset, additional_types=("track",))
+
+    totals = _sync_saved(
+        fetch_page, client, "track", build_track_info, use_cache,
+        progress=progress, page_size=PLAYLIST_PAGE_SIZE
+    )
+    del totals["removed"]
+    return totals
+
+def import_artist_albums(client, artist_id, use_cache=True, progress=None):
+    """Store an artist's discography (albums and singles). Returns inserted/updated/unchanged counts."""
+    def fetch_page(limit, offset):
+        page = client.artist_albums(artist_id, album_type="album,single", limit=limit, offset=offset)
+        # Wrap the albums like saved albums so the saved-items pipeline can store them
+        return {**page, "items": [{"album": album} for album in page["items"]]}
+
+    totals = _sync_saved(fetch_page, client, "album", build_album_info, use_cache, progress=progress)
+    del totals["removed"]
+    return totals
+
+# open.spotify.com links (optionally with an intl-xx/ prefix and query string) and spotify: URIs
+SPOTIFY_URL = re.compile(
+    r"^(?:https?://open\.spotify\.com/(?:intl-[\w-]+/)?(?P<url_kind>\w+)/(?P<url_id>[0-9A-Za-z]{22})(?:[/?#].*)?"
+    r"|spotify:(?P<uri_kind>\w+):(?P<uri_id>[0-9A-Za-z]{22}))$"
+)
+
+# Links that expand into many items, see import_playlist and import_artist_albums
+EXPANDED_KINDS = ("playlist", "artist")
+
+def parse_spotify_url(url):
+    """Return (kind, id) for a Spotify URL or URI, or None if it isn't one."""
+    match = SPOTIFY_URL.match(url.strip())
+    if not match:
+        return None
+    return match["url_kind"] or match["uri_kind"], match["url_id"] or match["uri_id"]
+
+def resolve_urls(client, urls, use_cache=True):
+    """Resolve album and track URLs to records with as few API calls as possible.
+
+    URLs are grouped by type and looked up with the multi-get endpoints, their
+    batches in parallel, followed by one round for all of their artists.
+    Returns a list with one ``(url, info, error)`` tuple per URL, in order.
+    """
+    parsed = [(url, parse_spotify_url(url)) for url in urls]
+    wanted = {"album": [], "track": []}
+    for _, target in parsed:
+        if target and target[0] in wanted:
+            wanted[target[0]].append(target[1])
+
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+        found = {
+            kind: fetch_cached(kind, ids, lambda missing, kind=kind: fetch_many(client, kind, missing, executor), use_cache)
+            for kind, ids in wanted.items()
+        }
+        artist_ids = [payload["artists"][0]["id"] for payloads in found.values() for payload in payloads.values()]
+        artists = fetch_cached("artist", artist_ids, lambda missing: fetch_artists(client, missing, executor), use_cache)
+
+    build_info = {"album": build_album_info, "track": build_track_info}
+    results = []
+    for url, target in parsed:
+        if not target:
+            results.append((url, None, "Not a Spotify URL"))
+            continue
+        kind, item_id = target
+        if kind in EXPANDED_KINDS:
+            results.append((url, None, f"Add {kind}s one at a time"))
+            continue
+        if kind not in build_info:
+            results.append((url, None, f"Unsupported link type: {kind}"))
+            continue
+        payload = found[kind].get(item_id)
+        artist = payload and artists.get(payload["artists"][0]["id"])
+        if not artist:
+            results.append((url, None, f"{kind.capitalize()} not found on Spotify"))
+            continue
+        try:
+            results.append((url, build_info[kind](payload, artist, url=url if "://" in url else None), None))
+        except Exception:
+            results.append((url, None, f"Malformed {kind} data"))
+    return results
+
+def add_urls(client, urls, use_cache=True):
+    """Resolve and store many album/track URLs in one transaction.
+
+    Returns one result dict per URL and the per-table database counts.
+    """
+    resolved = resolve_urls(client, urls, use_cache)
+    counts = database.add_items(info for _, info, _ in resolved if info)
+
+    results = []
+    for url, info, error in resolved:
+        if info:
+            name = info["album_name"] if info["type"] == "album" else info["track_name"]
+            results.append({"url": url, "ok": True, "type": info["type"], "id": info[f"{info['type']}_id"], "name": name})
+        else:
+            results.append({"url": url, "ok": False, "error": error})
+    return results, counts
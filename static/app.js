@@ -73,15 +73,29 @@ class SpotifyManager {
         e.preventDefault();
         const formData = new FormData(e.target);
         const btn = e.target.querySelector('button[type="submit"]');
+        // A list of links is resolved and stored in one request
+        const bulk = (formData.get('spotify_urls') || '').trim() !== '';
+        
+        if (!bulk && !(formData.get('spotify_url') || '').trim()) {
+            this.showMessage('Please enter a Spotify URL', 'error');
+            return;
+        }
         
         this.setLoading(btn, true);
         
         try {
-            const response = await fetch('/add', { method: 'POST', body: formData });
+            const response = await fetch(bulk ? '/add/bulk' : '/add', { method: 'POST', body: formData });
             const data = await response.json();
             
-            if (data.success) {
+            if (data.job_id) {
+                // Playlists and artists are imported in the background
+                this.closeModal();
+                const job = await followJob(data, 'Failed to add music. Please try again.');
+                if (job && window.location.pathname === '/browse') window.location.reload();
+            } else if (data.success) {
+                const failed = (data.results || []).filter(result => !result.ok);
                 this.showMessage(data.success, 'success');
+                failed.slice(0, 5).forEach(result => this.showMessage(`${result.url}: ${result.error}`, 'error'));
                 this.closeModal();
                 if (window.location.pathname === '/browse') {
                     setTimeout(() => window.location.reload(), 1000);
@@ -115,7 +129,11 @@ class SpotifyManager {
             const response = await fetch('/add', { method: 'POST', body: formData });
             const data = await response.json();
             
-            if (data.success) {
+            if (data.job_id) {
+                e.target.reset();
+                const job = await followJob(data, 'Failed to add music. Please try again.');
+                if (job) window.location.href = '/browse';
+            } else if (data.success) {
                 this.showMessage(data.success, 'success');
                 e.target.reset();
                 setTimeout(() => window.location.href = '/browse', 1500);
@@ -154,20 +172,52 @@ class SpotifyManager {
         }, 5000);
     }
 
-    // Utility functions for browse page
-    static initSearch(inputId, itemSelector) {
-        const input = document.getElementById(inputId);
-        const items = document.querySelectorAll(itemSelector);
+    // Persistent message for a running job; returns an updater and a close function
+    showProgress(message) {
+        const container = document.getElementById('messages');
+        const div = document.createElement('div');
+        div.className = 'message message-info';
+        div.textContent = message;
+        container.appendChild(div);
         
-        input?.addEventListener('input', function() {
-            const term = this.value.toLowerCase();
-            items.forEach(item => {
-                const searchData = item.dataset.search || item.textContent.toLowerCase();
-                item.style.display = searchData.includes(term) ? '' : 'none';
+        return {
+            update: (text) => { div.textContent = text; },
+            close: () => div.remove()
+        };
+    }
+
+    // Follow a background job over Server-Sent Events until it finishes
+    static watchJob(jobId, onProgress) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/jobs/${jobId}/events`);
+            source.onmessage = (e) => {
+                const job = JSON.parse(e.data);
+                onProgress?.(job);
+                if (job.status === 'done') {
+                    source.close();
+                    resolve(job);
+                } else if (job.status === 'failed') {
+                    source.close();
+                    reject(new Error(job.error));
+                }
+            };
+            source.addEventListener('gone', () => {
+                source.close();
+                reject(new Error('Unknown job'));
             });
         });
     }
 
+    static describeProgress(job) {
+        const p = job.progress || {};
+        if (p.fetched === undefined) {
+            const counts = Object.entries(p).map(([key, value]) => `${value} ${key}`);
+            return counts.length ? `Working... ${counts.join(', ')}` : 'Starting...';
+        }
+        const total = p.total ? ` of ${p.total}` : '';
+        return `Syncing ${p.step || ''}: ${p.fetched}${total} fetched, ${p.inserted || 0} new`;
+    }
+
     static async deleteItem(type, id) {
         if (!confirm(`Are you sure you want to delete this ${type}?`)) return;
         
@@ -181,7 +231,11 @@ class SpotifyManager {
             
             if (data.success) {
                 row.style.transform = 'translateX(100%)';
-                setTimeout(() => row.remove(), 300);
+                setTimeout(() => {
+                    row.remove();
+                    // Virtual lists drop the item from their data as well
+                    document.dispatchEvent(new CustomEvent('itemdeleted', { detail: { type, id } }));
+                }, 300);
                 app.showMessage(data.success, 'success');
             } else {
                 throw new Error(data.error);
@@ -216,9 +270,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // Auto-focus on home page
     document.getElementById('quickSpotifyUrl')?.focus();
     
-    // Initialize search if on browse/artists page
-    SpotifyManager.initSearch('searchInput', '.music-row');
-    SpotifyManager.initSearch('artistSearch', '.artist-card');
+    // Initialize the virtual music list if on browse page
+    SpotifyManager.initBrowse();
     
     // Initialize import page if present
     SpotifyManager.initImport();
@@ -227,12 +280,262 @@ document.addEventListener('DOMContentLoaded', () => {
     SpotifyManager.initArtistModal();
 });
 
+// Renders only the rows of a long list that are scrolled into view. Items are
+// laid out in fixed-height rows of columns() items inside a scrolling container,
+// so the DOM stays the same size whether the list holds 100 or 100k items.
+class VirtualList {
+    constructor(container, { rowHeight, renderRow, columns = () => 1, overscan = 6 }) {
+        this.container = container;
+        this.overscan = overscan;
+        this.items = [];
+        
+        this.spacer = document.createElement('div');
+        this.spacer.style.position = 'relative';
+        this.content = document.createElement('div');
+        this.content.style.cssText = 'position: absolute; top: 0; left: 0; right: 0;';
+        this.spacer.appendChild(this.content);
+        container.appendChild(this.spacer);
+        this.configure({ rowHeight, renderRow, columns });
+        
+        container.addEventListener('scroll', () => this.schedule(), { passive: true });
+        window.addEventListener('resize', () => this.schedule());
+    }
+
+    // Change the row layout, e.g. when switching between grid and list views
+    configure({ rowHeight, renderRow, columns = () => 1 }) {
+        this.rowHeight = rowHeight;
+        this.renderRow = renderRow;
+        this.columns = columns;
+        this.rendered = null;
+        this.schedule();
+    }
+
+    // Replace the items; keepScroll leaves the position alone while pages stream in
+    setItems(items, keepScroll = false) {
+        this.items = items;
+        this.rendered = null;
+        if (!keepScroll) this.container.scrollTop = 0;
+        this.schedule();
+    }
+
+    schedule() {
+        if (this.frame) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+
+    render() {
+        const perRow = Math.max(1, this.columns());
+        const rowCount = Math.ceil(this.items.length / perRow);
+        const top = this.container.scrollTop;
+        const first = Math.max(0, Math.floor(top / this.rowHeight) - this.overscan);
+        const last = Math.min(rowCount, Math.ceil((top + this.container.clientHeight) / this.rowHeight) + this.overscan);
+        
+        const range = `${first}:${last}:${perRow}`;
+        if (range === this.rendered) return;
+        this.rendered = range;
+        
+        this.spacer.style.height = `${rowCount * this.rowHeight}px`;
+        this.content.style.transform = `translateY(${first * this.rowHeight}px)`;
+        const html = [];
+        for (let row = first; row < last; row++) {
+            const start = row * perRow;
+            html.push(`<div style="height: ${this.rowHeight}px">${this.renderRow(this.items.slice(start, start + perRow), start)}</div>`);
+        }
+        this.content.innerHTML = html.join('');
+    }
+}
+
+// Escape text from the API before building row HTML with it
+function escapeHtml(value) {
+    return String(value ?? '').replace(/[&<>"']/g, (c) => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' })[c]);
+}
+
+// Call fn once the calls stop for wait milliseconds
+SpotifyManager.debounce = function(fn, wait = 150) {
+    let timer;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), wait);
+    };
+};
+
+// Genres as a list, whether an item came from the columnar API or a page as a string
+SpotifyManager.genresOf = function(item) {
+    if (Array.isArray(item.genres)) return item.genres;
+    return item.genres ? item.genres.split(', ') : [];
+};
+
+// Turn a columnar /api/items or /api/artists response back into row objects
+SpotifyManager.decodeColumnar = function(data) {
+    const { fields, columns, strings, count } = data;
+    const rows = new Array(count);
+    for (let i = 0; i < count; i++) {
+        const row = {};
+        fields.forEach((field) => {
+            const value = columns[field][i];
+            if (field === 'genres') {
+                row.genres = value.map((genre) => strings.genres[genre]);
+            } else {
+                row[field] = strings[field] && value !== null ? strings[field][value] : value;
+            }
+        });
+        rows[i] = row;
+    }
+    return rows;
+};
+
+// Load every row of a list endpoint in columnar pages; onPage(rows, done) runs as each arrives
+SpotifyManager.loadColumnar = async function(endpoint, onPage, pageSize = 5000) {
+    let cursor = null;
+    do {
+        const params = new URLSearchParams({ format: 'columnar', limit: pageSize });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`${endpoint}${endpoint.includes('?') ? '&' : '?'}${params}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error);
+        cursor = data.next_cursor;
+        onPage(SpotifyManager.decodeColumnar(data), !cursor);
+    } while (cursor);
+};
+
+SpotifyManager.icons = {
+    music: '<svg class="w-3 h-3 mr-1" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 19V6l12-1v13M9 19c0 1.105-1.343 2-3 2s-3-.895-3-2 1.343-2 3-2 3 .895 3 2zm12-3c0 1.105-1.343 2-3 2s-3-.895-3-2 1.343-2 3-2 3 .895 3 2zM9 10l12-1"/></svg>',
+    open: '<svg class="w-4 h-4" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M10 6H6a2 2 0 00-2 2v10a2 2 0 002 2h10a2 2 0 002-2v-4M14 4h6m0 0v6m0-6L10 14"/></svg>',
+    delete: '<svg class="w-4 h-4" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16"/></svg>',
+    person: '<svg class="w-6 h-6 text-white" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M16 7a4 4 0 11-8 0 4 4 0 018 0zM12 14a7 7 0 00-7 7h14a7 7 0 00-7-7z"/></svg>',
+    info: '<svg class="w-4 h-4" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M13 16h-1v-4h-1m1-4h.01M21 12a9 9 0 11-18 0 9 9 0 0118 0z"/></svg>'
+};
+
+// One row of the browse list
+SpotifyManager.renderMusicRow = function(item, filterType) {
+    const genres = SpotifyManager.genresOf(item);
+    const genreLinks = genres.slice(0, 2).map((genre) => `
+        <a href="/browse?type=${filterType}&genre=${encodeURIComponent(genre)}" class="inline-flex items-center px-2 py-1 rounded-md text-xs bg-dark-600 text-gray-300 hover:text-spotify">${escapeHtml(genre)}</a>`).join('');
+    const more = genres.length > 2 ? `<span class="text-xs text-gray-500">+${genres.length - 2}</span>` : '';
+    const label = item.type === 'album' ? 'Album' : 'Track';
+    
+    return `
+        <div class="virtual-row music-row grid grid-cols-12 gap-4 h-full" data-id="${escapeHtml(item.id)}" data-type="${item.type}">
+            <div class="col-span-2"><span class="badge badge-${item.type}">${SpotifyManager.icons.music}${label}</span></div>
+            <div class="col-span-3 truncate font-semibold text-white">
+                <a href="${escapeHtml(item.url)}" target="_blank" class="hover:text-spotify transition-colors" title="${escapeHtml(item.name)}">${escapeHtml(item.name)}</a>
+            </div>
+            <div class="col-span-2 truncate font-medium text-gray-300">${escapeHtml(item.artist_name)}</div>
+            <div class="col-span-1 text-gray-400">${escapeHtml(item.release_year)}</div>
+            <div class="col-span-3 flex items-center gap-1 overflow-hidden">
+                ${genres.length ? genreLinks + more : '<span class="text-gray-500 text-sm">No genres</span>'}
+            </div>
+            <div class="col-span-1 flex items-center justify-end space-x-2">
+                <a href="${escapeHtml(item.url)}" target="_blank" class="text-gray-400 hover:text-spotify transition-colors p-1 rounded">${SpotifyManager.icons.open}</a>
+                <button data-delete class="btn-danger-sm hover:scale-110 transition-transform" title="Delete ${item.type}">${SpotifyManager.icons.delete}</button>
+            </div>
+        </div>`;
+};
+
+// Browse page: keep every item in memory and show the matching ones in a virtual list
+SpotifyManager.initBrowse = function() {
+    const container = document.getElementById('musicList');
+    if (!container) return;
+    
+    const input = document.getElementById('searchInput');
+    const status = document.getElementById('musicStatus');
+    const filterType = container.dataset.type;
+    const embedded = document.getElementById('musicItems');
+    
+    let items = [];
+    let index = [];  // lowercased "title artist genres" per item
+    // Embedded full-text results already match the search box text
+    let term = '';
+    
+    const list = new VirtualList(container, {
+        rowHeight: 57,
+        renderRow: ([item]) => SpotifyManager.renderMusicRow(item, filterType)
+    });
+    
+    const addItems = (rows) => {
+        rows.forEach((item) => {
+            items.push(item);
+            index.push(`${item.name} ${item.artist_name} ${SpotifyManager.genresOf(item).join(', ')}`.toLowerCase());
+        });
+    };
+    
+    const applyFilter = (keepScroll = false) => {
+        const matches = term ? items.filter((item, i) => index[i].includes(term)) : items;
+        list.setItems(matches, keepScroll);
+        status.textContent = term ? `${matches.length} of ${items.length} items match "${term}"` : '';
+    };
+    
+    input?.addEventListener('input', SpotifyManager.debounce(() => {
+        term = input.value.trim().toLowerCase();
+        applyFilter();
+    }));
+    
+    container.addEventListener('click', (e) => {
+        const button = e.target.closest('[data-delete]');
+        if (!button) return;
+        const row = button.closest('.music-row');
+        SpotifyManager.deleteItem(row.dataset.type, row.dataset.id);
+    });
+    
+    document.addEventListener('itemdeleted', (e) => {
+        const position = items.findIndex((item) => item.id === e.detail.id && item.type === e.detail.type);
+        if (position === -1) return;
+        items.splice(position, 1);
+        index.splice(position, 1);
+        applyFilter(true);
+    });
+    
+    if (embedded) {
+        addItems(JSON.parse(embedded.textContent));
+        applyFilter();
+        return;
+    }
+    
+    status.textContent = 'Loading...';
+    SpotifyManager.loadColumnar(container.dataset.endpoint, (rows, done) => {
+        addItems(rows);
+        applyFilter(true);
+        if (!term && !done) status.textContent = `Loaded ${items.length} items...`;
+    }).catch((error) => {
+        status.textContent = `Failed to load items: ${error.message}`;
+    });
+};
+
 // Import page specific functionality
 SpotifyManager.initImport = function() {
         const fileInput = document.getElementById('file');
         const fileName = document.getElementById('fileName');
         const dropZone = document.querySelector('.border-dashed');
         
+        // Follow an import that is already running
+        const importProgress = document.getElementById('importProgress');
+        if (importProgress) {
+            SpotifyManager.watchJob(importProgress.dataset.jobId, (job) => {
+                importProgress.textContent = SpotifyManager.describeProgress(job);
+            }).then((job) => {
+                importProgress.textContent = job.result.message;
+                const errors = job.result.report?.errors || [];
+                if (errors.length) {
+                    // Leave the rejected rows on screen instead of moving on
+                    const list = document.createElement('ul');
+                    list.className = 'mt-2 text-xs text-red-300 space-y-1';
+                    errors.forEach((error) => {
+                        const li = document.createElement('li');
+                        li.textContent = error;
+                        list.appendChild(li);
+                    });
+                    importProgress.appendChild(list);
+                } else {
+                    setTimeout(() => window.location.href = '/browse', 1500);
+                }
+            }).catch((error) => {
+                importProgress.textContent = `Import failed: ${error.message}`;
+            });
+        }
+        
         if (!fileInput || !dropZone) return;
         
         // File selection handler
@@ -345,31 +648,62 @@ window.updateFileName = (input) => {
 window.viewArtistDetails = SpotifyManager.viewArtistDetails;
 window.searchSpotify = SpotifyManager.searchSpotify;
 
+// Start a background job and show its progress until it finishes
+async function runJob(endpoint, errorMessage) {
+    document.getElementById('settingsMenu').classList.add('hidden');
+    
+    let response, data;
+    try {
+        response = await fetch(endpoint, { method: 'POST' });
+        data = await response.json();
+    } catch (error) {
+        app.showMessage(errorMessage, 'error');
+        return null;
+    }
+    return followJob(data, errorMessage);
+}
+
+// Show progress of a job started by a POST until it finishes; resolves to the job or null
+async function followJob(data, errorMessage) {
+    if (!data.job_id) {
+        app.showMessage(data.error, 'error');
+        return null;
+    }
+    
+    const progress = app.showProgress(data.success);
+    try {
+        const job = await SpotifyManager.watchJob(data.job_id, (job) => {
+            progress.update(SpotifyManager.describeProgress(job));
+        });
+        app.showMessage(job.result.message, 'success');
+        return job;
+    } catch (error) {
+        app.showMessage(error.message || errorMessage, 'error');
+        return null;
+    } finally {
+        progress.close();
+    }
+}
+
 // Helper function for sync operations
 async function performSync(endpoint, confirmMessage, successRefresh = false) {
     if (!confirm(confirmMessage)) return;
     
-    try {
-        const response = await fetch(endpoint, { method: 'POST' });
-        const data = await response.json();
-        
-        if (data.success) {
-            app.showMessage(data.success, 'success');
-            if (successRefresh) {
-                setTimeout(() => window.location.reload(), 2000);
-            }
-        } else {
-            app.showMessage(data.error, 'error');
-        }
-        
-        // Close settings menu
-        document.getElementById('settingsMenu').classList.add('hidden');
-    } catch (error) {
-        app.showMessage('Network error during sync', 'error');
-        document.getElementById('settingsMenu').classList.add('hidden');
+    const job = await runJob(endpoint, 'Network error during sync');
+    if (job && successRefresh) {
+        setTimeout(() => window.location.reload(), 2000);
     }
 }
 
+// Export in the background, then download the finished file
+window.exportDatabase = async function(e) {
+    e?.preventDefault();
+    const job = await runJob('/export', 'Network error during export');
+    if (job) {
+        window.location.href = job.result.download_url;
+    }
+};
+
 // Sync all Spotify data
 window.syncAllSpotify = async function() {
     await performSync(
@@ -379,6 +713,15 @@ window.syncAllSpotify = async function() {
     );
 };
 
+// Full resync: re-read the whole library and remove items no longer saved on Spotify
+window.fullResyncSpotify = async function() {
+    await performSync(
+        '/sync-all-spotify?full=1',
+        'This will re-read your WHOLE Spotify library and remove synced albums and tracks you no longer have saved. Continue?',
+        true
+    );
+};
+
 // Sync followed artists from Spotify
 window.syncFollowedArtists = async function() {
     await performSync(
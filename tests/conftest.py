@@ -0,0 +1,84 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SPOTIPY_CLIENT_ID", "test")
+os.environ.setdefault("SPOTIPY_CLIENT_SECRET", "test")
+# Background maintenance would run in the middle of tests
+os.environ["OPTIMIZE_INTERVAL"] = "0"
+os.environ["ANALYZE_INTERVAL"] = "0"
+
+import database
+import metrics
+import spotify_client
+from fake_spotify import Catalog, FakeSpotify
+
+def artist_info(artist_id, name=None, genres=()):
+    """An artist record as stored by database.add_artists."""
+    return {
+        "artist_id": artist_id,
+        "artist_name": name or artist_id,
+        "genres": list(genres),
+        "uri": f"spotify:artist:{artist_id}",
+        "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist_id}"},
+    }
+
+def album_info(album_id, artist_id, year=2000, name=None):
+    """An album record as stored by database.add_albums."""
+    return {
+        "type": "album",
+        "album_id": album_id,
+        "artist_id": artist_id,
+        "album_name": name or album_id,
+        "artist_name": artist_id,
+        "release_year": year,
+        "album_uri": f"spotify:album:{album_id}",
+        "url": f"https://open.spotify.com/album/{album_id}",
+        "artist_info": artist_info(artist_id),
+    }
+
+def track_info(track_id, artist_id, album_id="al0", year=2000, name=None):
+    """A track record as stored by database.add_tracks."""
+    return {
+        "type": "track",
+        "track_id": track_id,
+        "artist_id": artist_id,
+        "album_id": album_id,
+        "track_name": name or track_id,
+        "artist_name": artist_id,
+        "release_year": year,
+        "track_uri": f"spotify:track:{track_id}",
+        "url": f"https://open.spotify.com/track/{track_id}",
+        "artist_info": artist_info(artist_id),
+    }
+
+@pytest.fixture(scope="session", autouse=True)
+def default_db_path(tmp_path_factory):
+    """Keep writes made outside a test's database (e.g. the metrics flush at exit) out of the repository."""
+    database.DB_PATH = str(tmp_path_factory.mktemp("default") / "spotify_manager.db")
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, migrated database in a temporary directory."""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "test.db"))
+    database.create_tables()
+    # Counts left over from earlier tests would be flushed into this database
+    metrics.take()
+    yield database
+    database.close_connections()
+
+@pytest.fixture
+def client(db):
+    """Flask test client on the fresh database."""
+    import app
+    return app.app.test_client()
+
+@pytest.fixture
+def fake_spotify(db, monkeypatch):
+    """A fake Spotify API over a small catalog; clients made with spotify_client.create use it, unthrottled."""
+    catalog = Catalog(artists=5, albums=12, tracks=30, genres=10, prefix="test")
+    with FakeSpotify(catalog) as fake:
+        monkeypatch.setattr(spotify_client, "SPOTIFY_API_URL", fake.url)
+        monkeypatch.setattr(spotify_client, "SPOTIFY_RATE_LIMIT", 0)
+        yield fake
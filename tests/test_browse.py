@@ -0,0 +1,24 @@
+from conftest import album_info, artist_info
+
+def test_search_form_keeps_the_genre(client, db):
+    db.add_artists([artist_info("ar1", genres=["rock"])])
+    
+    page = client.get("/browse", query_string={"genre": "rock", "type": "album"}).get_data(as_text=True)
+    
+    assert '<input type="hidden" name="genre" value="rock">' in page
+    assert '<input type="hidden" name="type" value="album">' in page
+
+def test_search_form_without_genre(client, db):
+    page = client.get("/browse").get_data(as_text=True)
+    
+    assert 'name="genre"' not in page
+
+def test_search_within_a_genre(client, db):
+    db.add_artists([artist_info("ar1", name="Rocker", genres=["rock"]), artist_info("ar2", name="Jazzer", genres=["jazz"])])
+    db.add_albums([album_info("al1", "ar1", name="Blue Night"), album_info("al2", "ar2", name="Blue Moon")])
+    
+    page = client.get("/browse", query_string={"search": "blue", "genre": "rock"}).get_data(as_text=True)
+    
+    assert "Blue Night" in page
+    assert "Blue Moon" not in page
+    assert '<input type="hidden" name="genre" value="rock">' in page
@@ -0,0 +1,70 @@
+import pytest
+import spotify_client
+from fake_spotify import Catalog, FakeSpotify, spotify_id
+
+@pytest.fixture
+def bulk(client, monkeypatch):
+    """A fake Spotify catalog of 30 albums and 60 tracks, used by the app's client."""
+    import app
+    with FakeSpotify(Catalog(artists=5, albums=30, tracks=60, genres=10, prefix="bulk")) as fake:
+        monkeypatch.setattr(spotify_client, "SPOTIFY_API_URL", fake.url)
+        monkeypatch.setattr(spotify_client, "SPOTIFY_RATE_LIMIT", 0)
+        monkeypatch.setattr(app, "sp", spotify_client.create(auth="test"))
+        yield fake
+
+def test_bulk_add_mixed_urls(client, db, bulk):
+    albums, tracks = bulk.catalog.albums, bulk.catalog.tracks
+    missing_track = spotify_id("bulktr", 999)
+    urls = (
+        [f"https://open.spotify.com/album/{album['id']}" for album in albums]
+        + [f"spotify:album:{albums[0]['id']}",
+           f"https://open.spotify.com/intl-de/track/{tracks[0]['id']}?si=abc",
+           f"spotify:track:{tracks[1]['id']}",
+           f"spotify:track:{tracks[1]['id']}",
+           f"https://open.spotify.com/track/{missing_track}",
+           "https://example.com/album/123",
+           "not a url",
+           f"https://open.spotify.com/playlist/{spotify_id('bulkpl', 1)}"]
+    )
+    
+    response = client.post("/add/bulk", json={"urls": urls})
+    
+    assert response.status_code == 200
+    body = response.get_json()
+    results = body["results"]
+    assert [result["url"] for result in results] == urls
+    assert body["success"] == f"Added {len(albums) + 4} of {len(urls)} items"
+    
+    by_url = dict(zip(urls, results))
+    assert by_url[f"spotify:album:{albums[0]['id']}"] == {
+        "url": f"spotify:album:{albums[0]['id']}", "ok": True, "type": "album",
+        "id": albums[0]["id"], "name": albums[0]["name"],
+    }
+    assert by_url[f"spotify:track:{tracks[1]['id']}"]["ok"]
+    assert by_url[f"https://open.spotify.com/track/{missing_track}"] == {
+        "url": f"https://open.spotify.com/track/{missing_track}", "ok": False, "error": "Track not found on Spotify",
+    }
+    assert by_url["https://example.com/album/123"]["error"] == "Not a Spotify URL"
+    assert by_url["not a url"]["error"] == "Not a Spotify URL"
+    assert by_url[urls[-1]]["error"] == "Add playlists one at a time"
+    
+    # Duplicates are stored once
+    assert body["counts"]["Albums"]["inserted"] == len(albums)
+    assert body["counts"]["Tracks"]["inserted"] == 2
+    conn = db.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM Albums").fetchone()[0] == len(albums)
+    assert conn.execute("SELECT COUNT(*) FROM Tracks").fetchone()[0] == 2
+    
+    # 30 albums in two batches of 20, the tracks and the artists in one each, no single lookups
+    assert bulk.paths == {"albums": 2, "tracks": 1, "artists": 1}
+
+def test_bulk_add_form_field(client, db, bulk):
+    track = bulk.catalog.tracks[0]
+    
+    response = client.post("/add/bulk", data={"spotify_urls": f"spotify:track:{track['id']}\nnonsense"})
+    
+    results = response.get_json()["results"]
+    assert [result["ok"] for result in results] == [True, False]
+
+def test_bulk_add_without_urls(client, db):
+    assert client.post("/add/bulk", json={"urls": ["  "]}).status_code == 400
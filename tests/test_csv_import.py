@@ -0,0 +1,45 @@
+import io
+import pytest
+
+CSV = """[Artists]
+id,name,genres,uri,url
+ar1,Artist One,rock,spotify:artist:ar1,
+[Albums]
+id,{album_columns}
+al1,{album_values}
+[Tracks]
+id,{track_columns}
+tr1,{track_values}
+tr2,{track_values}
+"""
+
+def import_csv(db, album_columns, album_values, track_columns, track_values):
+    return db.import_database_csv(io.StringIO(CSV.format(
+        album_columns=album_columns, album_values=album_values,
+        track_columns=track_columns, track_values=track_values,
+    )), chunk_size=1)
+
+def count(db, table):
+    return db.get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+@pytest.mark.parametrize("track_columns, track_values, missing", [
+    ("album_id,name", "al1,Song", "artist_id"),
+    ("artist_id,name", "ar1,Song", "album_id"),
+])
+def test_section_missing_a_required_column_is_rejected(db, track_columns, track_values, missing):
+    report = import_csv(db, "artist_id,name", "ar1,Album", track_columns, track_values)
+    
+    assert report["tables"]["Artists"] == {"accepted": 1, "rejected": 0}
+    assert report["tables"]["Albums"] == {"accepted": 1, "rejected": 0}
+    assert report["tables"]["Tracks"] == {"accepted": 0, "rejected": 2}
+    assert any(f"Tracks section needs id, artist_id, album_id, name columns, missing {missing}" in error
+               for error in report["errors"])
+    assert count(db, "Tracks") == 0
+
+def test_albums_without_artist_column_are_rejected(db):
+    report = import_csv(db, "name", "Album", "artist_id,album_id,name", "ar1,al1,Song")
+    
+    assert report["tables"]["Albums"] == {"accepted": 0, "rejected": 1}
+    assert any("missing artist_id" in error for error in report["errors"])
+    assert count(db, "Albums") == 0
+    assert count(db, "Tracks") == 2
@@ -0,0 +1,33 @@
+import base64
+import json
+import pytest
+
+def token(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+@pytest.mark.parametrize("path, cursor, args", [
+    ("/api/items", ["album", ["a"], "ar1", 2000, "al1"], {}),
+    ("/api/items", ["album", "a", "ar1", {"year": 2000}, "al1"], {}),
+    ("/api/items", ["album", "a", "ar1", 2000, True], {}),
+    ("/api/artists", [["a"], "ar1"], {}),
+    ("/api/artists", ["a", {"id": "ar1"}], {}),
+    ("/api/items", ["album", "a"], {}),
+    ("/api/items", ["artist", "", "", None, ""], {}),
+    ("/api/items", ["track", "a", "ar1", "t", "tr1"], {"type": "album"}),
+    ("/api/items", {"type": "album"}, {}),
+])
+def test_malformed_cursor_is_rejected(client, path, cursor, args):
+    response = client.get(path, query_string={"cursor": token(cursor), **args})
+    
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid cursor"
+
+def test_cursor_round_trip(client, db):
+    from conftest import artist_info
+    db.add_artists([artist_info(f"ar{i}") for i in range(3)])
+    
+    first = client.get("/api/artists", query_string={"limit": 2}).get_json()
+    second = client.get("/api/artists", query_string={"limit": 2, "cursor": first["next_cursor"]}).get_json()
+    
+    assert [row["id"] for row in first["items"] + second["items"]] == ["ar0", "ar1", "ar2"]
+    assert second["next_cursor"] is None
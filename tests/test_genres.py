@@ -0,0 +1,34 @@
+import io
+import database
+from conftest import artist_info
+
+GENRES = ["tab\there", "line\nbreak", "control\x01char", 'quote"d', "back\\slash", "plain"]
+
+def genres_of(db, artist_id):
+    return {row[0] for row in db.get_connection().execute(
+        "SELECT genre FROM ArtistGenres WHERE artist_id = ?", (artist_id,)
+    )}
+
+def test_genres_with_control_characters_are_indexed(db):
+    db.add_artists([artist_info("ar1", genres=GENRES)])
+    assert genres_of(db, "ar1") == set(GENRES)
+    
+    db.add_artists([artist_info("ar1", genres=["new\tgenre", "plain"])])
+    assert genres_of(db, "ar1") == {"new\tgenre", "plain"}
+
+def test_csv_import_with_multi_line_genres(db):
+    report = db.import_database_csv(io.StringIO(
+        '[Artists]\nid,name,genres,uri,url\nar1,Artist,"first\nline, second",spotify:artist:ar1,\n'
+    ))
+    
+    assert report["tables"]["Artists"] == {"accepted": 1, "rejected": 0}
+    assert genres_of(db, "ar1") == {"first\nline", "second"}
+
+def test_genre_index_backfill_with_control_characters(db):
+    db.add_artists([artist_info("ar1", genres=GENRES)])
+    conn = db.get_connection()
+    conn.execute("DROP TABLE ArtistGenres")
+    
+    database._create_schema(conn)
+    
+    assert genres_of(db, "ar1") == set(GENRES)
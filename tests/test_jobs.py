@@ -0,0 +1,37 @@
+import os
+import time
+import jobs
+
+def running_job(db, job_id, worker):
+    db.create_job(job_id, "sync", worker)
+    db.update_job(job_id, status="running")
+
+def test_job_of_this_worker_keeps_running(db):
+    running_job(db, "j1", jobs._process_identity(os.getpid()))
+    
+    assert jobs.get_job("j1")["status"] == "running"
+
+def test_job_of_a_reused_pid_is_failed(db):
+    # Same PID as this process, but recorded by an earlier process that had it
+    boot_id, pid, _ = jobs._process_identity(os.getpid()).split(":")
+    running_job(db, "j1", f"{boot_id}:{pid}:0")
+    
+    job = jobs.get_job("j1")
+    
+    assert job["status"] == "failed"
+    assert job["error"] == "The worker running this job exited"
+
+def test_job_of_an_exited_worker_is_failed(db, monkeypatch):
+    running_job(db, "j1", "gone")
+    monkeypatch.setattr(jobs, "_process_identity", lambda pid: None)
+    
+    assert jobs.get_job("j1")["status"] == "failed"
+
+def test_submitted_job_finishes(db):
+    job_id = jobs.submit("test", lambda progress, n: {"n": n}, 3)
+    deadline = time.monotonic() + 5
+    while jobs.get_job(job_id)["status"] not in jobs.FINISHED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    job = jobs.get_job(job_id)
+    assert (job["status"], job["result"]) == ("done", {"n": 3})
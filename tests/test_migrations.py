@@ -0,0 +1,54 @@
+import sqlite3
+import pytest
+import database
+from conftest import album_info, track_info
+
+CASCADE = "REFERENCES Artists(id) ON DELETE CASCADE\n"
+
+def downgrade_to_baseline(conn):
+    """Put back the artist foreign keys migration 2 replaces."""
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    conn.execute("PRAGMA writable_schema = ON")
+    conn.execute("UPDATE sqlite_master SET sql = replace(sql, ?, ?) WHERE name IN ('Albums', 'Tracks')",
+                 (CASCADE, "REFERENCES Artists(id)\n"))
+    conn.execute(f"PRAGMA schema_version = {schema_version + 1}")
+    conn.execute("PRAGMA writable_schema = OFF")
+    conn.commit()
+
+def add_orphans(conn):
+    """Albums and tracks of a deleted artist, as a database written with foreign keys off has."""
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("INSERT INTO Albums (id, artist_id, name) VALUES ('gone-album', 'gone', 'Orphan')")
+    conn.execute("INSERT INTO Tracks (id, artist_id, album_id, name) VALUES ('gone-track', 'gone', 'gone-album', 'Orphan')")
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = ON")
+
+def test_cascade_migration_removes_orphans(db, caplog):
+    db.add_items([album_info("al1", "ar1"), track_info("tr1", "ar1", "al1")])
+    conn = db.get_connection()
+    downgrade_to_baseline(conn)
+    add_orphans(conn)
+    
+    database._add_cascade_deletes(conn)
+    
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    assert [row[0] for row in conn.execute("SELECT id FROM Albums")] == ["al1"]
+    assert [row[0] for row in conn.execute("SELECT id FROM Tracks")] == ["tr1"]
+    assert "Removed 1 Albums rows" in caplog.text
+    assert all(CASCADE in row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE name IN ('Albums', 'Tracks')"))
+    
+    # The artist's remaining rows now go with it
+    conn.execute("DELETE FROM Artists WHERE id = 'ar1'")
+    assert conn.execute("SELECT COUNT(*) FROM Albums").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM Tracks").fetchone()[0] == 0
+
+def test_cascade_migration_reports_remaining_orphans(db, monkeypatch):
+    conn = db.get_connection()
+    downgrade_to_baseline(conn)
+    add_orphans(conn)
+    monkeypatch.setattr(database, "_delete_orphans", lambda conn, tables: {})
+    
+    with pytest.raises(sqlite3.DatabaseError, match="Albums has 1 rows without an artist"):
+        database._add_cascade_deletes(conn)
+    # Nothing was changed, so the migration runs again next time
+    assert all(CASCADE not in row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE name IN ('Albums', 'Tracks')"))
@@ -0,0 +1,58 @@
+from conftest import album_info, artist_info
+
+def page_through(db, **kwargs):
+    ids, after = [], None
+    while True:
+        items, after = db.get_items_page(after=after, limit=3, **kwargs)
+        ids += [item["id"] for item in items]
+        if after is None:
+            return ids
+
+def test_albums_without_year_are_paged(db):
+    db.add_artists([artist_info("ar1")])
+    db.add_albums(album_info(f"al{i}", "ar1", year=None if i % 2 == 0 else 2000 + i) for i in range(10))
+    
+    ids = page_through(db, item_type="album")
+    
+    assert sorted(ids) == sorted(f"al{i}" for i in range(10))
+    # Albums without a year sort first
+    assert ids[:5] == ["al0", "al2", "al4", "al6", "al8"]
+
+def test_old_cursor_with_null_sort_key(db):
+    db.add_artists([artist_info("ar1")])
+    db.add_albums(album_info(f"al{i}", "ar1", year=None) for i in range(4))
+    
+    items, _ = db.get_items_page("album", after=("album", "ar1", "ar1", None, "al1"), limit=10)
+    
+    assert [item["id"] for item in items] == ["al2", "al3"]
+
+def test_api_items_pages_albums_without_year(client, db):
+    db.add_artists([artist_info("ar1"), artist_info("ar2")])
+    db.add_albums(album_info(f"al{i}", f"ar{i % 2 + 1}", year=None if i < 4 else 1990) for i in range(8))
+    
+    ids, cursor = [], None
+    while True:
+        body = client.get("/api/items", query_string={"type": "album", "limit": 2, **({"cursor": cursor} if cursor else {})}).get_json()
+        ids += [item["id"] for item in body["items"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    
+    assert sorted(ids) == sorted(f"al{i}" for i in range(8))
+
+def test_album_sort_index_is_used(db):
+    plan = " ".join(row["detail"] for row in db.get_connection().execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM Albums a WHERE artist_id = ? ORDER BY COALESCE(a.release_year, -1), id",
+        ("ar1",)
+    ))
+    assert "idx_albums_artist_sort" in plan
+
+def test_api_artists_added_order(client, db):
+    for artist_id in ("b", "c", "a"):
+        db.add_artists([artist_info(artist_id)])
+    db.add_artists([artist_info("c", name="c renamed")])
+    
+    rows = client.get("/api/artists", query_string={"fields": "id,added"}).get_json()["items"]
+    
+    # Name order, but "added" ranks artists by when they were first stored
+    assert [row["id"] for row in sorted(rows, key=lambda row: row["added"], reverse=True)] == ["a", "c", "b"]
@@ -0,0 +1,32 @@
+import os
+import sqlite3
+import database
+from conftest import artist_info
+
+def snapshots(directory):
+    return sorted(name for name in os.listdir(directory) if ".snapshot-" in name)
+
+def test_snapshot_with_relative_db_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_PATH", "relative.db")
+    database.create_tables()
+    import app
+    client = app.app.test_client()
+    try:
+        database.add_artists([artist_info("ar1")])
+        first = client.get("/download_sqlite")
+        assert first.status_code == 200
+        assert len(snapshots(tmp_path)) == 1
+        
+        database.add_artists([artist_info("ar2")])
+        second = client.get("/download_sqlite")
+        assert second.status_code == 200
+        # The older snapshot is replaced, not left behind
+        assert snapshots(tmp_path) == [os.path.basename(database.get_snapshot())]
+        
+        path = tmp_path / "downloaded.db"
+        path.write_bytes(second.data)
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM Artists").fetchone()[0] == 2
+    finally:
+        database.close_connections()
@@ -0,0 +1,123 @@
+import threading
+import time
+import pytest
+from spotipy.exceptions import SpotifyException
+import database
+import metrics
+import spotify_client
+
+def call_stats(method="artist"):
+    """This test's counts for one client method, from the metrics not yet flushed."""
+    return next(stats for stats in spotify_client.get_call_stats(metrics.take()) if stats["endpoint"] == method)
+
+@pytest.fixture
+def sp(fake_spotify):
+    return spotify_client.create(auth="test")
+
+@pytest.fixture
+def artist_id(fake_spotify):
+    return fake_spotify.catalog.artists[0]["id"]
+
+def test_429_is_retried_after_retry_after(sp, fake_spotify, artist_id):
+    fake_spotify.fail_next(1, 429, retry_after=1)
+    fake_spotify.fail_next(1, 429, retry_after=0)
+    
+    start = time.monotonic()
+    assert sp.artist(artist_id)["id"] == artist_id
+    
+    assert time.monotonic() - start >= 1
+    assert fake_spotify.requests == 3
+    stats = call_stats()
+    assert (stats["calls"], stats["throttled"], stats["errors"]) == (3, 2, 2)
+
+def test_retries_stop_at_max_retries(sp, fake_spotify, artist_id, monkeypatch):
+    monkeypatch.setattr(spotify_client, "SPOTIFY_MAX_RETRIES", 2)
+    fake_spotify.fail_next(5, 429, retry_after=0)
+    
+    with pytest.raises(SpotifyException) as error:
+        sp.artist(artist_id)
+    
+    assert error.value.http_status == 429
+    assert fake_spotify.requests == 3
+
+def test_5xx_is_retried_with_exponential_backoff(sp, fake_spotify, artist_id, monkeypatch):
+    monkeypatch.setattr(spotify_client, "BACKOFF_SECONDS", 0.05)
+    fake_spotify.fail_next(1, 503)
+    fake_spotify.fail_next(1, 500)
+    
+    start = time.monotonic()
+    assert sp.artist(artist_id)["id"] == artist_id
+    elapsed = time.monotonic() - start
+    
+    # 0.05 * 2**attempt seconds, each stretched by up to 2x of jitter
+    assert 0.15 <= elapsed < 1
+    assert fake_spotify.requests == 3
+    stats = call_stats()
+    assert (stats["calls"], stats["errors"], stats["throttled"]) == (3, 2, 0)
+
+def test_other_errors_are_not_retried(sp, fake_spotify, artist_id):
+    fake_spotify.fail_next(1, 400)
+    
+    with pytest.raises(SpotifyException):
+        sp.artist(artist_id)
+    
+    assert fake_spotify.requests == 1
+
+def test_retry_after_pauses_the_shared_bucket(fake_spotify, artist_id, monkeypatch):
+    monkeypatch.setattr(spotify_client, "SPOTIFY_RATE_LIMIT", 100)
+    blocked = threading.Event()
+    block_rate_limit = database.block_rate_limit
+    
+    def block_and_signal(name, seconds):
+        block_rate_limit(name, seconds)
+        blocked.set()
+    
+    monkeypatch.setattr(database, "block_rate_limit", block_and_signal)
+    # Two workers' clients drawing from one bucket
+    first, second = spotify_client.create(auth="test"), spotify_client.create(auth="test")
+    fake_spotify.fail_next(1, 429, retry_after=1)
+    
+    throttled = threading.Thread(target=first.artist, args=(artist_id,))
+    throttled.start()
+    assert blocked.wait(5)
+    start = time.monotonic()
+    second.artist(artist_id)
+    waited = time.monotonic() - start
+    throttled.join()
+    
+    # The second client never got the 429, but still waited out the pause
+    assert waited >= 0.8
+    assert fake_spotify.requests == 3
+    assert fake_spotify.throttled == 1
+
+def test_identical_concurrent_reads_are_coalesced(sp, fake_spotify, artist_id):
+    fake_spotify.latency = 0.3
+    callers = 5
+    barrier = threading.Barrier(callers)
+    results = []
+    
+    def call():
+        barrier.wait()
+        results.append(sp.artist(artist_id))
+    
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert [result["id"] for result in results] == [artist_id] * callers
+    assert fake_spotify.requests == 1
+    stats = call_stats()
+    assert (stats["calls"], stats["coalesced"]) == (1, callers - 1)
+
+def test_different_reads_are_not_coalesced(sp, fake_spotify):
+    fake_spotify.latency = 0.1
+    ids = [artist["id"] for artist in fake_spotify.catalog.artists[:3]]
+    threads = [threading.Thread(target=sp.artist, args=(artist_id,)) for artist_id in ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert fake_spotify.requests == 3
@@ -0,0 +1,26 @@
+import pytest
+import spotify_client
+from spotipy.exceptions import SpotifyException
+
+def test_spotify_metrics_from_shared_counters(client, fake_spotify):
+    sp = spotify_client.create(auth="test")
+    artist_id = fake_spotify.catalog.artists[0]["id"]
+    sp.artist(artist_id)
+    sp.artist(artist_id)
+    with pytest.raises(SpotifyException):
+        sp.artist("missing")
+    
+    body = client.get("/api/spotify-metrics").get_json()
+    
+    [artist] = [endpoint for endpoint in body["endpoints"] if endpoint["endpoint"] == "artist"]
+    assert artist["calls"] == 3
+    assert artist["errors"] == 1
+    assert artist["throttled"] == 0
+    assert artist["coalesced"] == 0
+    assert artist["avg_seconds"] > 0
+    assert artist["total_seconds"] == pytest.approx(artist["avg_seconds"] * 3)
+
+def test_api_metrics_table_is_gone(db):
+    assert db.get_connection().execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name = 'ApiMetrics'"
+    ).fetchone()[0] == 0
@@ -0,0 +1,111 @@
+import threading
+import pytest
+import database
+import spotify_client
+import spotify_sync
+from conftest import artist_info
+from fake_spotify import Catalog, FakeSpotify
+
+def test_cleanup_never_sees_window_artists_without_their_items(fake_spotify, monkeypatch):
+    client = spotify_client.create(auth="test")
+    unused = []
+    upsert_rows = database._upsert_rows
+    
+    def count_unused_artists():
+        # What an artist cleanup running right now, on another connection, would delete
+        unused.append(database.get_connection().execute(
+            f"SELECT COUNT(*) FROM Artists ar WHERE {database.UNUSED_ARTIST}"
+        ).fetchone()[0])
+    
+    def upsert_rows_checked(conn, table, columns, rows):
+        if table == "Albums":
+            reader = threading.Thread(target=count_unused_artists)
+            reader.start()
+            reader.join()
+        return upsert_rows(conn, table, columns, rows)
+    
+    monkeypatch.setattr(database, "_upsert_rows", upsert_rows_checked)
+    totals = spotify_sync.sync_saved_albums(client, client, use_cache=False)
+    
+    assert unused and set(unused) == {0}
+    assert totals["inserted"] == len(fake_spotify.catalog.albums)
+    with database.get_connection() as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM Albums a JOIN Artists ar ON ar.id = a.artist_id"
+        ).fetchone()[0] == len(fake_spotify.catalog.albums)
+
+@pytest.fixture
+def library(db, monkeypatch):
+    """A fake Spotify library of 200 saved albums (four pages) by 60 artists."""
+    with FakeSpotify(Catalog(artists=60, albums=200, tracks=1, genres=10, prefix="lib")) as fake:
+        monkeypatch.setattr(spotify_client, "SPOTIFY_API_URL", fake.url)
+        monkeypatch.setattr(spotify_client, "SPOTIFY_RATE_LIMIT", 0)
+        yield fake
+
+def sync_albums(fake, full=False):
+    """Sync the saved albums as user u1. Returns the totals and the Spotify requests made."""
+    sp = spotify_client.create(auth="test")
+    before = fake.requests
+    totals = spotify_sync.sync_saved_albums(sp, sp, user_id="u1", full=full)
+    return totals, fake.requests - before
+
+def test_full_sync_fetches_pages_and_artists_in_batches(library):
+    totals, requests = sync_albums(library)
+    
+    assert totals["inserted"] == 200
+    # Four pages of saved albums and the 60 artists in two multi-get batches
+    assert requests == 6
+
+def album_ids():
+    return {row[0] for row in database.get_connection().execute("SELECT id FROM Albums")}
+
+def test_incremental_sync_reads_one_page(library):
+    sync_albums(library)
+    totals, requests = sync_albums(library)
+    
+    # The first page reaches the checkpoint, so nothing else is read
+    assert requests == 1
+    assert totals["inserted"] == totals["removed"] == 0
+
+def test_incremental_sync_picks_up_new_saves(library):
+    sync_albums(library)
+    newest = library.saved["albums"][0]
+    new_album = {**newest["album"], "id": "libnew0000000000000001"}
+    library.saved["albums"].insert(0, {"added_at": "9999-01-01T00:00:00Z", "album": new_album})
+    
+    totals, requests = sync_albums(library)
+    
+    assert totals["inserted"] == 1
+    assert requests == 1
+    assert "libnew0000000000000001" in album_ids()
+
+def test_full_resync_removes_unsaved_items(library):
+    sync_albums(library)
+    unsaved = [library.saved["albums"].pop(i)["album"]["id"] for i in (150, 80, 10)]
+    
+    incremental, _ = sync_albums(library)
+    assert incremental["removed"] == 0
+    assert set(unsaved) <= album_ids()
+    
+    totals, requests = sync_albums(library, full=True)
+    
+    assert totals["removed"] == 3
+    assert not set(unsaved) & album_ids()
+    assert len(album_ids()) == 197
+    # Artists come from the metadata cache this time, so only the four pages are read
+    assert requests == 4
+
+def test_cleanup_waits_for_writing_jobs(client, db):
+    db.add_artists([artist_info("ar1")])
+    db.create_job("j1", "import")
+    db.update_job("j1", status="running")
+    
+    response = client.post("/cleanup")
+    
+    assert response.status_code == 409
+    assert [row[0] for row in db.get_connection().execute("SELECT id FROM Artists")] == ["ar1"]
+    
+    db.update_job("j1", status="done")
+    response = client.post("/cleanup")
+    
+    assert response.get_json() == {"success": "Removed 1 unused artists"}